@@ -0,0 +1,91 @@
+import os
+import threading
+import pygame
+from collections import OrderedDict
+
+# Asset manager: every image in assets/ decoded once into a single atlas, with an LRU cache of scaled copies
+
+piece_names = {1: "pawn", 2: "knight", 3: "bishop", 5: "rook", 9: "queen", 10: "king"}
+images = ["icon", "board", "bg"]  # in assets/img
+
+
+class Assets:
+    def __init__(self, directory="assets", limit=96):
+        self.limit = limit
+        self.scaled_images = OrderedDict()  # LRU cache: (name, (width, height)) -> pygame.Surface
+        self.lock = threading.Lock()  # guards the cache and the requests between the worker and the main thread
+        self.requests = []  # (name, size) for the worker to scale, see prepare()
+        self.worker = None
+        loaded = {}
+        for colour in ("white", "black"):
+            for piece in piece_names.values():
+                loaded[colour + "_" + piece] = pygame.image.load(os.path.join(directory, "pieces",
+                                                                              colour + "_" + piece + ".png"))
+        for name in images:
+            loaded[name] = pygame.image.load(os.path.join(directory, "img", name + ".png"))
+
+        width = max(image.get_width() for image in loaded.values())
+        self.rects = {}  # name -> its rect in the atlas
+        x, y, shelf = 0, 0, 0
+        for name, image in loaded.items():
+            if x + image.get_width() > width:
+                x, y, shelf = 0, y + shelf, 0
+            self.rects[name] = pygame.Rect(x, y, *image.get_size())
+            x += image.get_width()
+            shelf = max(shelf, image.get_height())
+        self.atlas = pygame.Surface((width, y + shelf), pygame.SRCALPHA)
+        for name, image in loaded.items():
+            # a copy of the pixels, alpha included: blending onto the transparent atlas would darken translucent ones
+            self.atlas.blit(image, self.rects[name], special_flags=pygame.BLEND_RGBA_MAX)
+        self.images = {name: self.atlas.subsurface(rect) for name, rect in self.rects.items()}
+
+    def image(self, name):  # the decoded image, unscaled
+        return self.images[name]
+
+    def scaled(self, name, size):
+        key = (name, (int(size[0]), int(size[1])))
+        with self.lock:
+            surface = self.scaled_images.get(key)
+            if surface is not None:
+                self.scaled_images.move_to_end(key)
+                return surface
+        return self.add(key, pygame.transform.scale(self.images[name], key[1]))
+
+    def add(self, key, surface):
+        with self.lock:
+            self.scaled_images[key] = surface
+            if len(self.scaled_images) > self.limit:
+                self.scaled_images.popitem(last=False)
+        return surface
+
+    def prepare(self, requests):
+        # scale [(name, size)] on the worker thread, replacing the requests not done yet; pygame releases the GIL while
+        # it scales, and finish() is called before the main thread scales again
+        with self.lock:
+            self.requests = [(name, (int(size[0]), int(size[1]))) for name, size in reversed(requests)]
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run_worker, daemon=True)
+                self.worker.start()
+
+    def run_worker(self):
+        while True:
+            with self.lock:
+                if not self.requests:
+                    self.worker = None
+                    return
+                key = self.requests.pop()
+                if key in self.scaled_images:
+                    continue
+            self.add(key, pygame.transform.scale(self.images[key[0]], key[1]))
+
+    def finish(self):  # wait for the worker to scale its requests
+        worker = self.worker
+        if worker is not None:
+            worker.join()
+
+    def pieces(self, codes, size):  # {piece code: graphic} for the pieces of codes, both colours
+        graphics = {}
+        for code in codes:
+            graphics[code] = self.scaled("white_" + piece_names[code], (size, size))
+            graphics[-code] = self.scaled("black_" + piece_names[code], (size, size))
+        return graphics
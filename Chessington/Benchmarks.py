@@ -0,0 +1,310 @@
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from MoveGen import MoveGen, to_coordinates
+from Position import Position
+from MoveTree import MoveTree
+import Zobrist
+import io
+import PGN
+
+# Benchmarks for the data structures behind Chessington's analysis; they need neither pygame nor Enginegton
+# Usage: python Benchmarks.py [--nodes N] [--seed S] [--tree-nodes N] [--games N]
+# memory: bytes per MoveTree node for a tree built from random games, measured with tracemalloc, for the current
+# Position and for the layout it replaced (an instance dict, an 8x8 list board copy and a list move per node)
+# navigation: time to read a position's board back, jumping around the tree or stepping through its lines
+# tree: MoveTree operations on a large tree (--tree-nodes, 100000 by default): adding moves, finding moves that are
+# already in the tree, computing the part tree drawn by the variations UI, and deleting branches
+# scrub: time per step to get the legal moves and board situation while stepping to the end of random games and back
+# (--games / 10 of them), generating them at every step and with MoveTree.legal_moves() caching them per position
+# reclaim: memory before a tree of --tree-nodes positions is built and after all of it has been deleted again, as
+# reported by MoveTree.memory_usage() and by tracemalloc
+# pgn: games/s for writing random games with variations (--games, 1000 by default) to PGN and reading them back, and
+# a check that the trees read back write the same text again
+
+file_names = "abcdefgh"
+piece_names = {1: "", 2: "N", 3: "B", 5: "R", 9: "Q", 10: "K"}
+start_position = [[-5, -2, -3, -9, -10, -3, -2, -5], [-1] * 8] + [[0] * 8 for _ in range(4)] \
+    + [[1] * 8, [5, 2, 3, 9, 10, 3, 2, 5]]  # Board.start_pos(), without importing pygame
+
+
+class LegacyPosition:  # the original Position layout, kept only as the baseline for the memory benchmark
+    def __init__(self, **kwargs):
+        self.turn = kwargs["side_to_move"]
+        self.orientation = kwargs["pl_colour"]
+        self.move = kwargs["move"]
+        self.move_notation = kwargs["move_note"]
+        self.children = []
+        self.parent = None
+        if kwargs["promotion"]:
+            setattr(self, "promotion", True)
+        self.ply = 0
+        self.position = [rank.copy() for rank in kwargs["position"]]  # Board.copy_board
+        self.castling_rights = kwargs["castle"]
+        self.key = 0
+        self.captured = kwargs["material"]
+
+
+def random_games(nodes, seed):
+    # (parent index, position, move, notation, castle, turn, captured, zobrist) for every node of a tree of random games;
+    # each game starts from a random earlier node, so the tree branches like an analysis does
+    rng = random.Random(seed)
+    start = MoveGen(sum(start_position, []), 1, 15)
+    generators = [start]
+    records = []
+    parent = -1
+    while len(records) < nodes:
+        generator = generators[parent + 1]
+        for _ in range(rng.randint(10, 80)):
+            moves = generator.legal_moves()
+            if not moves or len(records) == nodes:
+                break
+            move = rng.choice(moves)
+            origin, destination = to_coordinates(move[0]), to_coordinates(move[1])
+            captured = [generator.squares[move[1]]] if generator.squares[move[1]] else []
+            notation = piece_names[abs(generator.squares[move[0]])] + file_names[destination[1]] + str(8 - destination[0])
+            generator = generator.make(move)
+            squares = generator.squares
+            position = [squares[i:i + 8] for i in range(0, 64, 8)]
+            records.append((parent, position, list(origin + destination), notation, generator.castle,
+                            -generator.turn, captured, Zobrist.full_key(position, generator.turn, generator.castle,
+                                                                        list(origin + destination))))
+            generators.append(generator)
+            parent = len(records) - 1
+        parent = rng.randrange(-1, len(records)) if records else -1
+    return records
+
+
+def build_tree(node_class, records):  # links the nodes the way MoveTree.add_move does
+    root = node_class(side_to_move=1, pl_colour=1, move=[-1, -1, -1, -1], move_note="", promotion=False,
+                      position=start_position, castle=15, material=[])
+    nodes = []
+    for parent_index, position, move, notation, castle, turn, captured, _ in records:
+        parent = root if parent_index == -1 else nodes[parent_index]
+        node = node_class(side_to_move=turn, pl_colour=1, move=move, move_note=notation, promotion=False,
+                          position=position, castle=castle, material=captured)
+        node.key = len(nodes) + 1
+        node.ply = parent.ply + (turn == 1)
+        if node_class is LegacyPosition:
+            node.captured = node.captured + parent.captured
+            node.parent = parent
+            parent.children.append(node)
+        else:
+            node.attach(parent, Position.snapshot_interval)
+        nodes.append(node)
+    return root, nodes
+
+
+def measure(node_class, records):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    tree = build_tree(node_class, records)
+    elapsed = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del tree
+    return used / len(records), 1e6 * elapsed / len(records)
+
+
+def navigation_benchmark(nodes, seed):  # the cost of reading boards back from the tree
+    records = random_games(nodes, seed)
+    root, tree = build_tree(Position, records)
+    for node, record in zip(tree, records):
+        assert node.position == record[1], "a rebuilt board does not match the board that was stored"
+    rng = random.Random(seed)
+    print(f"navigation: snapshot every {Position.snapshot_interval} plies, {Position.decoded_limit} cached boards")
+    tests = (("random jumps", [rng.choice(tree) for _ in range(nodes)]),
+             ("step through lines", tree))
+    for name, order in tests:
+        Position.decoded.clear()
+        start = time.perf_counter()
+        for node in order:
+            node.position
+        print(f"    {name:20} {1e6 * (time.perf_counter() - start) / len(order):>8.2f} us/read")
+
+
+def scrub_benchmark(games, seed):  # stepping through games with the arrow keys: legal moves for every position
+    trees = random_pgn_games(games, seed)
+    lines = [tree.root.line() for tree in trees]
+    steps = 2 * sum(len(line) for line in lines)  # to the end of each game and back
+    print(f"scrub: {games} games, {steps} steps")
+
+    def scrub(cached):
+        for tree in trees:
+            for transposition in tree.transpositions.values():
+                transposition.legal_moves = None
+        start = time.perf_counter()
+        for tree, line in zip(trees, lines):
+            for position in line + line[::-1]:
+                transposition = tree.legal_moves(position)
+                if not cached:
+                    transposition.legal_moves = None
+        print(f"    {'cached' if cached else 'generated every step':20} "
+              f"{1e6 * (time.perf_counter() - start) / steps:>8.2f} us/step")
+    scrub(False)
+    scrub(True)
+
+
+def tree_benchmark(nodes, seed):
+    records = random_games(nodes, seed)
+    rng = random.Random(seed)
+    tree = MoveTree(side_to_move=1, position=start_position, move=[-1, -1, -1, -1], move_note="", promotion=False,
+                    castle=15)
+    print(f"tree: {nodes} nodes")
+
+    def timed(name, count, operation):
+        start = time.perf_counter()
+        operation()
+        print(f"    {name:20} {1e6 * (time.perf_counter() - start) / count:>8.2f} us/op")
+
+    added = []
+
+    def add():
+        for parent_index, position, move, notation, castle, turn, captured, zobrist in records:
+            parent = tree.root if parent_index == -1 else added[parent_index]
+            node = Position(side_to_move=turn, position=position, move=move, move_note=notation, promotion=False,
+                            castle=castle, material=captured, zobrist=zobrist)
+            tree.add_move(node, parent, [])
+            added.append(node if node.parent is not None else tree.find_child(parent, zobrist))
+    timed("add", nodes, add)
+
+    # then every legal move from some of its positions, for wide branching
+    wide = []
+    for position in rng.sample(added, nodes // 100):
+        generator = MoveGen.from_board(position.position, -position.turn, position.castling_rights, position.move)
+        for move in generator.legal_moves():
+            child = generator.make(move)
+            squares = child.squares
+            board = [squares[i:i + 8] for i in range(0, 64, 8)]
+            coordinates = list(to_coordinates(move[0]) + to_coordinates(move[1]))
+            wide.append((position, Position(side_to_move=-child.turn, position=board, move=coordinates, move_note="",
+                                            promotion=False, castle=child.castle, material=[],
+                                            zobrist=Zobrist.full_key(board, child.turn, child.castle, coordinates))))
+
+    def add_wide():
+        for parent, node in wide:
+            tree.add_move(node, parent, [])
+            added.append(node if node.parent is not None else tree.find_child(parent, node.zobrist))
+    timed("add (all moves)", len(wide), add_wide)
+    branching = [len(position.children) for position in [tree.root] + added if len(position.children) > 1]
+    print(f"    {len(branching)} branch points, up to {max(branching)} moves from one position")
+    sample = [rng.randrange(len(added)) for _ in range(nodes // 10)]
+
+    def find():
+        for index in sample:
+            assert tree.find_child(added[index].parent, added[index].zobrist) is added[index]
+    timed("find existing move", len(sample), find)
+    timed("part tree (jumps)", len(sample), lambda: [tree.get_part_tree(added[index].key) for index in sample])
+    line = added[sample[0]].head.line()
+    timed("part tree (steps)", len(line), lambda: [tree.get_part_tree(position.key) for position in line])
+
+    # deepest first, so no branch is deleted after one of its ancestors
+    deleted = sorted({id(added[index]): added[index] for index in sample}.values(),
+                     key=lambda position: -position.depth)
+
+    def delete():
+        for position in deleted:
+            tree.remove_branch(position)
+    timed("delete branch", len(deleted), delete)
+
+
+def reclaim_benchmark(nodes, seed):
+    records = random_games(nodes, seed)
+    tree = MoveTree(side_to_move=1, position=start_position, move=[-1, -1, -1, -1], move_note="", promotion=False,
+                    castle=15)
+    gc.collect()
+    tracemalloc.start()
+    baseline, traced = tree.memory_usage(), tracemalloc.get_traced_memory()[0]
+    added = []
+    for parent_index, position, move, notation, castle, turn, captured, zobrist in records:
+        parent = tree.root if parent_index == -1 else added[parent_index]
+        node = Position(side_to_move=turn, position=position, move=move, move_note=notation, promotion=False,
+                        castle=castle, material=captured, zobrist=zobrist)
+        tree.add_move(node, parent, [])
+        added.append(node if node.parent is not None else tree.find_child(parent, zobrist))
+    full = tree.memory_usage()
+    del added, node, parent
+    for child in list(tree.root.children):
+        tree.remove_branch(child)
+    del child
+    gc.collect()
+    after, traced_after = tree.memory_usage(), tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"reclaim: {nodes} nodes")
+    print(f"    MoveTree.memory_usage() {baseline} bytes -> {full} bytes -> {after} bytes after deleting them")
+    print(f"    tracemalloc             {traced_after - traced:+} bytes after deleting them")
+
+
+def random_pgn_games(games, seed):  # MoveTrees of random games, with a few variations each
+    rng = random.Random(seed)
+    trees = []
+    for _ in range(games):
+        tree = MoveTree(side_to_move=1, position=start_position, move=[-1, -1, -1, -1], move_note="",
+                        promotion=False, castle=15)
+        line = [(tree.root, MoveGen(sum(start_position, []), 1, 15))]
+        for branch in range(rng.randint(1, 4)):
+            current = line[0] if branch == 0 else rng.choice(line)
+            for _ in range(rng.randint(20, 120) if branch == 0 else rng.randint(1, 20)):
+                moves = current[1].legal_moves()
+                if not moves:
+                    break
+                current = PGN.play(tree, current[0], current[1], rng.choice(moves))
+                if branch == 0:
+                    line.append(current)
+        trees.append(tree)
+    return trees
+
+
+def pgn_benchmark(games, seed):
+    trees = random_pgn_games(games, seed)
+    positions = sum(len(tree.position_lookup) for tree in trees)
+    print(f"pgn: {games} games, {positions} positions")
+    stream = io.StringIO()
+    start = time.perf_counter()
+    for number, tree in enumerate(trees):
+        PGN.write_game(stream, tree, {"Round": str(number + 1)})
+    elapsed = time.perf_counter() - start
+    print(f"    {'write':20} {games / elapsed:>8.0f} games/s")
+    text = stream.getvalue()
+    start = time.perf_counter()
+    read = list(PGN.read_games(io.StringIO(text)))
+    elapsed = time.perf_counter() - start
+    print(f"    {'read':20} {games / elapsed:>8.0f} games/s {len(text) / elapsed / 1e6:>8.2f} MB/s")
+    again = io.StringIO()
+    for tags, tree in read:
+        PGN.write_game(again, tree, tags)
+    assert again.getvalue() == text, "games read back from PGN do not write the same PGN"
+    assert sum(len(tree.position_lookup) for _, tree in read) == positions
+
+
+def memory_benchmark(nodes, seed):
+    records = random_games(nodes, seed)
+    print(f"memory: {nodes} nodes")
+    results = {}
+    for name, node_class in (("legacy", LegacyPosition), ("current", Position)):
+        per_node, build_us = measure(node_class, records)
+        results[name] = per_node
+        print(f"    {name:8} {per_node:>8.0f} bytes/node {build_us:>8.2f} us/node")
+    print(f"    saving   {1 - results['current'] / results['legacy']:>8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for Chessington's analysis data structures")
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tree-nodes", type=int, default=100000)
+    parser.add_argument("--games", type=int, default=1000)
+    args = parser.parse_args()
+    memory_benchmark(args.nodes, args.seed)
+    navigation_benchmark(args.nodes, args.seed)
+    tree_benchmark(args.tree_nodes, args.seed)
+    scrub_benchmark(args.games // 10, args.seed)
+    reclaim_benchmark(args.tree_nodes, args.seed)
+    pgn_benchmark(args.games, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,14 @@ import pygame
 from Position import *
 from Event import *
 from Buttons import Button
+import Zobrist
 from collections import Counter
 
 
 class MoveGraphic:  # if the user requested engine move in Analysis, this will add circle shapes to mark the engine move
-    def __init__(self, origin, destination, sqr_size):
+    def __init__(self, origin, destination, sqr_size, orientation):
         self.sqrs = (origin, destination)
+        origin, destination = Board.view_square(origin, orientation), Board.view_square(destination, orientation)
         self.origin = (origin[1] * sqr_size + (sqr_size // 2), origin[0] * sqr_size + (sqr_size // 2))
         self.destination = (destination[1] * sqr_size + (sqr_size // 2), destination[0] * sqr_size + (sqr_size // 2))
         self.radius = sqr_size // 2
@@ -17,16 +19,16 @@ class MoveGraphic:  # if the user requested engine move in Analysis, this will a
         pygame.draw.circle(window_data.window, (127, 23, 52), self.origin, self.radius, width=self.width)
         pygame.draw.circle(window_data.window, (127, 23, 52), self.destination, self.radius, width=self.width)
 
-    def sqrs_to_list(self):  # convert sqrs tuple to list
-        return list(self.sqrs[0]) + list(self.sqrs[1])
-
 
 # The Board instance draws the position and the material difference,
 # manages piece moving (its user interface and visuals), and processes a move (spawning the new Position instance,
 # defining the chess notation for the move)
+# The position, and every square Board works with, are in the canonical frame, with White at the bottom; the user's
+# orientation is applied by view_square() only where squares meet the screen, in drawing and in reading the mouse
 class Board:
-    def __init__(self, graphics, board):
+    def __init__(self, graphics, board, min_graphics):
         self.position = []
+        self.orientation = 1  # 1 if White is at the bottom of the screen, -1 if Black is
         self.editor_position = []
         self.promotion_dict = {1: 2, 2: 3, 3: 5, 4: 9}
         self.file_dict = {0: "a", 1: "b", 2: "c", 3: "d", 4: "e", 5: "f", 6: "g", 7: "h"}
@@ -38,10 +40,11 @@ class Board:
         self.sqr_under_mouse = None
         self.move_graphic = None
         self.piece_graphics = graphics
-        self.min_piece_graphics = {key: pygame.transform.scale(
-            graphic, (graphic.get_width() * 0.6, graphic.get_height() * 0.6)) for key, graphic in graphics.items()}
+        self.min_piece_graphics = min_graphics  # the captured pieces, 0.6 squares wide
         self.board_graphic = board
         self.board_situation = 0  # designates check, stalemate or checkmate : 1: check, 2: checkmate, 3: stalemate
+        self.layer = None  # the board as draw_pos() last composited it, see compose_layer()
+        self.layer_key = None  # what the layer was composited from
         self.captured = []
 
     def game_update(self, window_data, user_input, **kwargs):
@@ -51,6 +54,8 @@ class Board:
         mouse_file = user_input.position[0] // window_data.sqr_size
 
         cursor_over = 0 <= mouse_rank < 8 and 0 <= mouse_file < 8
+        if cursor_over:
+            mouse_rank, mouse_file = self.view_square((mouse_rank, mouse_file), self.orientation)
 
         if cursor_over:
             if user_input.left_click and not self.dragging and self.position[mouse_rank][mouse_file] != 0 \
@@ -93,6 +98,8 @@ class Board:
         mouse_file = user_input.position[0] // window_data.sqr_size
 
         cursor_over = 0 <= mouse_rank < 8 and 0 <= mouse_file < 8
+        if cursor_over:
+            mouse_rank, mouse_file = self.view_square((mouse_rank, mouse_file), self.orientation)
 
         if user_input.left_click and self.selected_piece is not None:
             window_data.window.blit(self.piece_graphics[self.selected_piece],
@@ -126,12 +133,16 @@ class Board:
 
     def process_move(self, piece, origin, destination, **kwargs):
 
-        orient = kwargs["pl_colour"]
         notation = self.get_notation(piece, origin, destination, **kwargs)
 
         cap_piece = self.position[destination[0]][destination[1]]
         captured = []
 
+        # the Zobrist key is updated with every change this function makes to the board
+        key = kwargs["zobrist"] ^ Zobrist.black_to_move ^ Zobrist.piece_key(piece, origin[0], origin[1])
+        if cap_piece != 0:
+            key ^= Zobrist.piece_key(cap_piece, destination[0], destination[1])
+
         if cap_piece == 9 or cap_piece == -9:
             captured.append(1 * -kwargs["turn"]) if self.piece_count[cap_piece] > 1 else captured.append(cap_piece)
             self.piece_count[cap_piece] -= 1
@@ -144,53 +155,38 @@ class Board:
         self.position[origin[0]][origin[1]] = 0
 
         if (piece == 10 or piece == -10) and (abs(origin[1] - destination[1]) > 1):
-            notation = self.castle((origin[1] == 4 and orient == 1 and destination[1] > origin[1])
-                                   or (origin[1] == 3 and orient == -1 and destination[1] < origin[1]),
-                                   piece, origin, orient)
+            notation = self.castle(destination[1] > origin[1], piece, origin)
+            rook_files = (7, origin[1] + 1) if destination[1] > origin[1] else (0, origin[1] - 1)
+            for file in rook_files:
+                key ^= Zobrist.piece_key(50 // piece, origin[0], file)
 
         elif (piece == 1 or piece == -1) and destination[1] != origin[1] \
                 and cap_piece == 0:
             captured.append(-piece)
             self.en_passant(origin, destination)
+            key ^= Zobrist.piece_key(-piece, origin[0], destination[1])
 
-        # Updating castling rights; this has been the most error-prone part of this method's code,
-        # so I lay out the logic of this update as much as possible
+        # Updating castling rights the way MoveGen.make() does, so a position reached here and one built from PGN hash
+        # the same: a king move loses both of its side's rights, and a move from or to a corner loses the right of the
+        # rook that starts there
         black_c = kwargs["castle"] % 4
         white_c = (kwargs["castle"] - black_c) >> 2
         # at the end of this function, the Position constructor is passed castling rights' value as int in range 0-15,
         # corresponding to all 16 possible combinations of castling rights of both sides
 
-        if white_c > 0:
-            if (piece == 5 and origin[1] == 7 and orient == 1) or (piece == 5 and origin[1] == 0 and orient == -1):
-                white_c -= 2
-            if (piece == 5 and origin[1] == 0 and orient == 1) or (piece == 5 and origin[1] == 7 and orient == -1):
-                white_c -= 1
-            if piece == 10:
-                white_c = 0
-
-        if black_c > 0:
-            if (piece == -5 and origin[1] == 7 and orient == 1) or (piece == -5 and origin[1] == 0 and orient == -1):
-                black_c -= 2
-            if (piece == -5 and origin[1] == 0 and orient == 1) or (piece == -5 and origin[1] == 7 and orient == -1):
-                black_c -= 1
-            if piece == -10:
-                black_c = 0
-
-        if cap_piece == 5 and white_c > 0:
-            if (destination[1] == 7 and orient == 1) or (destination[1] == 0 and orient == -1):
-                white_c -= 2
-            elif (destination[1] == 0 and orient == 1) or (destination[1] == 7 and orient == -1):
-                white_c -= 1
-        elif cap_piece == -5 and black_c > 0:
-            if (destination[1] == 7 and orient == 1) or (destination[1] == 0 and orient == -1):
-                black_c -= 2
-            elif (destination[1] == 0 and orient == 1) or (destination[1] == 7 and orient == -1):
-                black_c -= 1
-
-        if white_c < 0:
+        if piece == 10:
             white_c = 0
-        if black_c < 0:
+        elif piece == -10:
             black_c = 0
+        for square in (tuple(origin), tuple(destination)):
+            if square == (7, 7):
+                white_c &= ~2
+            elif square == (7, 0):
+                white_c &= ~1
+            elif square == (0, 7):
+                black_c &= ~2
+            elif square == (0, 0):
+                black_c &= ~1
 
         if "engine_promo" in kwargs:
             piece = self.promotion_dict[kwargs["engine_promo"]] * kwargs["turn"]
@@ -198,19 +194,28 @@ class Board:
 
         self.position[destination[0]][destination[1]] = piece
 
-        return Position(side_to_move=kwargs["turn"], pl_colour=orient, position=self.copy_board(self.position),
-                        move=[origin[0], origin[1], destination[0], destination[1]], move_note=notation,
+        move = [origin[0], origin[1], destination[0], destination[1]]
+        key ^= Zobrist.piece_key(piece, destination[0], destination[1])
+        key ^= Zobrist.castling[kwargs["castle"]] ^ Zobrist.castling[(white_c << 2) + black_c]
+        if kwargs["en_passant"] != -1:
+            key ^= Zobrist.en_passant[kwargs["en_passant"]]
+        en_passant = Zobrist.en_passant_file(self.position, move)
+        if en_passant != -1:
+            key ^= Zobrist.en_passant[en_passant]
+
+        return Position(side_to_move=kwargs["turn"], position=self.position,
+                        move=move, move_note=notation, zobrist=key,
                         castle=(white_c << 2) + black_c,
                         promotion=(piece == 1 or piece == -1) and (destination[0] == 0 or destination[0] == 7),
                         material=captured)
 
-    def castle(self, short, piece, origin, player_colour):
+    def castle(self, short, piece, origin):
 
         notation = "0-0" if short else "0-0-0"
-        if (short and player_colour == 1) or (not short and player_colour == -1):
+        if short:
             self.position[origin[0]][origin[1] + 1] = 50 // piece
             self.position[origin[0]][7] = 0
-        elif (short and player_colour == -1) or (not short and player_colour == 1):
+        else:
             self.position[origin[0]][origin[1] - 1] = 50 // piece
             self.position[origin[0]][0] = 0
         return notation
@@ -236,10 +241,7 @@ class Board:
                 notation += pawn_file + "x"
             else:
                 notation += "x"
-        if kwargs["pl_colour"] == 1:
-            notation += self.file_dict[destination[1]] + str(9 - (destination[0] + 1))
-        else:
-            notation += self.file_dict[destination[1]] + str((destination[0] + 1))
+        notation += self.file_dict[destination[1]] + str(8 - destination[0])
         return notation
 
     @staticmethod
@@ -267,8 +269,7 @@ class Board:
                 if origin[1] != move[1]:
                     return self.file_dict[origin[1]]
                 if origin[0] != move[0]:
-                    txt = str(9 - (origin[0] + 1)) if kwargs["pl_colour"] == 1 else str((origin[0] + 1))
-                    return txt
+                    return str(8 - origin[0])
         return ""
 
     def clear_pos(self):
@@ -277,74 +278,99 @@ class Board:
     def is_empty(self):
         return not any(self.position[rank][file] != 0 for rank in range(8) for file in range(8))
 
-    def flip_file_notation(self, sqr_size):
-        new = {}
-        for key, value in self.file_dict.items():
-            new[abs(key - 7)] = value
-        self.file_dict = new
+    def set_orientation(self, orientation, sqr_size):  # flipping the board only changes how squares are viewed
+        self.orientation = orientation
         if self.move_graphic is not None:
-            move = self.move_graphic.sqrs_to_list()
-            Position.reverse_move(move)
-            self.move_graphic = MoveGraphic((move[0], move[1]), (move[2], move[3]), sqr_size)
+            self.move_graphic = MoveGraphic(self.move_graphic.sqrs[0], self.move_graphic.sqrs[1], sqr_size, orientation)
 
-    def draw_pos(self, window_data, **kwargs):  # draws the board
+    @staticmethod
+    def view_square(square, orientation):  # canonical (rank, file) <-> (row, column) on screen; its own inverse
+        if orientation == 1:
+            return square[0], square[1]
+        return 7 - square[0], 7 - square[1]
+
+    def draw_pos(self, window_data, **kwargs):  # draws the board, where it is repainted in this frame
 
         w = window_data.sqr_size
-        font = pygame.font.SysFont("Futura", w // 4)
-        turn = 1 if "turn" not in kwargs else kwargs["turn"]
-        window_data.window.blit(self.board_graphic, (0, 0))
         self.draw_material_imbalance(window_data)
+        if not window_data.visible((0, 0, 8 * w, 8 * w)):
+            return
+        turn = 1 if "turn" not in kwargs else kwargs["turn"]
+        move = tuple(kwargs["move"]) if kwargs.get("move") else None
+        key = (tuple(map(tuple, self.position)), self.board_situation, turn, move, self.orientation, w)
+        if key != self.layer_key:
+            self.layer = self.compose_layer(w, turn, move)
+            self.layer_key = key
+        window_data.window.blit(self.layer, (0, 0))
+
+        if self.sqr_under_mouse is not None and self.selected_piece is not None:
+            rank, file = self.sqr_under_mouse
+            row, col = self.view_square(self.sqr_under_mouse, self.orientation)
+            square_rect = pygame.Rect(col * w, row * w, w, w)
+            if self.origin_square is None:
+                pygame.draw.rect(window_data.window, (0, 0, 0), square_rect, 3)
+            elif self.position[rank][file] == 0 \
+                    and not (abs(self.selected_piece == 1) and file != self.origin_square[1]):
+                pygame.draw.rect(window_data.window, (0, 0, 0), square_rect, 3)
+            else:
+                pygame.draw.rect(window_data.window, (127, 23, 52), square_rect, 3)
 
-        for rank in range(8):
-            for file in range(8):
+        if self.move_graphic is not None:
+            self.move_graphic.draw(window_data)
+
+    def compose_layer(self, w, turn, move):
+        # the board graphic, the check, mate and stalemate highlights, the pieces at rest, the coordinates and the last
+        # move, composited once for as long as none of them changes; draw_pos() only adds what follows the mouse
+        layer = pygame.Surface(self.board_graphic.get_size())  # in the display's pixel format
+        layer.blit(self.board_graphic, (0, 0))
+        font = Button.get_font(w // 4)
+        for row in range(8):
+            for col in range(8):
+                rank, file = self.view_square((row, col), self.orientation)  # the square drawn at (row, col)
+                square_rect = pygame.Rect(col * w, row * w, w, w)
                 if self.board_situation > 0:
                     # draw check
                     if (self.position[rank][file] == 10 and turn == 1 and self.board_situation == 1) \
                             or (self.position[rank][file] == -10 and turn == -1 and self.board_situation == 1):
-                        pygame.draw.rect(window_data.window, (127, 23, 52), pygame.Rect(file * w, rank * w, w, w), 6)
+                        pygame.draw.rect(layer, (127, 23, 52), square_rect, 6)
                     # draw checkmate
                     if (self.position[rank][file] == 10 and turn == 1 and self.board_situation == 2) \
                             or (self.position[rank][file] == -10 and turn == -1 and self.board_situation == 2):
-                        pygame.draw.rect(window_data.window, (127, 23, 52), pygame.Rect(file * w, rank * w, w, w))
+                        pygame.draw.rect(layer, (127, 23, 52), square_rect)
                     # draw stalemate
                     if ((self.position[rank][file] == 10 or self.position[rank][file] == -10)
                             and self.board_situation == 3):
-                        pygame.draw.rect(window_data.window, (35, 35, 35), pygame.Rect(file * w, rank * w, w, w))
+                        pygame.draw.rect(layer, (35, 35, 35), square_rect)
 
                 if self.position[rank][file] != 0:
-                    window_data.window.blit(self.piece_graphics[self.position[rank][file]], (file * w, rank * w))
+                    layer.blit(self.piece_graphics[self.position[rank][file]], (col * w, row * w))
 
                 # draw notation on the board:
-                orientation = 1 if "orientation" not in kwargs else kwargs["orientation"]
-                if rank == 7:
-                    x_pos = file * w if orientation == 1 else file * w + w - font.size(self.file_dict[file])[0]
-                    Button.draw_text(window_data, self.file_dict[file], font, (0, 0, 0), x_pos,
-                                     rank * w + w - font.size(self.file_dict[file])[1])
-                if (file == 0 and orientation == 1) or (file == 7 and orientation == -1):
-                    x_pos = file * w if orientation == 1 else file * w + w - font.size(str(8 - rank))[0]
-                    order = 8 - rank if orientation == 1 else rank + 1
-                    Button.draw_text(window_data, str(order), font, (0, 0, 0), x_pos, rank * w)
-
-                if "move" in kwargs:
-                    if kwargs["move"]:
-                        if rank == kwargs["move"][0] and file == kwargs["move"][1]:
-                            pygame.draw.rect(window_data.window, (0, 0, 0), pygame.Rect(file * w, rank * w, w, w), 1)
-                        if rank == kwargs["move"][2] and file == kwargs["move"][3]:
-                            pygame.draw.rect(window_data.window, (0, 0, 0), pygame.Rect(file * w, rank * w, w, w), 2)
-
-                if self.sqr_under_mouse is None or self.selected_piece is None:
-                    continue
-                if (rank, file) == self.sqr_under_mouse:
-                    if self.origin_square is None:
-                        pygame.draw.rect(window_data.window, (0, 0, 0), pygame.Rect(file * w, rank * w, w, w), 3)
-                    elif self.position[rank][file] == 0 \
-                            and not (abs(self.selected_piece == 1) and file != self.origin_square[1]):
-                        pygame.draw.rect(window_data.window, (0, 0, 0), pygame.Rect(file * w, rank * w, w, w), 3)
-                    else:
-                        pygame.draw.rect(window_data.window, (127, 23, 52), pygame.Rect(file * w, rank * w, w, w), 3)
-
-        if self.move_graphic is not None:
-            self.move_graphic.draw(window_data)
+                if row == 7:
+                    label = Button.render(self.file_dict[file], font, (0, 0, 0))
+                    x_pos = col * w if self.orientation == 1 else col * w + w - label.get_width()
+                    layer.blit(label, (x_pos, row * w + w - label.get_height()))
+                if (col == 0 and self.orientation == 1) or (col == 7 and self.orientation == -1):
+                    label = Button.render(str(8 - rank), font, (0, 0, 0))
+                    x_pos = col * w if self.orientation == 1 else col * w + w - label.get_width()
+                    layer.blit(label, (x_pos, row * w))
+
+                if move is not None:
+                    if rank == move[0] and file == move[1]:
+                        pygame.draw.rect(layer, (0, 0, 0), square_rect, 1)
+                    if rank == move[2] and file == move[3]:
+                        pygame.draw.rect(layer, (0, 0, 0), square_rect, 2)
+        return layer
+
+    def view_state(self):  # what draw_pos() draws that game_update() and editor_update() change, after it has drawn
+        return tuple(map(tuple, self.position)), self.selected_piece, self.origin_square, self.sqr_under_mouse
+
+    def drag_damage(self, window_data, last_position, position):
+        # while a piece is selected, the squares around the mouse change as it moves: the dragged piece is drawn
+        # centred on the mouse, and the square under it is highlighted
+        w = window_data.sqr_size
+        for x, y in (last_position, position):
+            window_data.invalidate((x - w, y - w, 2 * w, 2 * w))
 
     def draw_material_imbalance(self, window_data):
 
@@ -375,28 +401,27 @@ class Board:
             self.board_situation = 0
             self.captured.clear()
 
-    def set_board(self, pos):
-        self.set_pos(pos.position)
+    def set_board(self, pos):  # Position.position decodes a fresh list, so it does not need copying
+        self.position = pos.position
+        self.count_pieces()
         self.captured = pos.captured
 
     def set_pos(self, pos):
         self.position = self.copy_board(pos)
+        self.count_pieces()
+
+    def count_pieces(self):
         counts = Counter(element for row in self.position for element in row)
         self.piece_count = {key: counts.get(key, 0) for key in [2, -2, 3, -3, 5, -5, 9, -9]}
 
-    def redraw(self, graphics, board, sqr_size):  # called when application resizes
+    def redraw(self, graphics, board, min_graphics, sqr_size):  # called when application resizes
         self.piece_graphics = graphics
-        self.min_piece_graphics = {key: pygame.transform.scale(
-            graphic, (graphic.get_width() * 0.6, graphic.get_height() * 0.6)) for key, graphic in graphics.items()}
+        self.min_piece_graphics = min_graphics
         self.board_graphic = board
+        self.layer_key = None  # composited from the old graphics
         if self.move_graphic is not None:
-            self.move_graphic = MoveGraphic(self.move_graphic.sqrs[0], self.move_graphic.sqrs[1], sqr_size)
-
-    @staticmethod
-    def flip(pos):
-        for rank in range(8):
-            pos[rank].reverse()
-        pos.reverse()
+            self.move_graphic = MoveGraphic(self.move_graphic.sqrs[0], self.move_graphic.sqrs[1], sqr_size,
+                                            self.orientation)
 
     @staticmethod
     def start_pos():
@@ -1,9 +1,15 @@
 import pygame
 import time
+from collections import OrderedDict
 from Event import *
 
 
+# Fonts are kept by size and rendered text in an LRU cache, shared by every button and label
 class Button:
+    fonts = {}  # (name, size) -> pygame.font.Font
+    rendered = OrderedDict()  # LRU cache of text surfaces: (text, font, colour) -> pygame.Surface
+    rendered_limit = 2048
+
     def __init__(self, x, y, display, font, font_colour, ID, **event_data):
         self.event_ID = ID
         self.event_data = event_data
@@ -16,13 +22,39 @@ class Button:
             self.rect = pygame.Rect(x, y, self.to_display.get_size()[0], self.to_display.get_size()[1])
         self.clock = time.time()  # for button cooldown
 
+    @staticmethod
+    def get_font(size, name="Futura"):
+        font = Button.fonts.get((name, size))
+        if font is None:
+            font = Button.fonts[(name, size)] = pygame.font.SysFont(name, size)
+        return font
+
+    @staticmethod
+    def render(text, font, text_col):
+        key = (text, font, tuple(text_col))
+        img = Button.rendered.get(key)
+        if img is not None:
+            Button.rendered.move_to_end(key)
+            return img
+        img = Button.rendered[key] = font.render(text, True, text_col)
+        if len(Button.rendered) > Button.rendered_limit:
+            Button.rendered.popitem(last=False)
+        return img
+
+    @staticmethod
+    def clear_caches():  # the window was resized
+        Button.fonts.clear()
+        Button.rendered.clear()
+
     @staticmethod
     def draw_text(window_data, text, font, text_col, x, y):
-        img = font.render(text, True, text_col)
-        window_data.window.blit(img, (x, y))
+        img = Button.render(text, font, text_col)
+        if window_data.visible((x, y, img.get_width(), img.get_height())):
+            window_data.window.blit(img, (x, y))
 
     def update(self, window_data, user_input, event_list):
 
+        window_data.hover_rects.append(self.rect.copy())
         mouse_collides = self.rect.collidepoint(user_input.position)
 
         if user_input.left_click and mouse_collides and time.time() - self.clock >= 0.6 and not user_input.dragging:
@@ -50,17 +82,22 @@ class Dropdown(Button):
 
     def update_dropdown(self, window_data, user_input, event_list):
 
+        window_data.hover_rects.append(self.rect.copy())
         mouse_collides = self.rect.collidepoint(user_input.position)
+        was_open = self.dropdown_rect is not None
 
         if mouse_collides and not user_input.dragging:
             self.get_dropdown(window_data.sqr_size)
 
         if self.dropdown_rect is not None and self.dropdown_rect.collidepoint(user_input.position):
+            window_data.hover_rects.append(self.dropdown_rect.copy())
             for btn in self.buttons:
                 btn.update(window_data, user_input, event_list)
             pygame.draw.rect(window_data.window, (127, 23, 52), self.rect)
         else:
             self.dropdown_rect = None
+        if was_open != (self.dropdown_rect is not None):
+            window_data.invalidate()  # the list opened over, or closed from over, the rest of the window
 
         if type(self.to_display) == str:
             self.draw_text(window_data, self.to_display, self.font, self.font_colour, self.rect.x, self.rect.y)
@@ -86,6 +123,7 @@ class ToggleButton(Button):
 
     def update_toggle(self, window_data, user_input, event_list):
 
+        window_data.hover_rects.append(self.rect.copy())
         mouse_collides = self.rect.collidepoint(user_input.position)
 
         if self.on == 1 or (mouse_collides and not user_input.dragging):
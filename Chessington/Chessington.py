@@ -1,8 +1,15 @@
 from UI_Types import *
 from Game import *
-import ctypes
+from EngineClient import *
 import sys
-import multiprocessing
+import collections
+import Zobrist
+import Session
+import Journal
+import OpeningBook
+import EngineCache
+import Explorer
+from Assets import Assets
 
 
 # Wrapper class for mouse presses and position, and arrow keys
@@ -14,8 +21,12 @@ class Input:
         self.arrow_press = 0
         self.dragging = dragging
         self.wheel = None
+        self.last_position = pos  # the mouse position in the previous frame
+        self.changed = True  # whether a button, key or the wheel changed state since the previous frame
 
     def update(self, dragging, wheel):
+        previous = (self.left_click, self.right_click, self.arrow_press)
+        self.last_position = self.position
         self.position = pygame.mouse.get_pos()
         self.left_click = pygame.mouse.get_pressed()[0]
         self.right_click = pygame.mouse.get_pressed()[2]
@@ -23,12 +34,13 @@ class Input:
         self.wheel = wheel
         k_press = pygame.key.get_pressed()
         self.arrow_press = -1 if k_press[pygame.K_LEFT] else 1 if k_press[pygame.K_RIGHT] else 0
+        self.changed = (self.left_click, self.right_click, self.arrow_press) != previous or wheel is not None
 
     def any_click(self):
         return self.left_click or self.right_click
 
 
-# Wrapper class for pygame window and app dimensions
+# Wrapper class for pygame window and app dimensions, and for the regions of the window to repaint each frame
 class WindowData:
     def __init__(self, dimensions):
         self.width = dimensions[0]
@@ -36,6 +48,32 @@ class WindowData:
         self.sqr_size = dimensions[2]
         self.side_margin_size = dimensions[3]
         self.window = pygame.display.set_mode((self.width, self.height), pygame.RESIZABLE)
+        self.dirty = [self.window.get_rect()]  # regions to repaint at the next frame
+        self.repainting = []  # regions repainted in this frame
+        self.hover_rects = []  # the buttons drawn in this frame, whose look changes with the mouse over them
+
+    def invalidate(self, rect=None):  # repaint rect, or the whole window, at the next frame
+        self.dirty.append(self.window.get_rect() if rect is None else pygame.Rect(rect))
+
+    def visible(self, rect):  # whether any of rect is repainted in this frame
+        return self.window.get_clip().colliderect(rect)
+
+    def begin_frame(self, user_input):
+        if user_input.changed:
+            self.invalidate()
+        elif user_input.position != user_input.last_position:
+            for rect in self.hover_rects:
+                if rect.collidepoint(user_input.position) != rect.collidepoint(user_input.last_position):
+                    self.dirty.append(rect)
+        self.hover_rects = []
+        self.repainting, self.dirty = self.dirty, []
+        self.window.set_clip(self.repainting[0].unionall(self.repainting) if self.repainting else (0, 0, 0, 0))
+
+    def end_frame(self):  # the regions to push to the display
+        self.window.set_clip(None)
+        if any(rect == self.window.get_rect() for rect in self.repainting):
+            return [self.window.get_rect()]
+        return self.repainting
 
     def set_new_dimensions(self, dimensions):
         self.width = dimensions[0]
@@ -44,86 +82,37 @@ class WindowData:
         self.side_margin_size = dimensions[3]
 
 
-# Enginegton dll with ctypes
-if getattr(sys, 'frozen', False):
-    base_dir = os.path.dirname(sys.executable)
-else:
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-eng_path = os.path.join(base_dir, "Enginegton2", "Enginegton2.dll")
-os.add_dll_directory(os.path.dirname(eng_path))  # for Windows; remove for macOS
-Enginegton = ctypes.cdll.LoadLibrary(eng_path)
-RunEngine = Enginegton.Run
-RunEngine.argtypes = [ctypes.c_char_p]
-
-
-# Interface for communicating with the Enginegton dll/dylib
-class Enginegton:
-    def __init__(self, window_data, path, p_path):
-        self.path_to_log = path
-        log = open(self.path_to_log, "w")
-        log.truncate(0)
-        log.close()
-        self.engine_process = multiprocessing.Process(target=self.startup, args=(path.encode(), p_path.encode(),))
-        self.engine_process.start()
-        self.icon = pygame.transform.scale(pygame.image.load(os.path.join("assets", "img", "icon.png")),
-                                           (window_data.sqr_size * 2, window_data.sqr_size * 2))
+# Interface for communicating with the Enginegton dll/dylib, with the search animation shown while it is working
+class Enginegton(EngineClient):
+    def __init__(self, icon, p_path):
+        super().__init__(p_path)
+        self.icon = icon
         self.icon_rot = 0
-        self.searching = False
-
-    @staticmethod
-    def startup(path, private):
-        RunEngine(path, private)
-
-    def post_message(self, message):
-        log = open(self.path_to_log, "w")
-        log.write(message)
-        log.close()
-        self.searching = True if message[0] == "f" else False
-
-    def wait_for_ok(self):
-        while True:
-            log = open(self.path_to_log, "r+")
-            if log.read() == "ok":
-                log.truncate(0)
-                break
-            log.close()
-
-    # "get" result - reads out the result of "get" request
-    def get_gr(self):
-        rem = None
-        while rem is None:
-            log = open(self.path_to_log, "r")
-            if log.read(1) == "/":
-                rem = log.read()
-            log.close()
-        return rem
-
-    # "find" result - reads out the result of "find" request
-    def get_fr(self):
-        if not self.searching:
-            return ""
-        log = open(self.path_to_log, "r")
-        rem = log.read()
-        log.close()
-        return rem
 
     def run_animation(self, window_data, default=True):
         self.icon_rot += 1
+        rect = self.animation_rect(window_data, default)
+        icon = pygame.transform.rotozoom(self.icon.copy(), self.icon_rot, 1)
+        new_rect = icon.get_rect(center=rect.center)
+        window_data.window.blit(icon, new_rect)
+
+    def animation_rect(self, window_data, default=True):  # the region the rotating icon may cover
         if default:
             rect = self.icon.get_rect(center=(window_data.sqr_size * 8 + window_data.sqr_size // 4,
                                               window_data.sqr_size // 2))
         else:
             rect = self.icon.get_rect(center=(window_data.width // 2 - window_data.sqr_size * 2,
                                               window_data.height // 2))
-        icon = pygame.transform.rotozoom(self.icon.copy(), self.icon_rot, 1)
-        new_rect = icon.get_rect(center=rect.center)
-        window_data.window.blit(icon, new_rect)
+        return rect.inflate(rect.w // 2, rect.h // 2)  # the diagonal of the icon, when it is rotated by 45 degrees
 
 
 class Chessington:
     def __init__(self):
         self.running = True
         self.clock = pygame.time.Clock()
+        self.frame_times = collections.deque(maxlen=3600)  # milliseconds between the last frames
+        self.work_times = collections.deque(maxlen=3600)  # milliseconds the last frames took, without the wait
+        self.idle_frames = 0  # frames that repainted nothing
         self.scene = -1
         self.scenes = {-1: self.loading_screen, 0: self.update_menu, 1: self.update_game, 2: self.update_editor}
         self.window_data = WindowData(self.get_dimensions(self.get_default_height()))
@@ -132,55 +121,169 @@ class Chessington:
         self.current_UI = None
         self.board = None
         self.current_game = None
+        self.journal = None  # records the changes to the game's tree for crash recovery
         self.events = {0: self.take_to_position, 1: self.take_back, 2: self.delete_from_here, 3: self.promote_variation,
                        4: self.engine_recommendation, -4: self.stop_engine, 5: self.get_new_piece,
                        6: self.clear_editor_selection, 7: self.reset_editor_piece_buttons, 8: self.switch_branch,
                        -8: self.minimise_branch, 21: self.quit_app, 22: self.to_menu, 23: self.to_editor,
                        24: self.to_game, 33: self.restart_game, 40: self.reset_editor, 41: self.flip_board,
-                       42: self.btn_take_back, 43: self.move_made, 44: self.process_promotion, 50: self.game_event,
-                       51: self.enable_draw_claim}
+                       42: self.btn_take_back, 43: self.move_made, 44: self.process_promotion,
+                       45: self.process_engine_move, 46: self.play_move, 50: self.game_event, 51: self.enable_draw_claim}
         self.sounds = {2: pygame.mixer.Sound(os.path.join("assets", "sounds", "check.wav")),
                        1: pygame.mixer.Sound(os.path.join("assets", "sounds", "norm.wav")),
                        0: pygame.mixer.Sound(os.path.join("assets", "sounds", "over.wav"))}
-        self.enginegton = Enginegton(self.window_data, base_dir + "\\enginegton_log.txt",
-                                     base_dir + "\\Enginegton2\\search_log.txt")
+        self.assets = Assets()  # every image, decoded once
+        self.resize_height = None  # the height of a resize not applied yet, see request_resize()
+        self.resize_time = 0  # when its last resize event came
+        self.resize_frame = None  # the last frame drawn before it, stretched to the window meanwhile
+        self.resize_prepared = False  # whether the assets of its size are being scaled
+        self.enginegton = Enginegton(self.load_icon(2), os.path.join(base_dir, "Enginegton2", "search_log.txt"))
+        self.book = self.load_book()
+        self.cache = EngineCache.EngineCache(self.cache_path())
+        self.prefetch = Prefetch()  # legal moves of the positions the next move can reach, see Game.get_legal_moves()
+        self.explorer = self.load_explorer()
 
     def update_app(self, mouse_wheel):
+        self.frame_times.append(self.clock.get_time())
+        self.work_times.append(self.clock.get_rawtime())
+        if self.resize_height is not None and not self.settle_resize():
+            return
         if self.board is not None:
             self.input.update(self.board.dragging, mouse_wheel)
+        if self.board is not None and self.board.selected_piece is not None \
+                and self.input.position != self.input.last_position:
+            self.board.drag_damage(self.window_data, self.input.last_position, self.input.position)
+        if self.enginegton.searching and self.scene == 1:
+            self.window_data.invalidate(self.enginegton.animation_rect(self.window_data))
+        self.window_data.begin_frame(self.input)
+        if not self.window_data.repainting:
+            self.idle_frames += 1
+        events = self.enginegton.dispatch()  # results of engine requests that completed since the last frame
+        if self.scene == 1:
+            self.handle_events(events)
         self.scenes[self.scene]()
+        if self.scene == 1:
+            self.prefetch.step(0.002)  # in the frame's idle time
+        if self.journal is not None and self.scene == 1:
+            self.journal.flush(self.current_game.current_position)  # fsynced by the journal's writer thread
 
     def quit_app(self):
+        self.save_session()
         self.running = False
         self.terminate_engine()
+        self.cache.close()
+        if "--stats" in sys.argv:
+            self.print_stats()
+
+    def print_stats(self):  # engine round trips and frame times, to check that requests do not stall the frame loop
+        for kind, (count, mean, worst) in self.enginegton.latency_report().items():
+            print(f"{kind}: {count} requests, {mean:.3f} ms average, {worst:.3f} ms worst")
+        lookups = self.cache.hits + self.cache.misses
+        if lookups:
+            print(f"engine cache: {self.cache.hits} hits, {self.cache.misses} misses, "
+                  f"{self.cache.hits / lookups:.0%} hit rate")
+        moves = self.prefetch.hits + self.prefetch.misses
+        if moves:
+            print(f"prefetch: {self.prefetch.hits} of {moves} moves had their legal moves ready, "
+                  f"{self.prefetch.hits / moves:.0%} hit rate")
+        if self.frame_times:
+            print(f"frames: {sum(self.frame_times) / len(self.frame_times):.2f} ms average, "
+                  f"{max(self.frame_times)} ms worst")
+            print(f"frame work: {sum(self.work_times) / len(self.work_times):.2f} ms average, "
+                  f"{max(self.work_times)} ms worst, {self.idle_frames} frames repainted nothing")
 
     def loading_screen(self):  # Wait for Enginegton to initialise
         eng_ready = False
+        self.window_data.invalidate()  # animated
         self.window_data.window.fill((255, 255, 255), (0, 0, pygame.display.get_surface().get_size()[0],
                                                        pygame.display.get_surface().get_size()[1]))
         self.enginegton.run_animation(self.window_data, False)
         Button.draw_text(self.window_data, "Loading Enginegton",
-                         pygame.font.SysFont("Futura", self.window_data.sqr_size // 2), (0, 0, 0),
+                         Button.get_font(self.window_data.sqr_size // 2), (0, 0, 0),
                          self.window_data.width // 2 - self.window_data.sqr_size,
                          self.window_data.height // 2)
 
-        log = open(self.enginegton.path_to_log, "r+")
-        if log.read() == "ok":
+        if self.enginegton.is_ready():
             eng_ready = True
-        log.close()
 
         if eng_ready:
-            self.enginegton.icon = pygame.transform.scale(pygame.image.load(os.path.join("assets", "img", "icon.png")),
-                                                          (self.window_data.sqr_size // 2,
-                                                           self.window_data.sqr_size // 2))
-            self.board = Board(self.load_all_pieces(), self.load_board_graphic())
+            self.enginegton.icon = self.load_icon(0.5)
+            self.board = Board(self.load_all_pieces(), self.load_board_graphic(), self.load_min_pieces())
             self.to_menu()
 
+    @staticmethod
+    def load_book():  # python main.py --book FILE, or assets/book.bin; built from PGN files by OpeningBook.py
+        path = os.path.join("assets", "book.bin")
+        if "--book" in sys.argv and sys.argv.index("--book") + 1 < len(sys.argv):
+            path = sys.argv[sys.argv.index("--book") + 1]
+        return OpeningBook.OpeningBook(path) if os.path.exists(path) else None
+
+    @staticmethod
+    def cache_path():  # python main.py --cache FILE, or assets/engine_cache.bin, created on first use
+        if "--cache" in sys.argv and sys.argv.index("--cache") + 1 < len(sys.argv):
+            return sys.argv[sys.argv.index("--cache") + 1]
+        return os.path.join("assets", "engine_cache.bin")
+
+    @staticmethod
+    def load_explorer():  # python main.py --explorer FILE.pgn, once FILE.pgn is indexed by Explorer.py
+        if "--explorer" in sys.argv and sys.argv.index("--explorer") + 1 < len(sys.argv):
+            database = sys.argv[sys.argv.index("--explorer") + 1]
+            if Explorer.segment_paths(database):
+                return Explorer.Explorer(database)
+        return None
+
+    @staticmethod
+    def analysis_path():  # python main.py --session FILE, or assets/session.bin
+        if "--session" in sys.argv and sys.argv.index("--session") + 1 < len(sys.argv):
+            return sys.argv[sys.argv.index("--session") + 1]
+        return os.path.join("assets", "session.bin")
+
+    @staticmethod
+    def session_path(engine_on, from_pos, pl_colour, after_game=False):
+        # analysis from the starting position is kept between runs, in analysis_path(); engine games, games from an
+        # editor position and the analysis of a finished game are kept until they end, for crash recovery, in a file
+        # per kind of game and side played
+        if not engine_on and not from_pos and not after_game:
+            return Chessington.analysis_path()
+        return os.path.join("assets", "game_" + ("engine_" if engine_on else "") + ("position_" if from_pos else "")
+                            + ("white" if pl_colour == 1 else "black") + ".bin")
+
+    def save_session(self):  # on leaving a game: analysis is saved, the crash recovery files of other games removed
+        if self.journal is None:
+            return
+        self.journal.close()  # waits for a compaction in progress, which would overwrite the saved session
+        if self.journal.session_path == self.analysis_path():
+            Session.save_session(self.journal.session_path, self.current_game.all_variations,
+                                 self.current_game.current_position)
+        else:
+            self.current_game.all_variations.load_all()
+            if self.current_game.all_variations.source is not None:
+                self.current_game.all_variations.source.close()  # the file to remove may be the one it maps
+                self.current_game.all_variations.source = None
+            os.remove(self.journal.session_path)
+        self.journal.discard()
+        self.current_game.all_variations.journal = None
+        self.journal = None
+
+    def start_journal(self, current, saved, after_game=False):
+        # journal the game's tree; saved: whether the session file holds the tree. Returns the current position the
+        # journal recorded before a crash, if any
+        game = self.current_game
+        path = self.session_path(game.engine_on, game.from_position, game.user_orientation, after_game)
+        tree = game.all_variations
+        if saved:
+            current = Journal.recover(path, tree, current if current is not None else tree.root)
+        self.journal = Journal.Journal(path, tree, fresh=not saved)
+        tree.journal = self.journal
+        return current
+
     def to_menu(self):
+        self.save_session()
         self.stop_engine()
         time.sleep(0.1)
         self.scene = 0
-        self.current_UI = GeneralUI(GeneralUI.get_menu_UI, win_data=self.window_data, graphics=self.load_menu())
+        self.current_UI = GeneralUI(GeneralUI.get_menu_UI, win_data=self.window_data, graphics=self.load_menu(),
+                                    background=self.load_background())
         self.board.editor_position.clear()
 
     def to_game(self, **kwargs):
@@ -198,11 +301,19 @@ class Chessington:
             self.board.set_pos(self.board.start_pos())
             castle = 15
 
-        if kwargs["pl_colour"] == -1:
-            for rank in range(8):
-                self.board.position[rank].reverse()
-            self.board.position.reverse()
-            self.board.flip_file_notation(self.window_data.sqr_size)
+        self.board.set_orientation(kwargs["pl_colour"], self.window_data.sqr_size)
+
+        current, saved = None, False
+        path = self.session_path(kwargs["engine_on"], kwargs["from_pos"], kwargs["pl_colour"])
+        if os.path.exists(path):  # the analysis session, or a game that was interrupted by a crash
+            tree, current = Session.open_session(Journal.latest(path))
+            if (not kwargs["engine_on"] and not kwargs["from_pos"]) or tree.root.zobrist == Zobrist.full_key(
+                    self.board.position, kwargs["side_to_move"], castle, [-1, -1, -1, -1]):
+                kwargs = dict(kwargs, preexisting_tree=tree)
+                saved = True
+            else:  # interrupted in another position: the new game starts the file over
+                tree.source.close()
+                current = None
 
         self.current_UI = GeneralUI(GeneralUI.get_game_UI, win_data=self.window_data, engine_on=kwargs["engine_on"])
         if kwargs["from_pos"]:
@@ -210,18 +321,25 @@ class Chessington:
         self.board.reset_board_UI(True)
 
         self.current_game = Game(position=Board.copy_board(self.board.position), move=[-1, -1, -1, -1], move_note="",
-                                 castle=castle, promotion=False, enginegton=self.enginegton, **kwargs)
-        self.handle_events(self.current_game.get_moves(self.enginegton))
+                                 castle=castle, promotion=False, enginegton=self.enginegton, book=self.book,
+                                 cache=self.cache, prefetch=self.prefetch, **kwargs)
+        self.handle_events(self.current_game.get_moves())
+        current = self.start_journal(current, saved)
+        if current is not None and current is not self.current_game.all_variations.root:
+            self.current_UI.get_variations_UI(win_data=self.window_data, engine_on=self.current_game.engine_on)
+            self.take_to_position(position_key=current.key, type=0)
         if self.current_game.engine_on and self.current_game.turn == self.current_game.engine_turn:
             self.current_game.start_engine(self.enginegton)
 
     def to_editor(self):
+        self.save_session()
         if self.current_game is not None:
             self.stop_engine()
         time.sleep(0.1)
         self.scene = 2
         self.current_UI = GeneralUI(GeneralUI.get_editor_UI, win_data=self.window_data, graphics=self.load_all_pieces())
         self.board.reset_board_UI(True)
+        self.board.set_orientation(1, self.window_data.sqr_size)
 
         if not self.board.editor_position:
             self.board.set_pos(self.board.start_pos())
@@ -238,11 +356,13 @@ class Chessington:
         self.board.draw_pos(self.window_data, **self.current_game.get_draw_kwargs())
         if self.scene != 1:
             return
+        state = self.board.view_state()
         self.handle_events(self.board.game_update(self.window_data, self.input,
                                                   engine=self.current_game.engine_on and self.enginegton.searching,
                                                   **self.current_game.get_kwargs()))
+        if self.board.view_state() != state:  # a piece was picked up or put back, or another square is highlighted
+            self.window_data.invalidate((0, 0, 8 * self.window_data.sqr_size, 8 * self.window_data.sqr_size))
 
-        self.process_engine_move(self.enginegton.get_fr())
         if self.enginegton.searching:
             self.enginegton.run_animation(self.window_data)
 
@@ -251,7 +371,10 @@ class Chessington:
         self.board.draw_pos(self.window_data)
         if self.scene != 2:
             return
+        state = self.board.view_state()
         self.handle_events(self.board.editor_update(self.window_data, self.input))
+        if self.board.view_state() != state:
+            self.window_data.invalidate((0, 0, 8 * self.window_data.sqr_size, 8 * self.window_data.sqr_size))
         if not self.board.is_empty() and sum(1 for btn in self.current_UI.buttons if btn.event_ID == 40) == 0:
             self.current_UI.buttons.append(self.current_UI.add_special_button(self.window_data, "reset"))
         if self.board.is_empty() and sum(1 for btn in self.current_UI.buttons if btn.event_ID == 40) > 0:
@@ -259,6 +382,8 @@ class Chessington:
 
     # Every event ID is passed down in lists from the different UIs, Game, or Board instances, and processed below
     def handle_events(self, event_list):
+        if not all(self.idle_event(event) for event in event_list):
+            self.window_data.invalidate()
         for event in event_list:
             if event.ID not in self.events:
                 continue
@@ -268,16 +393,19 @@ class Chessington:
             except KeyError:
                 pass
 
+    def idle_event(self, event):  # the editor posts 6 and 7 every frame, and most of them change nothing
+        return (event.ID == 6 and self.board.selected_piece is None) or (event.ID == 7 and not event.data["edited"])
+
     def process_promotion(self, **kwargs):  # if a piece was selected to promote to
         position_data = self.current_UI.sub_interface.position_data
-        if self.current_game.user_orientation != position_data.orientation:
-            position_data.reverse_rank_and_file()
-            Board.flip(position_data.position)
-        self.board.position[position_data.move[2]][position_data.move[3]] = kwargs["id"]
+        rank, file = position_data.move[2], position_data.move[3]
+        self.board.position[rank][file] = kwargs["id"]
+        pawn = 1 if kwargs["id"] > 0 else -1
+        position_data.zobrist ^= Zobrist.piece_key(pawn, rank, file) ^ Zobrist.piece_key(kwargs["id"], rank, file)
         self.board.piece_count[kwargs["id"]] += 1
-        position_data.position = Board.copy_board(self.board.position)
+        position_data.position = self.board.position
         position_data.update_notation("=" + self.board.piece_dict[kwargs["id"]])
-        delattr(position_data, "promotion")
+        position_data.promotion = False
         self.current_UI.get_variations_UI(win_data=self.window_data, engine_on=self.current_game.engine_on)
         self.move_made(position=position_data)
 
@@ -285,9 +413,9 @@ class Chessington:
         if self.enginegton.searching:  # if the user requested an engine move in analysis but then makes a move
             self.stop_engine()
         position = kwargs["position"]
-        # if hasattr promotion, this function returns - once the player chooses a piece, process_promotion(), def above,
-        # calls it again with the same position but without promotion attr, to finish processing a move
-        if hasattr(position, "promotion"):
+        # if promotion is set, this function returns - once the player chooses a piece, process_promotion(), def above,
+        # calls it again with the same position with promotion cleared, to finish processing a move
+        if position.promotion:
             self.current_UI.get_promotion_UI(win_data=self.window_data, graphics=self.load_pieces(), position=position)
             return
         self.current_UI.remove_special_button("claim")
@@ -304,14 +432,14 @@ class Chessington:
         if self.current_UI.sub_interface is None:
             return
 
-        part_tree = {0: []}  # part_tree represents the currently visible (drawable) part of the tree
-        self.current_game.all_variations.get_part_tree(position.key, part_tree)
+        # part_tree represents the currently visible (drawable) part of the tree
+        part_tree = self.current_game.all_variations.get_part_tree(position.key)
         tree_height = self.current_game.all_variations.tree_height
+        self.current_UI.sub_interface.set_tree_height(tree_height)
         for depth, line in part_tree.items():
             self.current_UI.sub_interface.get_notation_buttons(self.window_data, line, depth, position.key)
             self.current_UI.sub_interface.update_scrolling_height(depth)
 
-        self.current_UI.sub_interface.no_branch(tree_height)
         if position.has_siblings():
             index = 1 if position.get_sibling_index() > 0 else 0
             self.current_UI.sub_interface.get_branch_buttons(self.window_data, position.parent.children[1:],
@@ -321,38 +449,61 @@ class Chessington:
                                                              kwargs["branches_redraw"].parent.children[1:],
                                                              tree_height, kwargs["branches_redraw"].key)
 
+        transpositions = self.current_game.all_variations.transposes_to(position)
         if position.key == "r":
             self.current_UI.sub_interface.no_modify()
+            self.current_UI.sub_interface.get_transposition_buttons(self.window_data, transpositions)
+            self.update_explorer(position)
             return
         if tree_height == 0:
             self.current_UI.sub_interface.allow_delete(self.window_data)
         else:
             self.current_UI.sub_interface.allow_branch_promotions(self.window_data)
+        self.current_UI.sub_interface.get_transposition_buttons(self.window_data, transpositions)
+        self.update_explorer(position)
 
         if kwargs["type"] == 1 and self.current_game.current_position.ply > 1:
-            self.current_UI.sub_interface.scrollers[tree_height].forward_offset(-self.current_game.turn)
+            self.current_UI.sub_interface.scroller(tree_height).forward_offset(-self.current_game.turn)
         elif kwargs["type"] == -1:
-            self.current_UI.sub_interface.scrollers[tree_height].back_offset(-self.current_game.turn)
+            self.current_UI.sub_interface.scroller(tree_height).back_offset(-self.current_game.turn)
         elif kwargs["type"] == 0:
-            self.current_UI.sub_interface.scrollers[tree_height].reset()
+            self.current_UI.sub_interface.scroller(tree_height).reset()
         else:
-            self.current_UI.sub_interface.scrollers[tree_height].reset_to_max()
+            self.current_UI.sub_interface.scroller(tree_height).reset_to_max()
+
+    def update_explorer(self, position):  # the database games that reached position, drawn by the variations UI
+        if self.explorer is None or self.current_game.engine_on:
+            return
+        moves, total, offsets = self.explorer.lookup(position.zobrist)
+        moves = [[OpeningBook.unpack_move(move)] + rest for move, *rest in moves if move != Explorer.no_move]
+        games = [self.explorer.game_tags(offset) for offset in offsets]
+        self.current_UI.sub_interface.get_explorer_buttons(self.window_data, moves, total, games)
+
+    def play_move(self, **kwargs):  # on explorer move button press
+        move = kwargs["move"]
+        if move not in self.current_game.legal_moves or self.board.board_situation > 1:
+            return
+        self.move_made(position=self.board.process_move(self.board.position[move[0]][move[1]], (move[0], move[1]),
+                                                        (move[2], move[3]), **self.current_game.get_kwargs(move[4])))
 
     def engine_recommendation(self):
         if self.board.board_situation > 1 or self.enginegton.searching:
             return
+        move = self.current_game.all_variations.transposition(self.current_game.current_position).engine_move
+        if move is not None and move[:4] + [move[4] if 0 < move[4] < 5 else 0] in self.current_game.legal_moves:
+            # this position, or a transposition of it, has already been searched, and the move read back is legal
+            self.board.move_graphic = MoveGraphic((move[0], move[1]), (move[2], move[3]), self.window_data.sqr_size,
+                                                  self.board.orientation)
+            return
         self.current_game.start_engine(self.enginegton)
 
     def terminate_engine(self):  # end the engine process
-        self.enginegton.post_message("term\n")
-        self.enginegton.wait_for_ok()
-        self.enginegton.engine_process.join()
+        self.enginegton.terminate()
 
     def stop_engine(self):  # stop the engine if it is searching
         if self.current_game is None:
             return
-        self.enginegton.post_message("stop\n")
-        self.enginegton.wait_for_ok()
+        self.enginegton.request("stop\n")  # the engine finishes stopping before it handles the next request
 
     def process_engine_move(self, res):
         if len(res) < 2:
@@ -365,10 +516,10 @@ class Chessington:
         else:
             move = [int(res[i]) for i in range(2, 6)] + [int(res[6] + res[7])]
         self.enginegton.icon_rot = 0
-        if self.current_game.engine_search_orientation != self.current_game.user_orientation:
-            Position.reverse_move(move)
         if not self.current_game.engine_on:
-            self.board.move_graphic = MoveGraphic((move[0], move[1]), (move[2], move[3]), self.window_data.sqr_size)
+            self.current_game.all_variations.set_engine_move(self.current_game.current_position, move)
+            self.board.move_graphic = MoveGraphic((move[0], move[1]), (move[2], move[3]), self.window_data.sqr_size,
+                                                  self.board.orientation)
             return
         self.move_made(position=self.board.process_move(self.board.position[move[0]][move[1]], (move[0], move[1]),
                                                         (move[2], move[3]), **self.current_game.get_kwargs(move[4])))
@@ -384,6 +535,9 @@ class Chessington:
         self.current_UI.add_special_button(self.window_data, "claim")
 
     def restart_game(self, **kwargs):
+        # a finished game's tree is analysed in a file of its own: the analysis session must not be overwritten with it
+        after_game = self.journal is None or self.journal.session_path != self.analysis_path()
+        self.save_session()
         delattr(self.current_UI, "winner")
         self.current_UI = GeneralUI(GeneralUI.get_game_UI, win_data=self.window_data, graphics=self.load_all_pieces(),
                                     engine_on=kwargs["on"])
@@ -393,10 +547,12 @@ class Chessington:
             = self.current_game.all_variations if kwargs["tree_exists"] else None
         self.current_game.start_data["engine_on"] = kwargs["on"]
         self.current_game = Game(**self.current_game.start_data)
-        self.handle_events(self.current_game.get_moves(self.enginegton))
+        self.board.set_orientation(self.current_game.user_orientation, self.window_data.sqr_size)
+        self.handle_events(self.current_game.get_moves())
         if self.current_game.from_position and not hasattr(self.current_UI, "winner"):
             self.current_UI.dropdowns[0].buttons.append(self.current_UI.add_special_button(self.window_data, "editor"))
         self.update_variations(self.current_game.current_position, type=0)
+        self.start_journal(None, False, after_game)
         if self.current_game.engine_on and self.current_game.turn == self.current_game.engine_turn:
             self.current_game.start_engine(self.enginegton)
 
@@ -441,13 +597,7 @@ class Chessington:
     def flip_board(self):
         self.board.reset_board_UI()
         self.current_game.user_orientation = -self.current_game.user_orientation
-        if self.current_game.current_position.orientation != self.current_game.user_orientation:
-            self.current_game.current_position.reverse_rank_and_file()
-            Board.flip(self.current_game.current_position.position)
-        Board.flip(self.board.position)
-        self.board.flip_file_notation(self.window_data.sqr_size)
-        for move in self.current_game.legal_moves:
-            Position.reverse_move(move)
+        self.board.set_orientation(self.current_game.user_orientation, self.window_data.sqr_size)
 
     def take_to_position(self, **kwargs):  # on notation button press, this function loads the corresponding position
         self.current_game.set_to_position(kwargs["position_key"])
@@ -459,7 +609,7 @@ class Chessington:
         self.board.reset_board_UI()
         if self.enginegton.searching:
             self.stop_engine()
-        self.handle_events(self.current_game.get_moves(self.enginegton))
+        self.handle_events(self.current_game.get_moves())
 
     def take_back(self, **kwargs):
         self.current_game.switch_position(kwargs["direction"])
@@ -470,7 +620,7 @@ class Chessington:
         self.board.reset_board_UI()
         if self.enginegton.searching:
             self.stop_engine()
-        self.handle_events(self.current_game.get_moves(self.enginegton))
+        self.handle_events(self.current_game.get_moves())
 
     def btn_take_back(self):  # takeback on Options->Takeback button press, works differently in vs. engine game
         if self.current_game.current_position == self.current_game.all_variations.root:
@@ -495,7 +645,7 @@ class Chessington:
         self.board.reset_board_UI()
         if self.enginegton.searching:
             self.stop_engine()
-        self.handle_events(self.current_game.get_moves(self.enginegton))
+        self.handle_events(self.current_game.get_moves())
 
     def switch_branch(self, **kwargs):  # on user branch button press
         self.take_to_position(type=0, **kwargs)
@@ -509,43 +659,18 @@ class Chessington:
         ancestor_ind = branch_ancestor.get_sibling_index()
         if ancestor_ind == 0:
             return
-        temp = branch_ancestor.parent.children[ancestor_ind - 1]
-        branch_ancestor.parent.children[ancestor_ind - 1] = branch_ancestor
-        branch_ancestor.parent.children[ancestor_ind] = temp
+        self.current_game.all_variations.promote_variation(branch_ancestor)
         self.update_variations(self.current_game.current_position, branches_redraw=branch_ancestor, type=0)
 
-    # Graphics loaders - load assets from the assets folder and transform, returning them in dictionary form
+    # Graphics loaders - scale assets from the asset manager, returning them in dictionary form
     def load_kings(self):  # some places, like main menu, only need king graphics
-        black_king_img = pygame.image.load(os.path.join("assets", "pieces", "black_king.png"))
-        white_king_img = pygame.image.load(os.path.join("assets", "pieces", "white_king.png"))
-        return {10: pygame.transform.scale(white_king_img, (self.window_data.sqr_size, self.window_data.sqr_size)),
-                -10: pygame.transform.scale(black_king_img, (self.window_data.sqr_size, self.window_data.sqr_size))}
+        return self.assets.pieces([10], self.window_data.sqr_size)
 
     def load_pieces(self):
-
-        black_bishop_img = pygame.image.load(os.path.join("assets", "pieces", "black_bishop.png"))
-        white_bishop_img = pygame.image.load(os.path.join("assets", "pieces", "white_bishop.png"))
-        black_knight_img = pygame.image.load(os.path.join("assets", "pieces", "black_knight.png"))
-        white_knight_img = pygame.image.load(os.path.join("assets", "pieces", "white_knight.png"))
-        black_rook_img = pygame.image.load(os.path.join("assets", "pieces", "black_rook.png"))
-        white_rook_img = pygame.image.load(os.path.join("assets", "pieces", "white_rook.png"))
-        white_queen_img = pygame.image.load(os.path.join("assets", "pieces", "white_queen.png"))
-        black_queen_img = pygame.image.load(os.path.join("assets", "pieces", "black_queen.png"))
-
-        return {2: pygame.transform.scale(white_knight_img, (self.window_data.sqr_size, self.window_data.sqr_size)),
-                3: pygame.transform.scale(white_bishop_img, (self.window_data.sqr_size, self.window_data.sqr_size)),
-                5: pygame.transform.scale(white_rook_img, (self.window_data.sqr_size, self.window_data.sqr_size)),
-                9: pygame.transform.scale(white_queen_img, (self.window_data.sqr_size, self.window_data.sqr_size)),
-                -2: pygame.transform.scale(black_knight_img, (self.window_data.sqr_size, self.window_data.sqr_size)),
-                -3: pygame.transform.scale(black_bishop_img, (self.window_data.sqr_size, self.window_data.sqr_size)),
-                -5: pygame.transform.scale(black_rook_img, (self.window_data.sqr_size, self.window_data.sqr_size)),
-                -9: pygame.transform.scale(black_queen_img, (self.window_data.sqr_size, self.window_data.sqr_size))}
+        return self.assets.pieces([2, 3, 5, 9], self.window_data.sqr_size)
 
     def load_pawns(self):
-        black_pawn_img = pygame.image.load(os.path.join("assets", "pieces", "black_pawn.png"))
-        white_pawn_img = pygame.image.load(os.path.join("assets", "pieces", "white_pawn.png"))
-        return {-1: pygame.transform.scale(black_pawn_img, (self.window_data.sqr_size, self.window_data.sqr_size)),
-                1: pygame.transform.scale(white_pawn_img, (self.window_data.sqr_size, self.window_data.sqr_size))}
+        return self.assets.pieces([1], self.window_data.sqr_size)
 
     def load_all_pieces(self):
         pieces = self.load_kings()
@@ -553,31 +678,73 @@ class Chessington:
         pieces.update(self.load_pawns())
         return pieces
 
+    def load_min_pieces(self):  # the captured pieces beside the board
+        return self.assets.pieces([1, 2, 3, 5, 9, 10], self.window_data.sqr_size * 0.6)
+
     def load_menu(self):
-        icons = {0: pygame.transform.scale(pygame.image.load(os.path.join("assets", "img", "icon.png")),
-                                           (self.window_data.sqr_size, self.window_data.sqr_size))}
+        icons = {0: self.load_icon(1)}
         icons.update(self.load_kings())
         return icons
 
-    def load_board_graphic(self):
-        board = pygame.image.load(os.path.join("assets", "img", "board.png"))
-        return pygame.transform.scale(board, (self.window_data.sqr_size * 8, self.window_data.sqr_size * 8))
+    def load_icon(self, squares):  # the Enginegton icon, squares wide
+        return self.assets.scaled("icon", (self.window_data.sqr_size * squares, self.window_data.sqr_size * squares))
 
-    # this function is called on pygame video resize; it defines new app dimensions, and uses them to remake
+    def load_board_graphic(self):
+        return self.assets.scaled("board", (self.window_data.sqr_size * 8, self.window_data.sqr_size * 8))
+
+    def load_background(self):
+        return self.assets.scaled("bg", (self.window_data.width, self.window_data.height))
+
+    # the (name, size) of the assets the loaders above ask for at the given dimensions
+    def asset_sizes(self, dimensions):
+        width, height, sqr_size = dimensions[:3]
+        sizes = [("bg", (width, height)), ("board", (sqr_size * 8, sqr_size * 8))]
+        sizes += [("icon", (sqr_size * squares, sqr_size * squares)) for squares in (0.5, 1, 2)]
+        for colour in ("white", "black"):
+            for piece in ("pawn", "knight", "bishop", "rook", "queen", "king"):
+                sizes += [(colour + "_" + piece, (sqr_size, sqr_size)),
+                          (colour + "_" + piece, (sqr_size * 0.6, sqr_size * 0.6))]
+        return sizes
+
+    # main.py passes each VIDEORESIZE event to request_resize(); the application is rebuilt once the size settles
+    resize_delay = 0.25
+
+    def request_resize(self, height):
+        if self.resize_height is None:
+            self.resize_frame = self.window_data.window.copy()
+        self.resize_height, self.resize_time, self.resize_prepared = height, time.perf_counter(), False
+        self.window_data.invalidate()  # the stretched frame, at the window's new size
+
+    def settle_resize(self):  # whether the frame loop can carry on: False while the window is being resized
+        elapsed = time.perf_counter() - self.resize_time
+        if elapsed >= self.resize_delay:
+            self.assets.finish()
+            self.resize_application(self.resize_height)
+            self.resize_height, self.resize_frame = None, None
+            return True
+        if not self.resize_prepared and elapsed >= self.resize_delay / 2:
+            self.resize_prepared = True
+            self.assets.prepare(self.asset_sizes(self.get_dimensions(self.resize_height)))
+        window_data = self.window_data
+        window_data.repainting, window_data.dirty = window_data.dirty, []  # the window, after each resize event
+        if window_data.repainting:
+            window_data.window.blit(pygame.transform.scale(self.resize_frame, window_data.window.get_size()), (0, 0))
+        return False
+
+    # this function is called once a resize settles; it defines new app dimensions, and uses them to remake
     # graphics and the current UI
     def resize_application(self, height):
+        Button.clear_caches()  # every font size follows the window's
         self.window_data = WindowData(self.get_dimensions(height))
         if self.scene == -1:
-            self.enginegton.icon = pygame.transform.scale(pygame.image.load(os.path.join("assets", "img", "icon.png")),
-                                                          (self.window_data.sqr_size * 2,
-                                                           self.window_data.sqr_size * 2))
+            self.enginegton.icon = self.load_icon(2)
             return
-        self.enginegton.icon = pygame.transform.scale(pygame.image.load(os.path.join("assets", "img", "icon.png")),
-                                                      (self.window_data.sqr_size // 2, self.window_data.sqr_size // 2))
-        self.board.redraw(self.load_all_pieces(), self.load_board_graphic(), self.window_data.sqr_size)
+        self.enginegton.icon = self.load_icon(0.5)
+        self.board.redraw(self.load_all_pieces(), self.load_board_graphic(), self.load_min_pieces(),
+                          self.window_data.sqr_size)
         engine = None if self.current_game is None else self.current_game.engine_on
         self.current_UI.redraw(win_data=self.window_data, graphics=self.load_all_pieces(),
-                               engine_on=engine)
+                               engine_on=engine, background=self.load_background())
         if self.scene == 1 and type(self.current_UI.sub_interface) == VariationsInterface:
             # noinspection PyUnresolvedReferences
             self.update_variations(self.current_game.current_position, type=0)
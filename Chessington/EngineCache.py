@@ -0,0 +1,71 @@
+import mmap
+import os
+import struct
+import time
+
+# Engine result cache: the moves Enginegton found, kept across sessions in a memory-mapped, fixed-size hash table keyed
+# by Zobrist key, replacing the least recently used entry of a full bucket
+
+magic = b"CHEC"
+version = 1
+header = struct.Struct("<4sHI")  # magic, version, slots
+entry = struct.Struct("<Q5bfBQI")  # Zobrist key, move (rank, file, rank, file, type), eval, depth, nodes, last used
+bucket = 4  # slots a key may occupy
+
+
+class EngineCache:
+    def __init__(self, path, slots=1 << 16):  # 1 << 16 slots: 2 MB
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.data = self.open_file(path, slots)
+        if self.data is None:  # missing, or written by another version: the cache starts over
+            with open(path, "wb") as file:
+                file.write(header.pack(magic, version, slots))
+                file.truncate(header.size + slots * entry.size)
+            self.data = self.open_file(path, slots)
+        self.slots = header.unpack_from(self.data)[2]
+
+    @staticmethod
+    def open_file(path, slots):
+        if not os.path.exists(path) or os.path.getsize(path) < header.size:
+            return None
+        with open(path, "r+b") as file:
+            data = mmap.mmap(file.fileno(), 0)
+        name, file_version, file_slots = header.unpack_from(data)
+        if name != magic or file_version != version or len(data) != header.size + file_slots * entry.size:
+            data.close()
+            return None
+        return data
+
+    def find(self, key):  # the offset of key's entry, or None
+        first = (key % (self.slots // bucket)) * bucket
+        for index in range(first, first + bucket):
+            offset = header.size + index * entry.size
+            if struct.unpack_from("<Q", self.data, offset)[0] == key:
+                return offset
+        return None
+
+    def lookup(self, key):  # (move, eval, depth, nodes) for the position with this Zobrist key, or None
+        offset = self.find(key)
+        if offset is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        fields = entry.unpack_from(self.data, offset)
+        struct.pack_into("<I", self.data, offset + entry.size - 4, int(time.time()))
+        return list(fields[1:6]), fields[6], fields[7], fields[8]
+
+    def store(self, key, move, evaluation, depth, nodes):
+        if depth == 0:
+            return
+        offset = self.find(key)
+        if offset is None:  # an empty slot of the bucket, or else its least recently used entry
+            first = (key % (self.slots // bucket)) * bucket
+            offsets = [header.size + index * entry.size for index in range(first, first + bucket)]
+            offset = min(offsets, key=lambda offset: entry.unpack_from(self.data, offset)[-1])
+        entry.pack_into(self.data, offset, key, *move, evaluation, depth, nodes, int(time.time()))
+
+    def close(self):
+        self.data.flush()
+        self.data.close()
@@ -0,0 +1,168 @@
+import ctypes
+import os
+import sys
+import time
+import multiprocessing
+import queue
+import socket
+import threading
+import collections
+import concurrent.futures
+
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+else:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+eng_path = os.path.join(base_dir, "Enginegton2", "Enginegton2.dll")
+
+
+def run_engine(address, private):  # target of the engine process; only this process loads the dll
+    os.add_dll_directory(os.path.dirname(eng_path))  # for Windows; remove for macOS
+    engine = ctypes.cdll.LoadLibrary(eng_path)
+    engine.Run.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
+    engine.Run(address, private)
+
+
+# A request posted to Enginegton; the engine acknowledges every request with "ok", and "get", "find" and "perft"
+# requests are resolved later by their result message
+class EngineRequest:
+    def __init__(self, kind):
+        self.kind = kind  # "startup", "get", "find", "stop", "term" or "perft"
+        self.future = concurrent.futures.Future()
+        self.sent = time.perf_counter()
+
+
+# Client for the Enginegton dll/dylib, which runs in its own process
+# Requests and results travel over a local socket as '\0'-terminated messages. A reader thread blocks on the socket and
+# resolves the future of each request; completion callbacks are queued and run on the main thread by dispatch(), once
+# per frame, so the pygame loop never waits for the engine. It does not depend on pygame, so tools can use it too.
+class EngineClient:
+    def __init__(self, p_path):
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        address = "127.0.0.1:" + str(self.listener.getsockname()[1])
+        self.connection = None
+        self.connected = threading.Event()
+        self.lock = threading.Lock()  # guards the request queues below, shared with the reader thread
+        self.startup_request = EngineRequest("startup")  # resolved by the "ok" posted once the engine has initialised
+        self.unacknowledged = collections.deque([self.startup_request])
+        self.awaiting_result = collections.deque()  # acknowledged "get" and "perft" requests
+        self.search = None  # the "find" request whose move has not arrived yet
+        self.completed = queue.Queue()
+        self.latency = {kind: collections.deque(maxlen=1000) for kind in ("get", "find", "stop", "term", "perft")}
+        self.reader = threading.Thread(target=self.read_messages, daemon=True)
+        self.reader.start()
+        self.engine_process = multiprocessing.Process(target=run_engine, args=(address.encode(), p_path.encode(),))
+        self.engine_process.start()
+        self.searching = False
+
+    def read_messages(self):  # runs on the reader thread
+        self.connection, _ = self.listener.accept()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.listener.close()
+        self.connected.set()
+        pending = b""
+        while True:
+            try:
+                chunk = self.connection.recv(4096)
+            except OSError:
+                break
+            if not chunk:
+                break
+            pending += chunk
+            *complete, pending = pending.split(b"\0")
+            for message in complete:
+                self.receive(message.decode())
+        with self.lock:  # the engine process has ended; nothing left can be answered
+            for request in list(self.unacknowledged) + list(self.awaiting_result) + [self.search]:
+                if request is not None:
+                    request.future.cancel()
+
+    def receive(self, message):
+        with self.lock:
+            if message == "ok":
+                if not self.unacknowledged:
+                    return
+                request = self.unacknowledged.popleft()
+                if request.kind == "get" or request.kind == "perft":
+                    self.awaiting_result.append(request)
+                    return
+                if request.kind == "find":
+                    return  # the move arrives in its own "f/" message
+            elif message[0] == "/" or message[:2] == "p/":
+                if not self.awaiting_result:
+                    return
+                request = self.awaiting_result.popleft()
+                message = message[message.index("/") + 1:]
+            elif message[:2] == "f/":
+                if any(request.kind in ("stop", "term") for request in self.unacknowledged):
+                    # posted by the search being stopped: the engine acknowledges a "stop" once its search has ended,
+                    # so the move of a later search comes after that "ok"
+                    return
+                request = self.search
+                self.search = None
+                if request is None:
+                    return  # the search was stopped before its move arrived
+            else:
+                return
+        self.resolve(request, message)
+
+    def resolve(self, request, result):
+        if request.kind in self.latency:
+            self.latency[request.kind].append(time.perf_counter() - request.sent)
+        try:
+            request.future.set_result(result)
+        except concurrent.futures.InvalidStateError:
+            pass  # cancelled by a "stop" while the result was on its way
+
+    def request(self, message, callback=None):
+        # posts a request and returns its future; callback(result) runs on the main thread in dispatch(), and returns
+        # the events its result spawns
+        self.connected.wait()
+        request = EngineRequest(message.split("\n", 1)[0])
+        if callback is not None:
+            request.future.add_done_callback(lambda future: self.completed.put((callback, future)))
+        with self.lock:
+            if request.kind == "find":
+                self.search = request
+                self.searching = True
+            elif request.kind in ("stop", "term"):
+                if self.search is not None:
+                    self.search.future.cancel()  # a move posted by a search that is being stopped is dropped
+                    self.search = None
+                self.searching = False
+            self.unacknowledged.append(request)
+        self.connection.sendall(message.encode() + b"\0")
+        return request.future
+
+    def answer(self, kind, result, callback):
+        # resolves a request without the engine (a move from the opening book): callback runs in dispatch() as it
+        # would for the engine's result, and a "stop" drops it the same way
+        request = EngineRequest(kind)
+        request.future.add_done_callback(lambda future: self.completed.put((callback, future)))
+        with self.lock:
+            if kind == "find":
+                self.searching = True
+        request.future.set_result(result)
+        return request.future
+
+    def dispatch(self):  # called once per frame on the main thread
+        events = []
+        while not self.completed.empty():
+            callback, future = self.completed.get_nowait()
+            if future.cancelled():
+                continue
+            result = callback(future.result())
+            if result:
+                events += result
+        return events
+
+    def is_ready(self):  # non-blocking check used by the loading screen
+        return self.startup_request.future.done()
+
+    def terminate(self):  # end the engine process
+        concurrent.futures.wait([self.request("term\n")])
+        self.engine_process.join()
+
+    def latency_report(self):  # average and worst round trip per request type, in milliseconds
+        return {kind: (len(times), 1000 * sum(times) / len(times), 1000 * max(times))
+                for kind, times in self.latency.items() if times}
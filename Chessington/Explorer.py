@@ -0,0 +1,264 @@
+import argparse
+import glob
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import PGN
+
+# Position explorer: an index of the positions reached by the games of a PGN database, with the moves played from them
+# and the games that reached them, in segment files (FILE.pgn.idx.1, ...) that are hash tables keyed by Zobrist key
+# Usage: python Explorer.py FILE [--jobs N] [--plies N]: builds or updates the index, and reports games/s
+
+magic = b"CHEX"
+version = 1
+header = struct.Struct("<4sHQQIII")  # magic, version, start and end offsets in the database, slots, positions, moves
+slot = struct.Struct("<QIIIH")  # Zobrist key, first posting, posting count, first move, move count
+move_record = struct.Struct("<H8sIIII")  # packed move (see pack_move), SAN, games, White wins, draws, Black wins
+posting = struct.Struct("<Q")  # offset of a game in the database
+no_move = 0xFFFF  # the games that ended in the position
+results = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}  # result -> index into a move's White wins, draws, Black wins
+segment_limit = 8  # more segments than this are merged into one
+
+
+def pack_move(position):  # the move that led to a Position: origin | destination << 6 | promotion << 12
+    rank, file, to_rank, to_file = position.move
+    piece = position.piece if position.piece < 128 else position.piece - 256
+    promotion = 0
+    if abs(piece) != 1 and position.parent.get_board()[rank * 8 + file] in (1, 255):
+        promotion = {2: 1, 3: 2, 5: 3, 9: 4}[abs(piece)]
+    return (rank * 8 + file) | (to_rank * 8 + to_file) << 6 | promotion << 12
+
+
+def index_range(path, start, end, plies):
+    # parse the games in [start, end) of the database; returns ({key: [game offsets]}, {key: {move: [SAN, games,
+    # White wins, draws, Black wins]}}, games). Runs in the worker processes
+    postings, moves, games = {}, {}, 0
+    with open(path, "rb") as file:
+        file.seek(start)
+        lines = iter(lambda: file.readline() if file.tell() < end else b"", b"")
+        for offset, tags, movetext in PGN.split_games(lines):
+            game = PGN.parse_game(tags, movetext, False, plies)
+            if game is None:
+                continue  # a game with an illegal move is left out of the index
+            games += 1
+            outcome = results.get(tags.get("Result"), -1)
+            line = game[1].root.line()
+            for index, position in enumerate(line):
+                key = position.zobrist
+                if key not in postings:
+                    postings[key], moves[key] = [], {}
+                if postings[key] and postings[key][-1] == start + offset:
+                    continue  # the game repeated the position
+                postings[key].append(start + offset)
+                if index + 1 < len(line):
+                    following = line[index + 1]
+                    move, san = pack_move(following), following.move_notation.rsplit(" ", 1)[-1]
+                else:
+                    move, san = no_move, ""
+                if move not in moves[key]:
+                    moves[key][move] = [san, 0, 0, 0, 0]
+                moves[key][move][1] += 1
+                if outcome != -1:
+                    moves[key][move][2 + outcome] += 1
+    return postings, moves, games
+
+
+def split(path, start, jobs):  # byte ranges of the database from start, cut where games begin
+    end = os.path.getsize(path)
+    cuts = [start]
+    with open(path, "rb") as file:
+        for part in range(1, jobs):
+            file.seek(max(cuts[-1], start + (end - start) * part // jobs))
+            file.readline()  # the rest of a line the cut fell into
+            previous_blank = False
+            while True:  # a game starts with a tag after a line that is not one
+                position = file.tell()
+                line = file.readline()
+                if not line:
+                    position = end
+                    break
+                if line.startswith(b"[") and previous_blank:
+                    break
+                previous_blank = not line.strip()
+            if cuts[-1] < position < end:
+                cuts.append(position)
+    cuts.append(end)
+    return list(zip(cuts, cuts[1:]))
+
+
+def write_segment(path, start, end, postings, moves):
+    keys = sorted(postings)
+    slots = 1 << max(4, (2 * len(keys)).bit_length())  # at most half full
+    table = [None] * slots
+    posting_data, move_data = bytearray(), bytearray()
+    for key in keys:
+        first_posting, first_move = len(posting_data) // posting.size, len(move_data) // move_record.size
+        for offset in sorted(postings[key]):
+            posting_data += posting.pack(offset)
+        for move, (san, games, white, draws, black) in sorted(moves[key].items(), key=lambda item: -item[1][1]):
+            move_data += move_record.pack(move, san.encode()[:8], games, white, draws, black)
+        index = key & (slots - 1)
+        while table[index] is not None:
+            index = (index + 1) & (slots - 1)
+        table[index] = slot.pack(key, first_posting, len(postings[key]), first_move, len(moves[key]))
+    empty = slot.pack(0, 0, 0, 0, 0)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(header.pack(magic, version, start, end, slots, len(keys), len(move_data) // move_record.size))
+        file.write(b"".join(entry if entry is not None else empty for entry in table))
+        file.write(move_data)
+        file.write(posting_data)
+    os.replace(temporary, path)
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        name, file_version, self.start, self.end, self.slots, self.positions, moves = header.unpack_from(self.data)
+        if name != magic or file_version != version:
+            self.close()
+            raise ValueError(path + " is not an explorer index")
+        self.moves_offset = header.size + self.slots * slot.size
+        self.postings_offset = self.moves_offset + moves * move_record.size
+
+    def find(self, key):  # (first posting, posting count, first move, move count), or None
+        index = key & (self.slots - 1)
+        while True:
+            found, *entry = slot.unpack_from(self.data, header.size + index * slot.size)
+            if found == key:
+                return entry
+            if found == 0 and entry[1] == 0:
+                return None
+            index = (index + 1) & (self.slots - 1)
+
+    def moves(self, first, count):
+        return [move_record.unpack_from(self.data, self.moves_offset + (first + index) * move_record.size)
+                for index in range(count)]
+
+    def postings(self, first, count):
+        return [posting.unpack_from(self.data, self.postings_offset + (first + index) * posting.size)[0]
+                for index in range(count)]
+
+    def contents(self):  # every position: key -> (offsets, {move: [SAN, games, White wins, draws, Black wins]})
+        for index in range(self.slots):
+            key, first_posting, postings, first_move, moves = slot.unpack_from(self.data,
+                                                                              header.size + index * slot.size)
+            if postings:
+                position_moves = {move: [san.rstrip(b"\0").decode(), *counts]
+                                  for move, san, *counts in self.moves(first_move, moves)}
+                yield key, self.postings(first_posting, postings), position_moves
+
+    def close(self):
+        self.data.close()
+
+
+def segment_paths(database):  # the index's segments, in the order they were written
+    paths = glob.glob(glob.escape(database) + ".idx.*")
+    paths = [path for path in paths if path.rsplit(".", 1)[1].isdigit()]
+    return sorted(paths, key=lambda path: int(path.rsplit(".", 1)[1]))
+
+
+def build(database, jobs=None, plies=None):  # index the games not indexed yet; returns the number of games indexed
+    segments = [Segment(path) for path in segment_paths(database)]
+    start = max((segment.end for segment in segments), default=0)
+    number = int(segments[-1].path.rsplit(".", 1)[1]) + 1 if segments else 1
+    games = 0
+    if start < os.path.getsize(database):
+        ranges = split(database, start, jobs or os.cpu_count() or 1)
+        with multiprocessing.Pool(len(ranges)) as pool:
+            parts = pool.starmap(index_range, [(database, begin, end, plies) for begin, end in ranges])
+        postings, moves = {}, {}
+        for part_postings, part_moves, part_games in parts:
+            merge(postings, moves, part_postings.items(), part_moves)
+            games += part_games
+        write_segment(database + ".idx." + str(number), start, ranges[-1][1], postings, moves)
+        segments.append(Segment(database + ".idx." + str(number)))
+    if len(segments) > segment_limit:  # merge them, from their contents: nothing is parsed again
+        postings, moves = {}, {}
+        for segment in segments:
+            for key, offsets, position_moves in segment.contents():
+                merge(postings, moves, [(key, offsets)], {key: position_moves})
+        write_segment(database + ".idx.merged", 0, segments[-1].end, postings, moves)
+        for segment in segments:
+            segment.close()
+            os.remove(segment.path)
+        os.replace(database + ".idx.merged", database + ".idx.1")
+        segments = []
+    for segment in segments:
+        segment.close()
+    return games
+
+
+def merge(postings, moves, new_postings, new_moves):
+    for key, offsets in new_postings:
+        if key not in postings:
+            postings[key], moves[key] = [], {}
+        postings[key] += offsets
+        for move, (san, *counts) in new_moves[key].items():
+            if move not in moves[key]:
+                moves[key][move] = [san, 0, 0, 0, 0]
+            for index, count in enumerate(counts):
+                moves[key][move][index + 1] += count
+
+
+# The index as the UI reads it
+class Explorer:
+    def __init__(self, database):
+        self.database = database
+        self.segments = [Segment(path) for path in segment_paths(database)]
+
+    def lookup(self, key, games=3):
+        # ([[move, SAN, games, White wins, draws, Black wins]] most played first, games reaching the position, offsets
+        # of the first games that reached it)
+        moves, total, offsets = {}, 0, []
+        for segment in self.segments:
+            entry = segment.find(key)
+            if entry is None:
+                continue
+            first_posting, count, first_move, move_count = entry
+            total += count
+            if len(offsets) < games:
+                offsets += segment.postings(first_posting, min(count, games - len(offsets)))
+            for move, san, *counts in segment.moves(first_move, move_count):
+                if move not in moves:
+                    moves[move] = [move, san.rstrip(b"\0").decode(), 0, 0, 0, 0]
+                for index, number in enumerate(counts):
+                    moves[move][index + 2] += number
+        return sorted(moves.values(), key=lambda move: -move[2]), total, offsets
+
+    def game_tags(self, offset):  # the tags of the game at offset in the database
+        with open(self.database, "rb") as file:
+            file.seek(offset)
+            lines = []
+            for line in file:
+                if not line.startswith(b"["):
+                    break
+                lines.append(line)
+        return next(PGN.split_games(lines + [b"*"]))[1]
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the position explorer index of a PGN database")
+    parser.add_argument("file")
+    parser.add_argument("--jobs", type=int, help="worker processes, one per core by default")
+    parser.add_argument("--plies", type=int, help="index positions up to this depth only")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    games = build(args.file, args.jobs, args.plies)
+    elapsed = time.perf_counter() - start
+    print(f"{games} new games indexed in {elapsed:.1f} s: {games / elapsed if elapsed else 0:.0f} games/s, "
+          f"{len(segment_paths(args.file))} segments")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
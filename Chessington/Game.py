@@ -1,9 +1,13 @@
 import Board
 from Board import *
 from MoveTree import *
+from collections import Counter
+from Prefetch import Prefetch
 
 
 # The Game class manages calls to Enginegton, operations on the move tree, and stores game data
+# Legal moves and board situations are computed in-process by MoveGen (cached per position by MoveTree); Enginegton
+# is only asked to search
 
 class Game:
     def __init__(self, **kwargs):
@@ -12,43 +16,43 @@ class Game:
         self.from_position = kwargs["from_pos"]
         self.engine_on = kwargs["engine_on"]
         self.fen_dict = {0: "0", 1: "P", 2: "N", 3: "B", 5: "R", 9: "Q", 10: "K"}
+        self.fen_table = bytearray(256)  # Position.board byte -> fen character, for bytes.translate
+        for piece, char in self.fen_dict.items():
+            self.fen_table[piece] = ord(char)
+            self.fen_table[-piece & 0xFF] = ord(char.lower())
         self.legal_moves = []
         self.engine_turn = -self.user_orientation
-        self.engine_search_orientation = 0
         if kwargs["preexisting_tree"] is None:
             self.all_variations = MoveTree(**kwargs)
         else:
             self.all_variations = kwargs["preexisting_tree"]
         self.current_position = self.all_variations.root
         self.start_data = kwargs
-        self.repetitions = {}
+        self.repetitions = Counter([self.current_position.zobrist])  # Zobrist key -> occurrences on the current line
+        self.en_passant_file = -1  # the en passant file included in current_position's Zobrist key
+        self.book = kwargs["book"] if "book" in kwargs else None  # OpeningBook for games against the engine
+        self.cache = kwargs["cache"] if "cache" in kwargs else None  # EngineCache of the results of earlier searches
+        self.prefetch = kwargs["prefetch"] if "prefetch" in kwargs else Prefetch()  # the replies' legal moves
 
     def update(self, new_pos, enginegton):  # called on move_made() event
         events = [Event(50, board=0)]
         self.all_variations.add_move(new_pos, self.current_position, events)
-        self.legal_moves.clear()
-        if events[-1].ID == 1:
-            return events
-        self.current_position = new_pos
+        self.legal_moves = []
+        if events[-1].ID == 0:
+            return events  # the move is already in the tree, and the event takes the game to its position
+        self.go_to(new_pos)
         self.turn = -self.turn
 
-        self.get_legal_moves(events, enginegton)  # calls enginegton with "get"
+        self.prefetch.cancel(new_pos.zobrist)
+        self.get_legal_moves(events)
         if events[0].data["board"] > 1:
             return events  # if game over, return here to avoid starting the engine
 
-        fen = self.to_fen(self.current_position.position)
         if self.engine_on and self.turn == self.engine_turn:
-            self.start_engine(enginegton, fen)  # calls enginegton with "find"
-
-        if self.user_orientation == -1:  # check if fen needs to be adjusted for board flipping
-            fen = fen[::-1]
+            self.start_engine(enginegton)  # calls enginegton with "find"
 
-        if fen in self.repetitions:  # check if a position has occurred using fen string as key
-            self.repetitions[fen] += 1
-            if self.repetitions[fen] >= 3 and self.engine_on and self.turn != self.engine_turn:
-                events.append(Event(51))
-        else:
-            self.repetitions[fen] = 1
+        if self.repetitions[self.current_position.zobrist] >= 3 and self.engine_on and self.turn != self.engine_turn:
+            events.append(Event(51))
 
         return events
 
@@ -76,9 +80,9 @@ class Game:
             else:
                 events[0] = Event(50, board=3)
 
-    def get_engine_args(self, pref, fen):  # convert Game data for writing to enginegton_log.txt
+    def get_engine_args(self, pref, fen):  # convert Game data into an Enginegton request message
         pref += fen + "\n"
-        pref += str(self.n_val(self.turn)) + str(self.n_val(self.user_orientation)) + "\n"
+        pref += str(self.n_val(self.turn)) + "\n"
         for i in self.current_position.move:
             pref += str(i)
         pref += "\n"
@@ -92,87 +96,107 @@ class Game:
         else:
             return str(val)
 
-    def get_moves(self, enginegton):
+    def get_moves(self):
         events = [Event(50, board=0)]
-        self.legal_moves.clear()
-        self.get_legal_moves(events, enginegton)
+        self.legal_moves = []
+        self.get_legal_moves(events)
         return events
 
-    def start_engine(self, enginegton, fen=None):
-        if fen is None:
-            fen = self.to_fen(self.current_position.position)
-        self.engine_search_orientation = self.user_orientation
-        self.to_fen(self.current_position.position)
-        enginegton.post_message(self.get_engine_args("find\n", fen))
-        enginegton.wait_for_ok()
-
-    def get_legal_moves(self, events, enginegton):
-        enginegton.post_message(self.get_engine_args("get\n", self.to_fen(self.current_position.position)))
-        enginegton.wait_for_ok()
-        self.update_events(self.parse_answer(enginegton.get_gr()), events)
-
-    def parse_answer(self, res):  # convert engine's returned legal moves list
-        for i in range(len(res)):
-            if res[i] == "\n":
-                return [int(res[i + 1]), int(res[i + 2]), int(res[i + 3]), int(res[i + 4])]
-            if (i + 1) % 5 == 0:
-                self.legal_moves.append([int(res[i - 4]), int(res[i - 3])] + [int(res[i - 2]), int(res[i - 1])])
-                if 0 < int(res[i]) < 5:
-                    self.legal_moves[-1].append(int(res[i]))
-                else:
-                    self.legal_moves[-1].append(0)
-
-    def to_fen(self, pos):  # convert position to a fen string
-        fen = ""
-        for rank in pos:
-            for file in rank:
-                if file < 0:
-                    fen += self.fen_dict[abs(file)].lower()
-                else:
-                    fen += self.fen_dict[file]
-        return fen
+    def start_engine(self, enginegton):
+        if self.book is not None and self.engine_on:
+            move = self.book.choose(self.current_position.zobrist)
+            if move is not None and move in self.legal_moves:  # a book move is played without a search
+                enginegton.answer("find", "f/" + "".join(str(i) for i in move), lambda res: [Event(45, res=res)])
+                return
+        key = self.current_position.zobrist
+        if self.cache is not None:
+            result = self.cache.lookup(key)
+            if result is not None and result[0] in self.legal_moves:  # searched before, in this session or another
+                enginegton.answer("find", "f/" + "".join(str(i) for i in result[0]), lambda res: [Event(45, res=res)])
+                return
+        fen = self.to_fen(self.current_position)
+        enginegton.request(self.get_engine_args("find\n", fen), lambda res: self.store_result(key, res))
+
+    def store_result(self, key, res):  # "f/" move, then the evaluation, depth and node count of the search
+        lines = res.split("\n")
+        if self.cache is not None and len(lines) > 1:
+            evaluation, depth, nodes = lines[1].split()
+            kind = int(lines[0][6:])  # legal_moves keep the type of promotions only, as 0 < engine_promotion < 5
+            move = [int(i) for i in lines[0][2:6]] + [kind if 0 < kind < 5 else 0]
+            self.cache.store(key, move, float(evaluation), int(depth), int(nodes))
+        return [Event(45, res=lines[0])]
+
+    def get_legal_moves(self, events):
+        # legal moves and the board situation are generated once per position, and shared with its transpositions
+        transposition = self.all_variations.legal_moves(self.current_position, self.prefetch)
+        self.legal_moves = transposition.legal_moves
+        self.en_passant_file = transposition.en_passant_file
+        self.update_events(transposition.situation, events)
+        self.prefetch.start(self.all_variations, self.current_position, self.turn)  # for the next move
+
+    def to_fen(self, position):  # convert a Position's board to a fen string
+        return position.get_board().translate(self.fen_table).decode()
 
     # Move tree and current_position operations
 
     def set_to_position(self, pos_id):  # search move tree dictionary to identify the new position to set to
 
-        self.current_position = self.all_variations.key_search(pos_id)
+        self.go_to(self.all_variations.key_search(pos_id))
         if self.current_position != self.all_variations.root:
             self.turn = self.current_position.turn * -1
         else:
             self.turn = self.current_position.turn
         self.all_variations.depth = self.current_position.ply
-        if self.current_position.orientation != self.user_orientation:
-            self.current_position.reverse_rank_and_file()
-            Board.flip(self.current_position.position)
 
     def switch_position(self, direction):  # move up or down by 1 position
 
+        if direction == 1:
+            self.all_variations.load(self.current_position)  # its children may still be in a session file
         if direction == -1 and self.current_position.parent is not None:
-            self.current_position = self.current_position.parent
+            self.go_to(self.current_position.parent)
         elif direction == 1 and self.current_position.children:
-            self.current_position = self.current_position.children[0]
-        if self.current_position.orientation != self.user_orientation:
-            self.current_position.reverse_rank_and_file()
-            Board.flip(self.current_position.position)
+            self.go_to(self.current_position.children[0])
         if self.current_position != self.all_variations.root:
             self.turn = self.current_position.turn * -1
         else:
             self.turn = self.current_position.turn
 
+    def go_to(self, position):
+        # make position the current one, and update the repetition counts of the line from the root: positions are
+        # removed up to the common ancestor and added down to the new position, so a move or a takeback costs O(1)
+        current, target = self.current_position, position
+        left, entered = [], []
+        while current.depth > target.depth:
+            left.append(current)
+            current = current.parent
+        while target.depth > current.depth:
+            entered.append(target)
+            target = target.parent
+        while current is not target:
+            left.append(current)
+            current = current.parent
+            entered.append(target)
+            target = target.parent
+        self.repetitions.subtract(left_position.zobrist for left_position in left)
+        self.repetitions.update(entered_position.zobrist for entered_position in entered)
+        for key in {left_position.zobrist for left_position in left}:  # drop keys no longer on the line
+            if self.repetitions[key] <= 0:
+                del self.repetitions[key]
+        self.current_position = position
+
     def trim_tree(self):  # delete a subbranch starting at current position
         if self.current_position != self.all_variations.root:
             from_pos = self.current_position
             # removes all moves after from_pos inclusive
             self.set_to_position(from_pos.parent.key)
-            self.current_position.children.remove(from_pos)
+            self.all_variations.remove_branch(from_pos)
 
     def get_kwargs(self, engine_promotion=0):  # used by Chessington to relay game data to Board.update() functions
-        kwargs = {"turn": self.turn, "pl_colour": self.user_orientation, "legal_moves": self.legal_moves,
-                  "castle": self.current_position.castling_rights}
+        kwargs = {"turn": self.turn, "legal_moves": self.legal_moves, "castle": self.current_position.castling_rights,
+                  "zobrist": self.current_position.zobrist, "en_passant": self.en_passant_file}
         if 0 < engine_promotion < 5:
             kwargs["engine_promo"] = engine_promotion
         return kwargs
 
     def get_draw_kwargs(self):  # used by Chessington to relay game data to Board.draw_pos()
-        return {"move": self.current_position.move, "turn": self.turn, "orientation": self.user_orientation}
+        return {"move": self.current_position.move, "turn": self.turn}
@@ -0,0 +1,178 @@
+import os
+import queue
+import struct
+import threading
+from Position import Position
+import Session
+
+# Crash recovery: an append-only log of the changes made to a game's MoveTree since its session file was last written,
+# fsynced by a writer thread and compacted into FILE.compact once it holds more than `threshold` records
+
+added, removed, promoted, current, engine = 1, 2, 3, 4, 5  # record types
+record = struct.Struct("<BIIhBbBbQ16s")
+# type, key, parent key (added) or key of the sibling swapped with (promoted), packed move, piece, side that moved,
+# castling rights, captured piece, Zobrist key, notation (added) or engine move (engine)
+engine_move_format = struct.Struct("<5b")
+
+
+def tree_key(key):  # MoveTree key -> record field: the root's "r" is written as 0
+    return 0 if key == "r" else key
+
+
+class Journal:
+    def __init__(self, session_path, tree, fresh=False, threshold=10000):
+        self.session_path = session_path
+        self.path = session_path + ".journal"
+        self.compacted = session_path + ".compact"
+        self.tree = tree
+        self.threshold = threshold
+        self.compact_at = threshold  # compact once the journal holds more records than this
+        self.pending = []  # (type, key, position, extra) since the last flush
+        self.current_key = None  # the current position written with the last flush
+        if fresh or not os.path.exists(session_path):  # a tree the file does not hold starts the session over
+            for path in (self.path, self.compacted):
+                if os.path.exists(path):
+                    os.remove(path)
+            Session.save_session(session_path, tree, tree.root)
+        self.records = os.path.getsize(self.path) // record.size if os.path.exists(self.path) else 0
+        self.batches = queue.Queue()  # packed records for the writer thread; None stops it
+        self.writer = threading.Thread(target=self.write_records, daemon=True)
+        self.writer.start()
+
+    # MoveTree and Game report their changes here
+    def added(self, position):
+        self.pending.append((added, position.key, position, tree_key(position.parent.key)))
+
+    def removed(self, position):
+        self.pending.append((removed, position.key, position, 0))
+
+    def promoted(self, position):  # before the swap
+        sibling = position.parent.children[position.index - 1]
+        self.pending.append((promoted, position.key, position, sibling.key))
+
+    def engine_move(self, position):
+        self.pending.append((engine, position.key, position, 0))
+
+    def flush(self, current_position):  # once per frame: hand the frame's changes to the writer thread
+        if current_position.key != self.current_key:
+            self.pending.append((current, current_position.key, current_position, 0))
+            self.current_key = current_position.key
+        if not self.pending:
+            return
+        data = bytearray()
+        for kind, key, position, extra in self.pending:
+            if kind == added:  # packed now, so the notation includes the check marks added after the move
+                data += record.pack(kind, key, extra, position.packed_move, position.piece, position.turn,
+                                    position.castling_rights, position.material[0] if position.material else 0,
+                                    position.zobrist, position.move_notation.encode()[:16])
+            elif kind == engine:
+                if position.zobrist not in self.tree.transpositions:
+                    continue  # deleted in the same frame
+                move = self.tree.transpositions[position.zobrist].engine_move
+                data += record.pack(kind, 0, 0, 0, 0, 0, 0, 0, position.zobrist, engine_move_format.pack(*move))
+            else:
+                data += record.pack(kind, tree_key(key), extra, 0, 0, 0, 0, 0, 0, b"")
+        self.pending = []
+        self.batches.put(bytes(data))
+
+    def close(self):  # write what is left and stop the writer thread
+        self.batches.put(None)
+        self.writer.join()
+
+    def discard(self):  # once the session file has been written with the whole tree, after close()
+        for path in (self.path, self.compacted):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # writer thread
+    def write_records(self):
+        file = open(self.path, "ab")
+        running = True
+        while running:
+            batches = [self.batches.get()]
+            while not self.batches.empty():  # one fsync for every batch that is waiting
+                batches.append(self.batches.get())
+            if None in batches:
+                batches = batches[:batches.index(None)]
+                running = False
+            data = b"".join(batches)
+            if data:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+                self.records += len(data) // record.size
+            if running and self.records > self.compact_at:
+                file.close()
+                self.compact()
+                file = open(self.path, "ab")
+        file.close()
+
+    def compact(self):  # fold the journal into the compacted session, on the writer thread
+        tree, position = Session.open_session(latest(self.session_path))
+        position = replay(self.path, tree, position)
+        try:
+            Session.save_session(self.compacted, tree, position)
+        except OSError:
+            self.compact_at = self.records + self.threshold  # not again until as many records have been added
+            return
+        open(self.path, "wb").close()
+        self.records = 0
+        self.compact_at = self.threshold
+
+
+# recovery
+def latest(session_path):  # the file a crashed session's tree is restored from: its last compaction, if any
+    compacted = session_path + ".compact"
+    return compacted if os.path.exists(compacted) else session_path
+
+
+def recover(session_path, tree, position):
+    # after a crash: replay the journal onto tree, opened from latest(), and write the result as the session file, so
+    # the live tree maps no compaction; returns the current position the journal last recorded, or position
+    path = session_path + ".journal"
+    if not os.path.exists(path) and latest(session_path) == session_path:
+        return position
+    position = replay(path, tree, position)
+    Session.save_session(session_path, tree, position)
+    for leftover in (path, session_path + ".compact"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    return position
+
+
+def replay(path, tree, position):
+    # apply the journal at path to tree, opened from latest(); returns the current position it last recorded, or
+    # position if it recorded none. Idempotent, since a crash during compaction replays records the tree already has
+    if not os.path.exists(path):
+        return position
+    with open(path, "rb") as file:
+        data = file.read()
+    data = data[:len(data) - len(data) % record.size]  # a record cut short by a crash is dropped
+    if data:
+        tree.load_all()  # the records refer to positions by key, anywhere in the tree
+    journal, tree.journal = tree.journal, None  # replayed changes are already in the journal
+    for kind, key, extra, packed_move, piece, turn, castle, captured, zobrist, text in record.iter_unpack(data):
+        key = "r" if key == 0 else key
+        lookup = tree.position_lookup  # remove_branch() may replace the dict
+        if kind == added:
+            parent = "r" if extra == 0 else extra
+            if key not in lookup and parent in lookup:
+                tree.insert(Position.restore(lookup[parent], key, turn, packed_move, piece, castle,
+                                             [captured] if captured else [], zobrist,
+                                             text.rstrip(b"\0").decode(), tree.snapshot_interval))
+        elif kind == removed:
+            if key in lookup:
+                tree.remove_branch(lookup[key])
+        elif kind == promoted:
+            if key in lookup and lookup[key].index > 0 \
+                    and lookup[key].parent.children[lookup[key].index - 1].key == extra:
+                tree.promote_variation(lookup[key])
+        elif kind == current:
+            if key in lookup:
+                position = lookup[key]
+        elif kind == engine:
+            if zobrist in tree.transpositions:
+                tree.transpositions[zobrist].engine_move = list(engine_move_format.unpack(text[:5]))
+    tree.journal = journal
+    tree.part_tree = None
+    return position if position.key != 0 else tree.root
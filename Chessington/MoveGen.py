@@ -0,0 +1,357 @@
+# Pure-Python bitboard move generator, used by Game for legal moves and board situations, so that Enginegton is only
+# involved in searches. It does not depend on pygame or on the engine binary, and can be used by analysis tooling.
+#
+# Squares are numbered like in Enginegton: 0 is a8, 7 is h8, 56 is a1, 63 is h1 (square = rank * 8 + file, with
+# White at the bottom). Pieces use the codes of Board.position (1 pawn, 2 knight, 3 bishop, 5 rook, 9 queen,
+# 10 king, negative for Black), and castling rights use the integer of Position.castling_rights
+# (White's rights << 2 + Black's rights, 2 for short and 1 for long castling).
+# Moves are (origin, destination, type) tuples, with the types of Enginegton's Move struct:
+# 0 ordinary, 1-4 promotion to knight, bishop, rook, queen, 5 short castle, 6 long castle, 7-8 en passant
+
+FULL = (1 << 64) - 1
+material_values = {1: 10, 2: 30, 3: 35, 5: 50, 9: 90, 10: 0}  # as in Enginegton's PieceGroup
+promotion_pieces = {1: 2, 2: 3, 3: 5, 4: 9}  # move type -> piece, as in Board.promotion_dict
+
+
+def on_board(rank, file):
+    return 0 <= rank < 8 and 0 <= file < 8
+
+
+def step_table(steps):
+    table = []
+    for sqr in range(64):
+        rank, file = divmod(sqr, 8)
+        bits = 0
+        for dr, df in steps:
+            if on_board(rank + dr, file + df):
+                bits |= 1 << ((rank + dr) * 8 + file + df)
+        table.append(bits)
+    return table
+
+
+def ray_table(dr, df):
+    table = []
+    for sqr in range(64):
+        rank, file = divmod(sqr, 8)
+        bits = 0
+        rank, file = rank + dr, file + df
+        while on_board(rank, file):
+            bits |= 1 << (rank * 8 + file)
+            rank, file = rank + dr, file + df
+        table.append(bits)
+    return table
+
+
+knight_attacks = step_table([(1, 2), (2, 1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-1, -2), (-2, -1)])
+king_attacks = step_table([(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)])
+# squares attacked by a pawn of the given colour standing on a square
+pawn_attacks = {1: step_table([(-1, -1), (-1, 1)]), -1: step_table([(1, -1), (1, 1)])}
+
+# rays in increasing square order (the nearest blocker is the lowest set bit) and in decreasing order (highest bit)
+rook_rays_up = [ray_table(1, 0), ray_table(0, 1)]
+rook_rays_down = [ray_table(-1, 0), ray_table(0, -1)]
+bishop_rays_up = [ray_table(1, 1), ray_table(1, -1)]
+bishop_rays_down = [ray_table(-1, -1), ray_table(-1, 1)]
+
+# squares strictly between two squares on a common line, 0 otherwise
+between = [[0] * 64 for _ in range(64)]
+for _rays in (rook_rays_up, rook_rays_down, bishop_rays_up, bishop_rays_down):
+    for _ray in _rays:
+        for _a in range(64):
+            _bits = _ray[_a]
+            while _bits:
+                _b = (_bits & -_bits).bit_length() - 1
+                between[_a][_b] = _ray[_a] & ~_ray[_b] & ~(1 << _b)
+                _bits &= _bits - 1
+
+castling_paths = {  # colour -> ((rights bit, king destination, squares to be empty, squares not attacked, rook square))
+    1: ((2, 62, (1 << 61) | (1 << 62), (1 << 61) | (1 << 62), 63),
+        (1, 58, (1 << 57) | (1 << 58) | (1 << 59), (1 << 58) | (1 << 59), 56)),
+    -1: ((2, 6, (1 << 5) | (1 << 6), (1 << 5) | (1 << 6), 7),
+         (1, 2, (1 << 1) | (1 << 2) | (1 << 3), (1 << 2) | (1 << 3), 0))
+}
+
+
+def slider_attacks(sqr, occupied, rays_up, rays_down):
+    attacks = 0
+    for ray in rays_up:
+        bits = ray[sqr]
+        blockers = bits & occupied
+        if blockers:
+            bits &= ~ray[(blockers & -blockers).bit_length() - 1]
+        attacks |= bits
+    for ray in rays_down:
+        bits = ray[sqr]
+        blockers = bits & occupied
+        if blockers:
+            bits &= ~ray[blockers.bit_length() - 1]
+        attacks |= bits
+    return attacks
+
+
+def rook_attacks(sqr, occupied):
+    return slider_attacks(sqr, occupied, rook_rays_up, rook_rays_down)
+
+
+def bishop_attacks(sqr, occupied):
+    return slider_attacks(sqr, occupied, bishop_rays_up, bishop_rays_down)
+
+
+def squares_of(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def to_square(rank, file):  # Board coordinates -> square index
+    return rank * 8 + file
+
+
+def to_coordinates(sqr):  # square index -> Board coordinates
+    return sqr >> 3, sqr & 7
+
+
+class MoveGen:
+    def __init__(self, squares, turn, castle, en_passant=-1):
+        self.squares = squares  # 64 piece codes
+        self.turn = turn  # side to move
+        self.castle = castle
+        self.en_passant = en_passant  # square a pawn can capture onto en passant, -1 if none
+        self.pieces = {code: 0 for code in (1, 2, 3, 5, 9, 10, -1, -2, -3, -5, -9, -10)}
+        self.colours = {1: 0, -1: 0}
+        for sqr, piece in enumerate(squares):
+            if piece != 0:
+                self.pieces[piece] |= 1 << sqr
+                self.colours[1 if piece > 0 else -1] |= 1 << sqr
+        self.occupied = self.colours[1] | self.colours[-1]
+        self.check = 0  # number of pieces giving check, set by legal_moves()
+        self.moves = None
+
+    @classmethod
+    def from_board(cls, position, turn, castle, last_move=None):
+        # position, last_move: Board.position and Position.move
+        squares = [piece for rank in position for piece in rank]
+        en_passant = -1
+        if last_move is not None and len(last_move) >= 4 and last_move[0] != -1:
+            origin = to_square(last_move[0], last_move[1])
+            destination = to_square(last_move[2], last_move[3])
+            if squares[destination] == -turn and abs(origin - destination) == 16:
+                en_passant = (origin + destination) >> 1
+        return cls(squares, turn, castle, en_passant)
+
+    # attacks
+
+    def attackers(self, sqr, colour, occupied):  # pieces of the given colour attacking a square
+        sign = colour
+        return ((pawn_attacks[-colour][sqr] & self.pieces[sign])
+                | (knight_attacks[sqr] & self.pieces[2 * sign])
+                | (king_attacks[sqr] & self.pieces[10 * sign])
+                | (rook_attacks(sqr, occupied) & (self.pieces[5 * sign] | self.pieces[9 * sign]))
+                | (bishop_attacks(sqr, occupied) & (self.pieces[3 * sign] | self.pieces[9 * sign])))
+
+    def attacked(self, colour, occupied):  # all squares attacked by the given colour
+        sign = colour
+        attacks = 0
+        for sqr in squares_of(self.pieces[sign]):
+            attacks |= pawn_attacks[colour][sqr]
+        for sqr in squares_of(self.pieces[2 * sign]):
+            attacks |= knight_attacks[sqr]
+        for sqr in squares_of(self.pieces[10 * sign]):
+            attacks |= king_attacks[sqr]
+        for sqr in squares_of(self.pieces[5 * sign] | self.pieces[9 * sign]):
+            attacks |= rook_attacks(sqr, occupied)
+        for sqr in squares_of(self.pieces[3 * sign] | self.pieces[9 * sign]):
+            attacks |= bishop_attacks(sqr, occupied)
+        return attacks
+
+    def pins(self, king, own):  # pinned square -> squares it may still move to
+        pinned = {}
+        sign = -self.turn
+        orthogonal = self.pieces[5 * sign] | self.pieces[9 * sign]
+        diagonal = self.pieces[3 * sign] | self.pieces[9 * sign]
+        for rays, up, sliders in ((rook_rays_up, True, orthogonal), (rook_rays_down, False, orthogonal),
+                                  (bishop_rays_up, True, diagonal), (bishop_rays_down, False, diagonal)):
+            if not sliders:
+                continue
+            for ray in rays:
+                blockers = ray[king] & self.occupied
+                if not blockers:
+                    continue
+                first = (blockers & -blockers).bit_length() - 1 if up else blockers.bit_length() - 1
+                if not (own >> first) & 1:
+                    continue
+                blockers &= ~(1 << first)
+                blockers &= ray[first]
+                if not blockers:
+                    continue
+                second = (blockers & -blockers).bit_length() - 1 if up else blockers.bit_length() - 1
+                if (sliders >> second) & 1:
+                    pinned[first] = between[king][second] | (1 << second)
+        return pinned
+
+    # move generation
+
+    def legal_moves(self):
+        if self.moves is not None:
+            return self.moves
+        turn = self.turn
+        own = self.colours[turn]
+        enemy = self.colours[-turn]
+        king_bits = self.pieces[10 * turn]
+        moves = []
+        self.moves = moves
+        if not king_bits:
+            return moves
+        king = king_bits.bit_length() - 1
+
+        checkers = self.attackers(king, -turn, self.occupied)
+        self.check = bin(checkers).count("1")
+        danger = self.attacked(-turn, self.occupied & ~king_bits)  # the king cannot hide behind itself
+
+        for destination in squares_of(king_attacks[king] & ~own & ~danger):
+            moves.append((king, destination, 0))
+        if self.check > 1:
+            return moves
+
+        target = ~own & FULL  # squares pieces may move to, narrowed to blocking or capturing if in check
+        if self.check == 1:
+            checker = checkers.bit_length() - 1
+            target = checkers | between[king][checker]
+        pinned = self.pins(king, own)
+
+        occupied = self.occupied
+        for piece, bits in ((2, self.pieces[2 * turn]), (3, self.pieces[3 * turn]),
+                            (5, self.pieces[5 * turn]), (9, self.pieces[9 * turn])):
+            for origin in squares_of(bits):
+                if piece == 2:
+                    if origin in pinned:
+                        continue  # a pinned knight can never move
+                    reach = knight_attacks[origin]
+                elif piece == 3:
+                    reach = bishop_attacks(origin, occupied)
+                elif piece == 5:
+                    reach = rook_attacks(origin, occupied)
+                else:
+                    reach = rook_attacks(origin, occupied) | bishop_attacks(origin, occupied)
+                reach &= target & ~own
+                if origin in pinned:
+                    reach &= pinned[origin]
+                for destination in squares_of(reach):
+                    moves.append((origin, destination, 0))
+
+        self.pawn_moves(moves, turn, own, enemy, king, target, pinned)
+
+        if self.check == 0:
+            self.castling_moves(moves, turn, king, danger)
+        return moves
+
+    def pawn_moves(self, moves, turn, own, enemy, king, target, pinned):
+        forward = -8 * turn
+        start_rank = 6 if turn == 1 else 1
+        last_rank = 0 if turn == 1 else 7
+        empty = ~self.occupied
+        for origin in squares_of(self.pieces[turn]):
+            allowed = target & pinned.get(origin, FULL)
+            reach = pawn_attacks[turn][origin] & enemy
+            single = origin + forward
+            if (empty >> single) & 1:
+                reach |= 1 << single
+                if origin >> 3 == start_rank and (empty >> (single + forward)) & 1:
+                    reach |= 1 << (single + forward)
+            reach &= allowed
+            for destination in squares_of(reach):
+                if destination >> 3 == last_rank:
+                    for promotion in range(1, 5):
+                        moves.append((origin, destination, promotion))
+                else:
+                    moves.append((origin, destination, 0))
+            if self.en_passant >= 0 and (pawn_attacks[turn][origin] >> self.en_passant) & 1:
+                if self.en_passant_legal(origin, turn, king):
+                    moves.append((origin, self.en_passant, 7 if turn == 1 else 8))
+
+    def en_passant_legal(self, origin, turn, king):
+        # the captured pawn leaves the board too, so the capture is verified by checking the king after making it
+        captured = self.en_passant + 8 * turn
+        occupied = (self.occupied & ~(1 << origin) & ~(1 << captured)) | (1 << self.en_passant)
+        enemy = self.colours[-turn] & ~(1 << captured)
+        sign = -turn
+        if pawn_attacks[turn][king] & self.pieces[sign] & enemy:
+            return False
+        if knight_attacks[king] & self.pieces[2 * sign]:
+            return False
+        if rook_attacks(king, occupied) & (self.pieces[5 * sign] | self.pieces[9 * sign]):
+            return False
+        if bishop_attacks(king, occupied) & (self.pieces[3 * sign] | self.pieces[9 * sign]):
+            return False
+        return True
+
+    def castling_moves(self, moves, turn, king, danger):
+        rights = self.castle >> 2 if turn == 1 else self.castle & 3
+        if not rights:
+            return
+        for bit, destination, empty, safe, rook in castling_paths[turn]:
+            if not rights & bit or self.squares[rook] != 5 * turn or king != (60 if turn == 1 else 4):
+                continue
+            if empty & self.occupied or safe & danger:
+                continue
+            moves.append((king, destination, 5 if bit == 2 else 6))
+
+    # board situation
+
+    def insufficient_material(self):
+        # the Enginegton rule: a side cannot force mate with only two knights, or with less than a rook and no pawns
+        def insufficient(colour):
+            pieces = [piece for piece in self.squares if piece * colour > 0]
+            if len(pieces) == 3 and pieces.count(2 * colour) == 2:
+                return True
+            return sum(material_values[abs(piece)] for piece in pieces) < 50 and colour not in pieces
+        return insufficient(1) and insufficient(-1)
+
+    def situation(self):  # [check, checkmate, stalemate, insufficient material], as in Enginegton's "get" answer
+        moves = self.legal_moves()
+        check = int(self.check > 0)
+        return [check, int(check == 1 and not moves), int(check == 0 and not moves),
+                int(self.insufficient_material())]
+
+    def board_moves(self):  # legal moves in Board coordinates: [rank, file, rank, file, promotion]
+        out = []
+        for origin, destination, kind in self.legal_moves():
+            out.append(list(to_coordinates(origin)) + list(to_coordinates(destination))
+                       + [kind if 0 < kind < 5 else 0])
+        return out
+
+    # making moves, for tooling that walks the move tree without a Board (e.g. perft)
+
+    def make(self, move):
+        origin, destination, kind = move
+        squares = self.squares.copy()
+        turn = self.turn
+        piece = squares[origin]
+        squares[origin] = 0
+        squares[destination] = promotion_pieces[kind] * turn if 0 < kind < 5 else piece
+        if kind == 5:
+            squares[destination + 1], squares[destination - 1] = 0, 5 * turn
+        elif kind == 6:
+            squares[destination - 2], squares[destination + 1] = 0, 5 * turn
+        elif kind == 7 or kind == 8:
+            squares[destination + 8 * turn] = 0
+
+        white, black = self.castle >> 2, self.castle & 3
+        if piece == 10:
+            white = 0
+        elif piece == -10:
+            black = 0
+        for sqr in (origin, destination):
+            if sqr == 63:
+                white &= ~2
+            elif sqr == 56:
+                white &= ~1
+            elif sqr == 7:
+                black &= ~2
+            elif sqr == 0:
+                black &= ~1
+        en_passant = -1
+        if abs(piece) == 1 and abs(origin - destination) == 16:
+            en_passant = (origin + destination) >> 1
+        return MoveGen(squares, -turn, (white << 2) + black, en_passant)
@@ -1,21 +1,45 @@
 from Position import *
 from Event import *
+from MoveGen import MoveGen
+import Zobrist
+import sys
+
+
+# The data of a position that does not depend on the moves that led to it, shared by every node of the tree that
+# reaches the position (the same Zobrist key) through a different move order
+class Transposition:
+    __slots__ = ("positions", "legal_moves", "situation", "en_passant_file", "engine_move")
+
+    def __init__(self):
+        self.positions = []  # the nodes with this key, in the order they were added
+        self.legal_moves = None  # MoveGen.board_moves(), once a node has been visited
+        self.situation = None  # MoveGen.situation()
+        self.en_passant_file = -1  # Zobrist.en_passant_file(), which the key already depends on
+        self.engine_move = None  # the move Enginegton recommended in Analysis: [rank, file, rank, file, promotion]
 
 
 class MoveTree:
     def __init__(self, **kwargs):
         self.root = Position(key="r", material=[], **kwargs)
-        # the maximum number of children a position can lead to
-        self.branch_limit = 5
-        # the current branch depth
+        self.root.zobrist = Zobrist.full_key(kwargs["position"], kwargs["side_to_move"], kwargs["castle"], kwargs["move"])
         self.position_lookup = {"r": self.root}
-        self.branch_limit = 5  # controls how many branches can be started from one position
-        self.tree_height = 0
+        self.next_key = 1  # keys are allocated in order and never reused; 0 marks a position outside the tree
+        self.peak_size = 1  # the most positions the lookup dicts have held since they were last compacted
+        self.tree_height = 0  # the current branch depth
+        self.snapshot_interval = Position.snapshot_interval  # plies between positions that keep their full board
+        self.transpositions = {}  # Zobrist key -> Transposition, for every position in the tree
+        self.part_tree = None  # the lines drawn by the variations UI: depth -> positions, see get_part_tree()
+        self.part_heads = []  # the first position of each line of part_tree
+        self.unloaded = {}  # key -> record, for the positions of an opened session whose children are still on disk
+        self.source = None  # the Session the unloaded children are read from
+        self.journal = None  # the Journal that records every change to the tree, if the session has one
+        self.index(self.root)
 
     def key_search(self, key):
         return self.position_lookup[key]
 
     def add_move(self, new_pos, current_pos, events):
+        self.load(current_pos)
 
         new_pos.ply = current_pos.ply
         if new_pos.turn == 1:
@@ -24,44 +48,165 @@ class MoveTree:
         if new_pos.turn == -1 and current_pos == self.root:
             new_pos.update_notation("... ", True)
 
-        if len(current_pos.children) >= self.branch_limit:
-            events.append(Event(1, direction=-1))  # if branching limit is crossed, the app will take that move back
-            return
-        callback = []
-        if self.pos_in_tree(current_pos.children, new_pos.move_notation, callback) and current_pos.children:
-            events.append(Event(0, position_key=current_pos.children[callback[0]].key))
-            return  # if the position is already in the tree, spawn a takeback(1) event
-        if self.tree_height == self.branch_limit and current_pos.children:
-            events.append(Event(0, position_key=current_pos.children[0].key))
-            return  # if branch limit is exceeded, spawn a takeback(-1) event and do not add the position into the tree
-
-        new_pos.captured = new_pos.captured + current_pos.captured  # increment the captured pieces list
-        new_pos.key = id(new_pos)  # generate the id from Position instance id
-        current_pos.children.append(new_pos)
-        new_pos.parent = current_pos
+        existing = self.find_child(current_pos, new_pos.zobrist)
+        if existing is not None:
+            events.append(Event(0, position_key=existing.key))
+            return  # if the move is already in the tree, go to its position instead of adding it again
+
+        new_pos.key = self.next_key
+        self.next_key += 1
+        new_pos.attach(current_pos, self.snapshot_interval)  # from here on, the position only stores its delta
         self.position_lookup[new_pos.key] = new_pos
+        self.peak_size = max(self.peak_size, len(self.position_lookup))
+        self.index(new_pos)
+        if self.journal is not None:
+            self.journal.added(new_pos)
+        if self.part_tree is not None and new_pos.index == 0:
+            for depth, head in enumerate(self.part_heads):
+                if head is new_pos.head:  # a move at the end of a drawn line extends it
+                    self.part_tree[depth].append(new_pos)
+
+    # transpositions
+    def index(self, position):
+        if position.zobrist not in self.transpositions:
+            self.transpositions[position.zobrist] = Transposition()
+        self.transpositions[position.zobrist].positions.append(position)
+
+    def find_child(self, parent, zobrist):
+        # a move is identified by the position it leads to, so a parent's child for a move is found among the (few)
+        # nodes of the tree with the resulting key, whatever the number of children the parent has
+        if zobrist not in self.transpositions:
+            return None
+        for position in self.transpositions[zobrist].positions:
+            if position.parent is parent:
+                return position
+        return None
+
+    def transposition(self, position):
+        return self.transpositions[position.zobrist]
+
+    def legal_moves(self, position, prefetch=None):
+        # the Transposition of position, with its legal moves and board situation generated the first time any node
+        # with the key is visited, so stepping back through a line or over a transposition never generates them again;
+        # taken from prefetch (a Prefetch) if it has generated them already
+        transposition = self.transpositions[position.zobrist]
+        prefetched = prefetch.take(position.zobrist) if prefetch is not None and transposition.legal_moves is None \
+            else None
+        if prefetched is not None:
+            transposition.legal_moves, transposition.situation, transposition.en_passant_file = prefetched
+        elif transposition.legal_moves is None:
+            board, move = position.position, position.move
+            turn = position.turn if position.parent is None else -position.turn
+            generator = MoveGen.from_board(board, turn, position.castling_rights, move)
+            transposition.legal_moves = generator.board_moves()
+            transposition.situation = generator.situation()
+            transposition.en_passant_file = Zobrist.en_passant_file(board, move)
+        return transposition
+
+    def set_engine_move(self, position, move):  # the move Enginegton recommends, for position and its transpositions
+        self.transpositions[position.zobrist].engine_move = move
+        if self.journal is not None:
+            self.journal.engine_move(position)
+
+    def transposes_to(self, position):  # the other nodes of the tree with the same position, in the order they were added
+        return [other for other in self.transpositions[position.zobrist].positions if other is not position]
+
+    def remove_branch(self, position):
+        # cut position and its descendants from the tree, and drop every reference the tree holds to them; the links
+        # between the removed positions are cut too, so they are freed as soon as the caller lets go of position
+        if self.journal is not None:
+            self.journal.removed(position)
+        parent = position.parent
+        parent.children.remove(position)
+        self.relink(parent)
+        branch = [position]
+        while branch:
+            removed = branch.pop()
+            branch += removed.children
+            del self.position_lookup[removed.key]
+            transposition = self.transpositions[removed.zobrist]
+            transposition.positions.remove(removed)
+            if not transposition.positions:
+                del self.transpositions[removed.zobrist]
+            Position.decoded.pop(id(removed), None)
+            self.unloaded.pop(removed.key, None)
+            removed.children = []
+            removed.parent = None
+            removed.key = 0
+        if len(self.position_lookup) * 4 < self.peak_size:  # dicts do not shrink when keys are deleted
+            self.position_lookup = {key: value for key, value in self.position_lookup.items()}
+            self.transpositions = {key: value for key, value in self.transpositions.items()}
+            self.peak_size = len(self.position_lookup)
+
+    def memory_usage(self):  # bytes held by the tree: its positions, the lookup dicts and the transposition data
+        size = sys.getsizeof(self.position_lookup) + sys.getsizeof(self.transpositions)
+        for position in self.position_lookup.values():
+            size += position.footprint()
+        for transposition in self.transpositions.values():
+            size += sys.getsizeof(transposition) + sys.getsizeof(transposition.positions)
+            if transposition.legal_moves is not None:
+                size += sys.getsizeof(transposition.legal_moves)
+                size += sum(sys.getsizeof(move) for move in transposition.legal_moves)
+        return size
+
+    # lazy loading
+    # a tree opened from a session file (see Session) starts with only the positions on the way to the saved current
+    # position; the children of every other position are decoded the first time something needs them
+    def load(self, position):
+        if position.key in self.unloaded:
+            self.source.load_children(self, position, self.unloaded.pop(position.key))
+
+    def load_all(self):
+        while self.unloaded:
+            self.load(self.position_lookup[next(iter(self.unloaded))])
+
+    def insert(self, position):  # a position restored by Session or Journal, already linked to its parent
+        self.position_lookup[position.key] = position
+        self.peak_size = max(self.peak_size, len(self.position_lookup))
+        self.next_key = max(self.next_key, position.key + 1)
+        self.index(position)
+
+    def line(self, head):  # Position.line(), loading the line as it goes
+        line = [head]
+        self.load(head)
+        while line[-1].children:
+            line.append(line[-1].children[0])
+            self.load(line[-1])
+        return line
+
+    def promote_variation(self, position):  # swap position with its previous sibling
+        if self.journal is not None:
+            self.journal.promoted(position)
+        siblings = position.parent.children
+        index = position.index
+        siblings[index - 1], siblings[index] = siblings[index], siblings[index - 1]
+        self.relink(position.parent)
+
+    def relink(self, parent):  # update the cached indices and line heads after parent.children has changed
+        for index, child in enumerate(parent.children):
+            child.index = index
+            head = child if index > 0 else parent.head
+            position = child
+            while position.head is not head:  # the heads only change along the first-child line
+                position.head = head
+                if not position.children:
+                    break
+                position = position.children[0]
+        self.part_tree = None
 
     # part tree
-    def get_part_tree(self, key, part_tree):
+    # the part tree is the part of the tree drawn by the variations UI: depth 0 is the main line, and each deeper line
+    # is the variation the path to the current position branches into, from its first move to its end. These lines
+    # are the first-child lines of the heads on the path, so the part tree only changes when the current position
+    # moves to another line: it is cached, and extended in place when a move is added at the end of one of its lines.
+    def get_part_tree(self, key):
         position = self.position_lookup[key]
-        position.tree_backtrack(part_tree, False)
-        self.tree_height = max(part_tree.keys())
-        if position.children:
-            position.children[0].follow_line(part_tree, self.tree_height)
-        return part_tree
-
-    @staticmethod
-    def pos_in_tree(siblings, new_pos_notation, callback):
-        # this function compares moves by notation - in case the existing position ends with check, checkmate or
-        # stalemate symbols, these symbols are added for the comparison since the incoming position does not have
-        # them yet: its notation is updated later on in Game.update(), when Enginegton is called
-        # to define the legal moves for the incoming position, and one of these situations is detected.
-        for index, sibling in enumerate(siblings):
-            if sibling.move_notation[-1] == "+" or sibling.move_notation[-1] == "=" or sibling.move_notation[-1] == "#":
-                if new_pos_notation + sibling.move_notation[-1] == sibling.move_notation:
-                    callback.append(index)
-                    return True
-            if sibling.move_notation == new_pos_notation:
-                callback.append(index)
-                return True
-        return False
+        if self.part_tree is None or position.head is not self.part_heads[-1]:
+            heads = [position.head]
+            while heads[-1].parent is not None:
+                heads.append(heads[-1].parent.head)
+            heads.reverse()
+            self.part_heads = heads
+            self.part_tree = {depth: self.line(head) for depth, head in enumerate(heads)}
+        self.tree_height = len(self.part_heads) - 1
+        return self.part_tree
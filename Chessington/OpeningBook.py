@@ -0,0 +1,127 @@
+import argparse
+import mmap
+import random
+import struct
+import sys
+import time
+from MoveGen import to_square
+import PGN
+
+# Opening book: the moves played from each position of a PGN collection, weighted as in Polyglot books, in a sorted
+# binary file that is memory-mapped and binary-searched by Zobrist key
+# Usage: python OpeningBook.py PGN [PGN ...] --out FILE [--plies N] [--min-count N] [--lenient]
+
+entry = struct.Struct("<QHHI")  # Zobrist key, move, weight, count
+promotion_kinds = {2: 1, 3: 2, 5: 3, 9: 4}  # promoted piece -> MoveGen move type
+scores = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}  # result -> (White's score, Black's score)
+
+
+def pack_move(origin, destination, promotion):
+    return origin | destination << 6 | promotion << 12
+
+
+def unpack_move(move):  # -> [rank, file, rank, file, promotion], the format of Enginegton's moves
+    origin, destination = move & 63, (move >> 6) & 63
+    return [origin >> 3, origin & 7, destination >> 3, destination & 7, move >> 12]
+
+
+def count_moves(games, plies, moves=None):
+    # moves: (position key, move) -> [weight, count], from (tags, MoveTree) pairs read with at most plies moves
+    moves = {} if moves is None else moves
+    for tags, tree in games:
+        white, black = scores.get(tags.get("Result"), (1, 1))
+        stack = list(tree.root.children)
+        while stack:
+            position = stack.pop()
+            stack += position.children
+            if position.depth > plies:
+                continue
+            rank, file, to_rank, to_file = position.move
+            piece = position.piece if position.piece < 128 else position.piece - 256
+            promotion = 0
+            if abs(piece) != 1 and position.parent.get_board()[rank * 8 + file] in (1, 255):  # a pawn moved
+                promotion = promotion_kinds[abs(piece)]
+            key = (position.parent.zobrist, pack_move(to_square(rank, file), to_square(to_rank, to_file), promotion))
+            if key not in moves:
+                moves[key] = [0, 0]
+            moves[key][0] += white if position.turn == 1 else black
+            moves[key][1] += 1
+    return moves
+
+
+def write_book(path, moves, min_count=1):
+    by_position = {}
+    for (key, move), (weight, count) in moves.items():
+        if count >= min_count:
+            by_position.setdefault(key, []).append((weight, count, move))
+    with open(path, "wb") as file:
+        for key in sorted(by_position):
+            options = sorted(by_position[key], reverse=True)
+            scale = max(1, -(-options[0][0] // 65535))  # weights are 16-bit, so a very common position's are scaled
+            for weight, count, move in options:
+                file.write(entry.pack(key, move, -(-weight // scale), min(count, 0xFFFFFFFF)))
+    return sum(len(options) for options in by_position.values())
+
+
+class OpeningBook:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if file.seek(0, 2) else b""
+        self.entries = len(self.data) // entry.size
+        self.random = random.Random()
+
+    def moves(self, key):  # [(move, weight, count)] for the position with this Zobrist key, the heaviest first
+        low, high = 0, self.entries
+        while low < high:  # the first entry with a key >= key
+            middle = (low + high) // 2
+            if struct.unpack_from("<Q", self.data, middle * entry.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        moves = []
+        while low < self.entries:
+            found, move, weight, count = entry.unpack_from(self.data, low * entry.size)
+            if found != key:
+                break
+            moves.append((unpack_move(move), weight, count))
+            low += 1
+        return moves
+
+    def choose(self, key):  # a move for the position, at random in proportion to the weights, or None
+        moves = [(move, weight) for move, weight, _ in self.moves(key) if weight > 0]
+        if not moves:
+            return None
+        pick = self.random.randrange(sum(weight for _, weight in moves))
+        for move, weight in moves:
+            if pick < weight:
+                return move
+            pick -= weight
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an opening book from PGN files")
+    parser.add_argument("pgn", nargs="+")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--plies", type=int, default=30, help="moves deeper than this are not in the book")
+    parser.add_argument("--min-count", type=int, default=1, help="leave out moves played in fewer games")
+    parser.add_argument("--lenient", action="store_true", help="skip games with illegal moves instead of stopping")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    moves = {}
+    games = 0
+    for path in args.pgn:
+        with open(path, encoding="utf-8", errors="replace") as stream:
+            for game in PGN.read_games(stream, not args.lenient, args.plies):
+                count_moves([game], args.plies, moves)
+                games += 1
+    entries = write_book(args.out, moves, args.min_count)
+    print(f"{games} games, {entries} book moves in {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+import argparse
+import re
+import sys
+import time
+from MoveGen import MoveGen, to_coordinates, to_square, promotion_pieces
+from MoveTree import MoveTree
+from Position import Position
+from Perft import parse_fen
+import Zobrist
+
+# PGN import and export for MoveTree: read_games() streams a database one game at a time, write_game() writes a tree
+# back with all of its branches
+# Usage: python PGN.py FILE [--out FILE] [--lenient]: reads a database and reports games/s; --out writes it back
+
+start_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+file_names = "abcdefgh"
+piece_letters = {2: "N", 3: "B", 5: "R", 9: "Q", 10: "K"}
+letter_pieces = {"N": 2, "B": 3, "R": 5, "Q": 9, "K": 10}
+promotion_kinds = {"N": 1, "B": 2, "R": 3, "Q": 4}  # SAN letter -> MoveGen move type
+roster = ("Event", "Site", "Date", "Round", "White", "Black", "Result")  # the tags every exported game has
+roster_defaults = {"Date": "????.??.??", "Result": "*"}
+
+tag_pattern = re.compile(r'\[\s*(\w+)\s*"((?:[^"\\]|\\.)*)"\s*]')
+token_pattern = re.compile(r"\{[^}]*}?|;[^\n]*|\$\d+|[()]|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s(){};$.]+")
+san_pattern = re.compile(r"([NBRQK])?([a-h])?([1-8])?x?([a-h])([1-8])=?([NBRQ])?")
+
+
+# reading
+
+def read_games(stream, strict=True, max_plies=None):
+    # yields (tags, MoveTree) for each game of the stream; a game with a move that cannot be played raises a
+    # ValueError, or is skipped if strict is False. With max_plies, moves deeper than that are not parsed at all
+    for _, tags, movetext in split_games(stream):
+        game = parse_game(tags, movetext, strict, max_plies)
+        if game is not None:
+            yield game
+
+
+def split_games(stream):
+    # yields (offset, tags, movetext lines) for each game of a stream of lines, where offset is the position of the
+    # game's first line in the stream: in bytes for a binary stream (whose lines are decoded as UTF-8)
+    tags, movetext = {}, []
+    offset = start = 0
+    for line in stream:
+        length = len(line)
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "replace")
+        if line.startswith("%"):
+            pass  # escape mechanism: the rest of the line is not PGN
+        elif line.startswith("["):
+            if movetext:  # the tags of the next game
+                yield start, tags, movetext
+                tags, movetext = {}, []
+            if not tags:
+                start = offset
+            match = tag_pattern.match(line)
+            if match:
+                tags[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+        elif tags or movetext or line.strip():
+            if not tags and not movetext:
+                start = offset  # a game without tags
+            movetext.append(line)
+        offset += length
+    if tags or movetext:
+        yield start, tags, movetext
+
+
+def parse_game(tags, movetext, strict, max_plies):
+    try:
+        return tags, build_tree(tags, "".join(movetext), max_plies)
+    except ValueError:
+        if strict:
+            raise
+        return None
+
+
+def build_tree(tags, movetext, max_plies=None):
+    position, turn, castle, move = parse_fen(tags["FEN"] if "FEN" in tags else start_fen)
+    tree = MoveTree(side_to_move=turn, position=position, move=move, move_note="", promotion=False, castle=castle)
+    current = (tree.root, MoveGen.from_board(position, turn, castle, move))
+    previous = None  # the state before the last move, where a variation on that move starts
+    variations = []
+    skipped = -1  # -1 while moves are played, else the variations opened since the line went past max_plies
+    for token in token_pattern.findall(movetext):
+        first = token[0]
+        if skipped >= 0:
+            if first == "(":
+                skipped += 1
+            elif first == ")" and skipped > 0:
+                skipped -= 1
+            elif first == ")":
+                skipped = -1  # the line that went past max_plies was a variation, which ends here
+                if variations:
+                    current, previous = variations.pop()
+            continue
+        if first == "(":
+            if previous is None:
+                raise ValueError("variation without a move to replace: " + tags.get("White", "?") + " - "
+                                 + tags.get("Black", "?"))
+            variations.append((current, previous))
+            current = previous
+        elif first == ")":
+            if variations:
+                current, previous = variations.pop()
+        elif first in "{;$*" or first.isdigit() and token not in ("0-0", "0-0-0"):
+            continue  # comments, NAGs, move numbers and results
+        elif max_plies is not None and current[0].depth >= max_plies:
+            skipped = 0
+        else:
+            previous = current
+            current = play(tree, current[0], current[1], find_move(current[1], token))
+    return tree
+
+
+def find_move(generator, san):  # the legal move a SAN token stands for
+    san = san.rstrip("+#!?")
+    moves = generator.legal_moves()
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        kind = 5 if len(san) == 3 else 6
+        for move in moves:
+            if move[2] == kind:
+                return move
+        raise ValueError("illegal castling: " + san)
+    match = san_pattern.fullmatch(san)
+    if match is None:
+        raise ValueError("not a SAN move: " + san)
+    letter, from_file, from_rank, to_file, to_rank, promotion = match.groups()
+    piece = letter_pieces[letter] if letter else 1
+    destination = to_square(8 - int(to_rank), file_names.index(to_file))
+    for move in moves:
+        origin, move_destination, kind = move
+        if move_destination != destination or abs(generator.squares[origin]) != piece or kind == 5 or kind == 6:
+            continue
+        if from_file and origin & 7 != file_names.index(from_file):
+            continue
+        if from_rank and origin >> 3 != 8 - int(from_rank):
+            continue
+        if 0 < kind < 5 and kind != promotion_kinds[promotion or "Q"]:
+            continue
+        return move
+    raise ValueError("illegal move: " + san)
+
+
+def play(tree, parent, generator, move):  # add the Position a move leads to under parent, or find it if it exists
+    origin, destination, kind = move
+    child = generator.make(move)
+    squares = child.squares
+    board = [squares[i:i + 8] for i in range(0, 64, 8)]
+    coordinates = list(to_coordinates(origin) + to_coordinates(destination))
+    notation = san(generator, move, child).rstrip("+#")  # Board's notation has no check marks
+    if kind == 5 or kind == 6:
+        notation = notation.replace("O", "0")  # Board's notation for castling
+    position = Position(side_to_move=generator.turn, position=board, move=coordinates, move_note=notation,
+                        promotion=False, castle=child.castle, material=captured(generator, move),
+                        zobrist=child_key(parent.zobrist, generator, move, child))
+    events = []
+    tree.add_move(position, parent, events)
+    if events:
+        position = tree.key_search(events[-1].data["position_key"])
+    return position, child
+
+
+def child_key(key, generator, move, child):
+    # the Zobrist key of child, generator.make(move), updated from its parent's key as Board.process_move() does
+    origin, destination, kind = move
+    turn = generator.turn
+    squares = generator.squares
+    key ^= Zobrist.black_to_move ^ square_key(squares[origin], origin)
+    key ^= square_key(child.squares[destination], destination)
+    if squares[destination] != 0:
+        key ^= square_key(squares[destination], destination)
+    if kind == 5:
+        key ^= square_key(5 * turn, destination + 1) ^ square_key(5 * turn, destination - 1)
+    elif kind == 6:
+        key ^= square_key(5 * turn, destination - 2) ^ square_key(5 * turn, destination + 1)
+    elif kind == 7 or kind == 8:
+        key ^= square_key(-turn, destination + 8 * turn)
+    key ^= Zobrist.castling[generator.castle] ^ Zobrist.castling[child.castle]
+    for file in (en_passant_file(generator), en_passant_file(child)):
+        if file != -1:
+            key ^= Zobrist.en_passant[file]
+    return key
+
+
+def square_key(piece, sqr):
+    return Zobrist.pieces[sqr][Zobrist.piece_index[piece]]
+
+
+def en_passant_file(generator):  # Zobrist.en_passant_file() of a MoveGen: only with a pawn that can capture
+    if generator.en_passant < 0:
+        return -1
+    pawn = generator.en_passant + 8 * generator.turn  # the pawn just pushed two squares
+    file = pawn & 7
+    if (file > 0 and generator.squares[pawn - 1] == generator.turn) \
+            or (file < 7 and generator.squares[pawn + 1] == generator.turn):
+        return file
+    return -1
+
+
+def captured(generator, move):  # Position.material, as Board.process_move counts it
+    origin, destination, kind = move
+    if kind == 7 or kind == 8:
+        return [-generator.squares[origin]]
+    piece = generator.squares[destination]
+    if piece == 0:
+        return []
+    if abs(piece) == 9 and generator.squares.count(piece) > 1 or 2 <= abs(piece) <= 5 \
+            and generator.squares.count(piece) > 2:
+        return [generator.turn * -1]  # a piece beyond the starting set is counted as a promoted pawn
+    return [piece]
+
+
+# writing
+
+def san(generator, move, child):  # child: generator.make(move), whose legal moves tell check and mate
+    origin, destination, kind = move
+    if kind == 5:
+        text = "O-O"
+    elif kind == 6:
+        text = "O-O-O"
+    else:
+        piece = generator.squares[origin]
+        target = file_names[destination & 7] + str(8 - (destination >> 3))
+        capture = generator.squares[destination] != 0 or kind == 7 or kind == 8
+        if piece == 1 or piece == -1:
+            text = (file_names[origin & 7] + "x" if capture else "") + target
+            if 0 < kind < 5:
+                text += "=" + piece_letters[promotion_pieces[kind]]
+        else:
+            rivals = [other for other, other_destination, _ in generator.legal_moves()
+                      if other_destination == destination and other != origin and generator.squares[other] == piece]
+            disambiguation = ""
+            if rivals:
+                if all(other & 7 != origin & 7 for other in rivals):
+                    disambiguation = file_names[origin & 7]
+                elif all(other >> 3 != origin >> 3 for other in rivals):
+                    disambiguation = str(8 - (origin >> 3))
+                else:
+                    disambiguation = file_names[origin & 7] + str(8 - (origin >> 3))
+            text = piece_letters[abs(piece)] + disambiguation + ("x" if capture else "") + target
+    replies = child.legal_moves()
+    if child.check:
+        text += "+" if replies else "#"
+    return text
+
+
+def to_fen(position, turn, castle, move):  # Board-style position -> FEN, with the en passant square of move
+    rows = []
+    for rank in position:
+        row, empty = "", 0
+        for piece in rank:
+            if piece == 0:
+                empty += 1
+                continue
+            if empty:
+                row, empty = row + str(empty), 0
+            letter = piece_letters.get(abs(piece), "P")
+            row += letter if piece > 0 else letter.lower()
+        rows.append(row + (str(empty) if empty else ""))
+    rights = "".join(char for bit, char in ((8, "K"), (4, "Q"), (2, "k"), (1, "q")) if castle & bit) or "-"
+    en_passant = "-"
+    if move[0] != -1 and abs(position[move[2]][move[3]]) == 1 and abs(move[0] - move[2]) == 2:
+        en_passant = file_names[move[3]] + str(8 - (move[0] + move[2]) // 2)
+    return "/".join(rows) + " " + ("w" if turn == 1 else "b") + " " + rights + " " + en_passant + " 0 1"
+
+
+def write_game(stream, tree, tags=None):
+    tags = dict(tags or {})
+    root = tree.root
+    fen = to_fen(root.position, root.turn, root.castling_rights, root.move)
+    if fen != start_fen:
+        tags["SetUp"], tags["FEN"] = "1", fen
+    result = tags["Result"] if "Result" in tags else "*"
+    lines = []
+    for name in roster + tuple(name for name in tags if name not in roster):
+        value = tags[name] if name in tags else roster_defaults.get(name, "?")
+        lines.append('[' + name + ' "' + value.replace("\\", "\\\\").replace('"', '\\"') + '"]')
+    lines.append("")
+
+    # the tree is walked with a stack rather than recursion, so deep lines and deep nesting are both fine: each node
+    # writes its main move, then each alternative as a variation, then the main line continues
+    offset = 0 if root.turn == 1 else 1  # Position.ply counts from 0 before Black's first move in a set-up position
+    tokens = []
+    stack = [("line", root, MoveGen.from_board(root.position, root.turn, root.castling_rights, root.move), True)]
+    while stack:
+        frame = stack.pop()
+        if frame[0] == "close":
+            tokens.append(")")
+            continue
+        node, generator = frame[1], frame[2]
+        if frame[0] == "variation":
+            tokens.append("(")
+            child = frame[3]
+            child_generator = write_move(tokens, generator, child, True, offset)
+            stack.append(("close",))
+            stack.append(("line", child, child_generator, False))
+            continue
+        if not node.children:
+            continue
+        main = node.children[0]
+        main_generator = write_move(tokens, generator, main, frame[3], offset)
+        stack.append(("line", main, main_generator, len(node.children) > 1))
+        for alternative in reversed(node.children[1:]):
+            stack.append(("variation", node, generator, alternative))
+    tokens.append(result)
+
+    line = ""
+    for token in tokens:  # export format: lines of at most 80 characters
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        elif line and token != ")" and not line.endswith("("):
+            line += " " + token
+        else:
+            line += token
+    lines.append(line)
+    stream.write("\n".join(lines) + "\n\n")
+
+
+def write_move(tokens, generator, position, numbered, offset):  # writes the SAN of position's move
+    move = generator_move(generator, position)
+    child = generator.make(move)
+    if generator.turn == 1:
+        tokens.append(str(position.ply + offset) + ".")
+    elif numbered:
+        tokens.append(str(position.ply + offset) + "...")
+    tokens.append(san(generator, move, child))
+    return child
+
+
+def generator_move(generator, position):  # the MoveGen move of a Position, promotions told apart by Position.piece
+    origin = to_square(*position.move[:2])
+    destination = to_square(*position.move[2:])
+    piece = position.piece if position.piece < 128 else 256 - position.piece  # a byte of Position.board
+    for move in generator.legal_moves():
+        if move[0] == origin and move[1] == destination:
+            if 0 < move[2] < 5 and promotion_pieces[move[2]] != piece:
+                continue
+            return move
+    raise ValueError("the tree holds an illegal move: " + position.move_notation)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read a PGN database into MoveTrees, and optionally write it back")
+    parser.add_argument("file")
+    parser.add_argument("--out", help="write every game read to this file")
+    parser.add_argument("--lenient", action="store_true", help="skip games with illegal moves instead of stopping")
+    args = parser.parse_args()
+    games = nodes = 0
+    start = time.perf_counter()
+    out = open(args.out, "w", encoding="utf-8") if args.out else None
+    try:
+        with open(args.file, encoding="utf-8", errors="replace") as stream:
+            for tags, tree in read_games(stream, not args.lenient):
+                games += 1
+                nodes += len(tree.position_lookup)
+                if out is not None:
+                    write_game(out, tree, tags)
+    finally:
+        if out is not None:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(f"{games} games, {nodes} positions in {elapsed:.1f} s: {games / elapsed if elapsed else 0:.0f} games/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import argparse
+import os
+import time
+from MoveGen import MoveGen, to_coordinates
+from EngineClient import EngineClient, base_dir
+
+# Perft: count the leaf nodes of the legal move tree to a fixed depth, and compare the counts with the published ones
+# Usage: python Perft.py [--depth N] [--position NAME] [--divide] [--engine]; --engine also checks Enginegton's MovesGen
+
+# name: (FEN, node counts from depth 1)
+positions = {
+    "start": ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+              [20, 400, 8902, 197281, 4865609, 119060324]),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 [48, 2039, 97862, 4085603, 193690690, 8031647685]),
+    "endgame": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                [14, 191, 2812, 43238, 674624, 11030083]),
+    "promotions": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                   [6, 264, 9467, 422333, 15833292, 706045033]),
+    "discovered": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                   [44, 1486, 62379, 2103487, 89941194]),
+    "middlegame": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                   [46, 2079, 89890, 3894594, 164075551, 6923051137]),
+}
+
+piece_codes = {"p": 1, "n": 2, "b": 3, "r": 5, "q": 9, "k": 10}
+fen_dict = {0: "0", 1: "P", 2: "N", 3: "B", 5: "R", 9: "Q", 10: "K"}
+
+
+def parse_fen(fen):  # FEN -> Board-style position (White at the bottom), turn, castling rights, last move
+    fields = fen.split()
+    position = []
+    for row in fields[0].split("/"):
+        rank = []
+        for char in row:
+            if char.isdigit():
+                rank += [0] * int(char)
+            else:
+                rank.append(piece_codes[char.lower()] * (1 if char.isupper() else -1))
+        position.append(rank)
+    turn = 1 if fields[1] == "w" else -1
+    rights = fields[2]
+    castle = ((2 * ("K" in rights) + ("Q" in rights)) << 2) + 2 * ("k" in rights) + ("q" in rights)
+    move = [-1, -1, -1, -1]
+    if fields[3] != "-":  # Chessington derives en passant from the last move, so recreate the double push
+        file = ord(fields[3][0]) - ord("a")
+        rank = 8 - int(fields[3][1])
+        move = [rank - turn, file, rank + turn, file]
+    return position, turn, castle, move
+
+
+def move_name(move):  # (origin, destination, type) -> "rfrft", the format of Enginegton's results
+    return "".join(str(i) for i in to_coordinates(move[0]) + to_coordinates(move[1])) + str(move[2])
+
+
+def perft(generator, depth):
+    moves = generator.legal_moves()
+    if depth == 1:
+        return len(moves)
+    return sum(perft(generator.make(move), depth - 1) for move in moves)
+
+
+def python_perft(fen, depth, divide=False):  # returns (nodes, milliseconds, {move: nodes})
+    position, turn, castle, move = parse_fen(fen)
+    start = time.perf_counter()
+    root = MoveGen.from_board(position, turn, castle, move)
+    counts = {}
+    if depth == 0:
+        nodes = 1
+    elif divide:
+        for m in root.legal_moves():
+            counts[move_name(m)] = 1 if depth == 1 else perft(root.make(m), depth - 1)
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(root, depth)
+    return nodes, 1000 * (time.perf_counter() - start), counts
+
+
+def engine_perft(client, fen, depth, divide=False):  # the same, counted by Enginegton
+    position, turn, castle, move = parse_fen(fen)
+    message = "perft\n"
+    message += "".join(fen_dict[abs(i)].lower() if i < 0 else fen_dict[i] for rank in position for i in rank) + "\n"
+    message += ("-" if turn == -1 else "1") + "\n"
+    message += "".join(str(i) for i in move) + "\n"
+    message += str(castle) + "\n"
+    message += str(depth) + "\n"
+    message += str(int(divide))
+    lines = client.request(message).result().split("\n")
+    counts = {}
+    for line in lines[2:]:
+        name, count = line.split(":")
+        counts[name] = int(count)
+    return int(lines[0]), float(lines[1]), counts
+
+
+def report(backend, name, depth, expected, nodes, ms, counts, reference=None):
+    status = "ok" if expected is None or nodes == expected else "FAIL (expected " + str(expected) + ")"
+    nps = int(nodes / (ms / 1000)) if ms > 0 else 0
+    print(f"{backend:8} {name:12} depth {depth}: {nodes:>12} nodes {ms:>10.1f} ms {nps:>10} nodes/s  {status}")
+    for move, count in sorted(counts.items()):
+        line = f"    {move}: {count}"
+        if reference is not None and reference.get(move) != count:
+            line += "  <- python: " + str(reference.get(move))
+        print(line)
+    if reference is not None:
+        for move in sorted(set(reference) - set(counts)):
+            print(f"    {move}: missing  <- python: {reference[move]}")
+    return status == "ok"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft validation and benchmark for Chessington's move generators")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--position", choices=sorted(positions), action="append",
+                        help="can be given more than once; all positions by default")
+    parser.add_argument("--fen", help="count an arbitrary position instead of the reference ones")
+    parser.add_argument("--divide", action="store_true")
+    parser.add_argument("--engine", action="store_true", help="also run Enginegton's move generator")
+    args = parser.parse_args()
+
+    if args.fen:
+        tests = [("fen", args.fen, None)]
+    else:
+        tests = []
+        for name in args.position or positions:
+            fen, counts = positions[name]
+            tests.append((name, fen, counts[args.depth - 1] if 0 < args.depth <= len(counts) else None))
+
+    client = None
+    if args.engine:
+        client = EngineClient(os.path.join(base_dir, "Enginegton2", "perft_log.txt"))
+        client.startup_request.future.result()  # requests posted while the engine is loading would be dropped
+
+    passed = True
+    try:
+        for name, fen, expected in tests:
+            nodes, ms, counts = python_perft(fen, args.depth, args.divide)
+            passed &= report("python", name, args.depth, expected, nodes, ms, counts)
+            if client is not None:
+                e_nodes, e_ms, e_counts = engine_perft(client, fen, args.depth, args.divide)
+                if expected is None:
+                    expected = nodes
+                passed &= report("engine", name, args.depth, expected, e_nodes, e_ms, e_counts,
+                                 counts if args.divide else None)
+    finally:
+        if client is not None:
+            client.terminate()
+    print("all counts match" if passed else "MISMATCH")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
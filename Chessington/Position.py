@@ -1,65 +1,182 @@
+from array import array
+from itertools import chain
+from collections import OrderedDict
+import sys
+
+
+# Position instances are the nodes of the MoveTree, kept compact: __slots__, a packed move, and a 64-byte board in the
+# canonical frame (White at the bottom) stored only every snapshot_interval plies, other boards being rebuilt from deltas
 class Position:
+    __slots__ = ("turn", "packed_move", "move_notation", "children", "parent", "promotion", "ply",
+                 "depth", "board", "piece", "castling_rights", "key", "material", "zobrist", "index", "head")
+
+    snapshot_interval = 16
+    decoded = OrderedDict()  # LRU cache of rebuilt boards: id(position) -> (position, board)
+    decoded_limit = 64
+
     def __init__(self, **kwargs):
         self.turn = kwargs["side_to_move"]   # which side moved to bring this position about
-        self.orientation = kwargs["pl_colour"]
-        self.move = kwargs["move"]  # move in list format
+        self.packed_move = -1
+        self.move = kwargs["move"]
         self.move_notation = kwargs["move_note"]  # move in chess notation format
         self.children = []
         self.parent = None
-        if kwargs["promotion"]:
-            setattr(self, "promotion", True)
+        self.promotion = kwargs["promotion"]  # set until the player has chosen the piece to promote to
         self.ply = 0  # a ply is white's move + black's move
+        self.depth = 0  # number of moves from the root
+        self.index = 0  # index in parent.children, kept up to date by MoveTree
+        self.head = self  # the first position of the line this position is in, kept up to date by MoveTree
+        self.board = None
         self.position = kwargs["position"]
+        self.piece = 0  # the piece the move leaves on its destination square
         self.castling_rights = kwargs["castle"]
         if "key" in kwargs:
             self.key = kwargs["key"]  # if key in kwargs, this is the root of the MoveTree
         else:
-            self.key = 0  # will be obtained from id(self) when the position is added to the tree
-        self.captured = kwargs["material"]
+            self.key = 0  # will be allocated by MoveTree when the position is added to the tree
+        self.material = kwargs["material"]  # pieces captured by this move
+        self.zobrist = kwargs["zobrist"] if "zobrist" in kwargs else 0  # Zobrist key, set by MoveTree for the root
 
-    def __eq__(self, other):
-        if not isinstance(other, Position):
-            return False
-        return self.key == other.key
+    @property
+    def position(self):  # a fresh 8x8 list, so callers may modify it
+        squares = memoryview(self.get_board()).cast("b").tolist()
+        return [squares[i:i + 8] for i in range(0, 64, 8)]
+
+    @position.setter
+    def position(self, position):
+        self.board = array("b", chain.from_iterable(position)).tobytes()
+        self.decoded.pop(id(self), None)
 
-    # this function reconstructs a part tree (all the positions to be displayed by the variations UI)
-    # by moving backwards through Position parents until it hits the root
-    # if the position has siblings, it means branching was encountered:
-    # the keys need to be incremented and new 0-depth added to the tree_dict,
-    # and, the alternative line needs to be followed from this junction to get the rest of it for drawing
-    def tree_backtrack(self, tree_dict, line_cont):
-        # line_cont bool is set if a branching needs to be followed before the backtrack can proceed
-        tree_dict[0].insert(0, self)
-        if line_cont and self.children:
-            self.children[0].follow_line(tree_dict, 0)
-
-        if self.key == "r":  # root is hit
+    @property
+    def move(self):  # move in list format
+        packed = self.packed_move
+        if packed == -1:
+            return [-1, -1, -1, -1]
+        return [packed >> 9, (packed >> 6) & 7, (packed >> 3) & 7, packed & 7]
+
+    @move.setter
+    def move(self, move):  # [rank, file, rank, file] -> 12-bit int; the root's [-1, -1, -1, -1] is stored as -1
+        if not move or move[0] == -1:
+            self.packed_move = -1
             return
+        self.packed_move = (move[0] << 9) | (move[1] << 6) | (move[2] << 3) | move[3]
 
-        # entering a lower branch, one depth lower
-        if self.has_siblings() and self.get_sibling_index() > 0:
-            # increment keys and add new depth 0
-            max_key = max(tree_dict.keys())
-            for i in range(len(tree_dict)):
-                tree_dict[max_key + 1] = tree_dict[max_key]
-                tree_dict.pop(max_key)
-                max_key -= 1
-            tree_dict[0] = []
-            self.parent.tree_backtrack(tree_dict, True)  # set line_cont to true to follow the alternative
-        else:
-            self.parent.tree_backtrack(tree_dict, False)
+    @property
+    def captured(self):  # all pieces captured on the way to this position, the latest first
+        captured = []
+        position = self
+        while position is not None:
+            captured += position.material
+            position = position.parent
+        return captured
+
+    def attach(self, parent, snapshot_interval):  # called by MoveTree.add_move once the position joins the tree
+        self.parent = parent
+        self.depth = parent.depth + 1
+        self.index = len(parent.children)
+        self.head = self if self.index > 0 else parent.head
+        parent.children.append(self)
+        self.piece = self.board[self.packed_move & 63]
+        if self.depth % snapshot_interval != 0:
+            self.cache(self.board)  # it is about to become the current position
+            self.board = None
 
-    def follow_line(self, tree_dict, max_key):
-        tree_dict[max_key].append(self)
-        if self.children:
-            self.children[0].follow_line(tree_dict, max_key)
+    @classmethod
+    def restore(cls, parent, key, turn, packed_move, piece, castle, material, zobrist, notation, snapshot_interval):
+        # a position read back from a session file or journal: it joins the tree from its delta; restore() may run on
+        # Journal's writer thread, so it builds snapshots without the decoded cache, which only the UI thread uses
+        position = cls.__new__(cls)
+        position.turn = turn
+        position.packed_move = packed_move
+        position.move_notation = notation
+        position.children = []
+        position.promotion = False
+        position.ply = parent.ply + (turn == 1)
+        position.board = None
+        position.piece = piece
+        position.castling_rights = castle
+        position.key = key
+        position.material = material
+        position.zobrist = zobrist
+        position.parent = parent
+        position.depth = parent.depth + 1
+        position.index = len(parent.children)
+        position.head = position if position.index > 0 else parent.head
+        parent.children.append(position)
+        if position.depth % snapshot_interval == 0:
+            line = [position]
+            while line[-1].parent.board is None:
+                line.append(line[-1].parent)
+            squares = bytearray(line[-1].parent.board)
+            for ancestor in reversed(line):
+                ancestor.replay(squares)
+            position.board = bytes(squares)
+        return position
 
-    # this function is used in every takeback scenario,
-    # if this position's orientation is not equal to the current orientation, its data is "flipped" too
-    def reverse_rank_and_file(self):
-        if len(self.move) > 0 and self.move[0] != -1:
-            self.reverse_move(self.move)
-        self.orientation *= -1
+    def get_board(self):  # this position's board as bytes
+        if self.board is not None:
+            return self.board
+        entry = self.decoded.get(id(self))
+        if entry is not None and entry[0] is self:
+            self.decoded.move_to_end(id(self))
+            return entry[1]
+
+        # walk up to the nearest snapshot or cached board, then replay the moves down to this position
+        line = []
+        position = self
+        board = None
+        while board is None:
+            line.append(position)
+            position = position.parent
+            if position.board is not None:
+                board = position.board
+            else:
+                entry = self.decoded.get(id(position))
+                if entry is not None and entry[0] is position:
+                    board = entry[1]
+        squares = bytearray(board)
+        for position in reversed(line):
+            position.replay(squares)
+            board = bytes(squares)
+            position.cache(board)
+        return board
+
+    def footprint(self):  # bytes held by this position and the objects only it refers to, for MoveTree.memory_usage
+        size = sys.getsizeof(self) + sys.getsizeof(self.move_notation) + sys.getsizeof(self.children)
+        size += sys.getsizeof(self.material) + sys.getsizeof(self.zobrist)
+        if self.board is not None:
+            size += sys.getsizeof(self.board)
+        return size
+
+    def replay(self, squares):  # apply this position's move to its parent's board, as a bytearray
+        origin, destination = self.packed_move >> 6, self.packed_move & 63
+        piece = squares[origin]
+        squares[origin] = 0
+        if piece in (1, 255) and (origin ^ destination) & 7 and squares[destination] == 0:  # en passant
+            squares[(origin & 56) | (destination & 7)] = 0
+        elif piece in (10, 246) and abs((origin & 7) - (destination & 7)) == 2:  # castling
+            if destination > origin:
+                squares[destination - 1], squares[origin | 7] = squares[origin | 7], 0
+            else:
+                squares[destination + 1], squares[origin & 56] = squares[origin & 56], 0
+        squares[destination] = self.piece
+
+    def cache(self, board):
+        self.decoded[id(self)] = (self, board)
+        self.decoded.move_to_end(id(self))
+        if len(self.decoded) > self.decoded_limit:
+            self.decoded.popitem(last=False)
+
+    def __eq__(self, other):
+        if not isinstance(other, Position):
+            return False
+        return self.key == other.key
+
+    def line(self):  # this position and its first-child continuation, to the end of the line
+        line = [self]
+        while line[-1].children:
+            line.append(line[-1].children[0])
+        return line
 
     def update_notation(self, add, prefix=False):
         if len(self.move_notation) == 0:
@@ -75,21 +192,13 @@ class Position:
         return len(self.parent.children) > 1
 
     def get_sibling_index(self):
-        for index, sibling in enumerate(self.parent.children):
-            if sibling == self:
-                return index
+        return self.index
 
     def find_branch_ancestor(self):
-        if self.get_sibling_index() != 0:
-            return self
-        return self.parent.find_branch_ancestor()
+        return self.head
 
     @staticmethod
     def get_next(current):
         if len(current.children) == 0:
             return None
         return current.children[0]
-
-    @staticmethod
-    def reverse_move(move):
-        move[:] = [7 - m if i != 4 else move[-1] for i, m in enumerate(move)]
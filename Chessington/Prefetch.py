@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+from MoveGen import MoveGen, to_coordinates
+import Zobrist
+
+# Speculative generation of the legal moves of every position one move away from the current one, run in the frame
+# loop's idle time by step() and kept by Zobrist key for MoveTree.legal_moves()
+
+class Prefetch:
+    def __init__(self, limit=512):
+        self.limit = limit
+        self.results = OrderedDict()  # Zobrist key -> (legal moves, situation, en passant file)
+        self.generator = None  # MoveGen of the position whose replies are being generated
+        self.pending = []  # its legal moves whose positions are still to generate
+        self.position = None  # the position to prefetch from, until its generator is built by step()
+        self.turn = 0
+        self.tree = None
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, tree, position, turn):  # prefetch the positions the moves from position lead to
+        self.tree, self.position, self.turn = tree, position, turn
+        self.generator = None
+        self.pending = []
+
+    def cancel(self, key=None):  # a move was made to the position with Zobrist key: stop, and count it
+        if key is not None and (self.generator is not None or self.position is not None):
+            transposition = self.tree.transpositions.get(key)
+            if key in self.results or (transposition is not None and transposition.legal_moves is not None):
+                self.hits += 1
+            else:
+                self.misses += 1
+        self.tree, self.position, self.generator = None, None, None
+        self.pending = []
+
+    def take(self, key):  # the prefetched (legal moves, situation, en passant file) of a position, or None
+        return self.results.pop(key, None)
+
+    def step(self, budget):  # generate replies for up to budget seconds
+        if self.position is None and not self.pending:
+            return
+        deadline = time.perf_counter() + budget
+        if self.position is not None:
+            position, self.position = self.position, None
+            self.generator = MoveGen.from_board(position.position, self.turn, position.castling_rights, position.move)
+            self.pending = self.generator.legal_moves()
+        while self.pending and time.perf_counter() < deadline:
+            move = self.pending.pop()
+            child = self.generator.make(move)
+            squares = child.squares
+            board = [squares[i:i + 8] for i in range(0, 64, 8)]
+            coordinates = list(to_coordinates(move[0]) + to_coordinates(move[1]))
+            key = Zobrist.full_key(board, child.turn, child.castle, coordinates)
+            if key in self.results:
+                self.results.move_to_end(key)
+                continue
+            if key in self.tree.transpositions and self.tree.transpositions[key].legal_moves is not None:
+                continue  # already in the tree, and visited
+            self.results[key] = (child.board_moves(), child.situation(), Zobrist.en_passant_file(board, coordinates))
+            if len(self.results) > self.limit:
+                self.results.popitem(last=False)
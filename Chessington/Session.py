@@ -0,0 +1,124 @@
+import mmap
+import os
+import struct
+from MoveTree import MoveTree
+from Position import Position
+
+# Analysis sessions: a whole MoveTree saved in a binary file, one preorder record per position with its subtree size,
+# memory-mapped when it is opened again so that MoveTree.load() decodes positions only when the UI first reaches them
+
+magic = b"CHSN"
+version = 1
+header = struct.Struct("<4sHIIIII")  # magic, version, records, next key, current record, notation and engine offsets
+root_record = struct.Struct("<64sbB4bQ")  # board, side to move, castling rights, move, Zobrist key
+record = struct.Struct("<IIHhBbBbQIB")
+# key, subtree size, children, packed move, piece, side that moved, castling rights, captured piece, Zobrist key,
+# notation offset, notation length
+engine_record = struct.Struct("<Q5b")  # Zobrist key, engine move (rank, file, rank, file, promotion)
+
+
+def save_session(path, tree, current):
+    tree.load_all()  # the positions that were never opened are written from the tree, like the others
+    if tree.source is not None:
+        tree.source.close()  # the file may be the one being replaced
+        tree.source = None
+
+    # preorder, and the subtree sizes from the end of it
+    order = []
+    stack = [tree.root]
+    while stack:
+        position = stack.pop()
+        order.append(position)
+        stack += reversed(position.children)
+    number = {id(position): index for index, position in enumerate(order)}
+    sizes = [1] * len(order)
+    for index in range(len(order) - 1, 0, -1):
+        sizes[number[id(order[index].parent)]] += sizes[index]
+
+    notations = bytearray()
+    records = bytearray()
+    for index, position in enumerate(order):
+        notation = position.move_notation.encode()
+        records += record.pack(0 if position.key == "r" else position.key, sizes[index], len(position.children),
+                               position.packed_move, position.piece & 0xFF, position.turn, position.castling_rights,
+                               position.material[0] if position.material else 0, position.zobrist, len(notations),
+                               len(notation))
+        notations += notation
+    engine_moves = bytearray()
+    for key, transposition in tree.transpositions.items():
+        if transposition.engine_move is not None:
+            engine_moves += engine_record.pack(key, *transposition.engine_move)
+
+    root = tree.root
+    notation_offset = header.size + root_record.size + len(records)
+    data = header.pack(magic, version, len(order), tree.next_key, number[id(current)], notation_offset,
+                       notation_offset + len(notations))
+    data += root_record.pack(root.get_board(), root.turn, root.castling_rights, *root.move, root.zobrist)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(data + records + notations + engine_moves)
+    os.replace(temporary, path)
+
+
+def open_session(path):  # -> (MoveTree, the position that was current when the session was saved)
+    session = Session(path)
+    return session.tree, session.current
+
+
+class Session:
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        name, file_version, self.records, next_key, current, self.notations, engines = header.unpack_from(self.data)
+        if name != magic or file_version != version:
+            self.close()
+            raise ValueError(path + " is not a Chessington session")
+        self.records_offset = header.size + root_record.size
+        self.engine_moves = {}  # Zobrist key -> engine move, for every transposition that has one
+        for offset in range(engines, len(self.data), engine_record.size):
+            key, *move = engine_record.unpack_from(self.data, offset)
+            self.engine_moves[key] = move
+
+        board, turn, castle, *move, zobrist = root_record.unpack_from(self.data, header.size)
+        squares = memoryview(board).cast("b").tolist()
+        self.tree = MoveTree(side_to_move=turn, position=[squares[i:i + 8] for i in range(0, 64, 8)], move=move,
+                             move_note="", promotion=False, castle=castle)
+        self.tree.next_key = next_key
+        self.tree.source = self
+        self.tree.unloaded["r"] = 0
+        self.set_engine_move(self.tree.root)
+
+        # decode the path to the current position: at each position, the child whose subtree holds the record
+        self.current = self.tree.root
+        index = 0
+        while index != current:
+            self.tree.load(self.current)
+            child = index + 1
+            for position in self.current.children:
+                size = record.unpack_from(self.data, self.records_offset + child * record.size)[1]
+                if child <= current < child + size:
+                    self.current, index = position, child
+                    break
+                child += size
+
+    def load_children(self, tree, parent, index):  # called by MoveTree.load() for the parent at record index
+        children = record.unpack_from(self.data, self.records_offset + index * record.size)[2]
+        child = index + 1
+        for _ in range(children):
+            key, size, grandchildren, packed_move, piece, turn, castle, captured, zobrist, start, length \
+                = record.unpack_from(self.data, self.records_offset + child * record.size)
+            notation = self.data[self.notations + start:self.notations + start + length].decode()
+            position = Position.restore(parent, key, turn, packed_move, piece, castle, [captured] if captured else [],
+                                        zobrist, notation, tree.snapshot_interval)
+            tree.insert(position)
+            self.set_engine_move(position)
+            if grandchildren:
+                tree.unloaded[key] = child
+            child += size
+
+    def set_engine_move(self, position):
+        if position.zobrist in self.engine_moves:
+            self.tree.transposition(position).engine_move = self.engine_moves[position.zobrist]
+
+    def close(self):
+        self.data.close()
@@ -1,5 +1,4 @@
 from Buttons import *
-import os
 
 
 class GeneralUI:
@@ -33,7 +32,7 @@ class GeneralUI:
 
         if hasattr(self, "winner"):
             Button.draw_text(window_data, getattr(self, "winner"),
-                             pygame.font.SysFont("Futura", window_data.sqr_size // 2), (0, 0, 0),
+                             Button.get_font(window_data.sqr_size // 2), (0, 0, 0),
                              window_data.width - window_data.side_margin_size + window_data.sqr_size // 2,
                              window_data.height // 2)
 
@@ -41,11 +40,10 @@ class GeneralUI:
 
     def get_menu_UI(self, **kwargs):
         win_data = kwargs["win_data"]
-        self.background = pygame.transform.scale(
-            pygame.image.load(os.path.join("assets", "img", "bg.png")), (win_data.width, win_data.height))
+        self.background = kwargs["background"]
         offsetX = win_data.width // 4
         offsetY = win_data.sqr_size // 2
-        font = pygame.font.SysFont("Futura", win_data.sqr_size // 2)
+        font = Button.get_font(win_data.sqr_size // 2)
         white_btn = Button(0, 0, kwargs["graphics"][10], font, (222, 227, 230), 24,
                            pl_colour=1, side_to_move=1, from_pos=False, engine_on=True, preexisting_tree=None)
         black_btn = Button(0, 0, kwargs["graphics"][-10], font, (222, 227, 230), 24,
@@ -61,7 +59,7 @@ class GeneralUI:
     def get_game_UI(self, **kwargs):
 
         win_data = kwargs["win_data"]
-        font = pygame.font.SysFont("Futura", win_data.sqr_size // 2)
+        font = Button.get_font(win_data.sqr_size // 2)
 
         drop = [Button(0, 0, "Main menu", font, (0, 0, 0), 22), Button(0, 0, "Flip board", font, (0, 0, 0), 41),
                 Button(0, 0, "Takeback", font, (0, 0, 0), 42)]
@@ -81,7 +79,7 @@ class GeneralUI:
 
         win_data = kwargs["win_data"]
         graphics = kwargs["graphics"]
-        font = pygame.font.SysFont("Futura", win_data.sqr_size // 2)
+        font = Button.get_font(win_data.sqr_size // 2)
 
         self.sub_interface = EditorInterface()
         white_pawn_btn = ToggleButton(win_data.width - win_data.side_margin_size + win_data.sqr_size, win_data.sqr_size,
@@ -148,7 +146,7 @@ class GeneralUI:
     # special buttons appear on condition, and are not part of the static UI
     def add_special_button(self, win_data, tag):
 
-        font = pygame.font.SysFont("Futura", win_data.sqr_size // 2)
+        font = Button.get_font(win_data.sqr_size // 2)
         if tag == "reset":
             return Button(self.buttons[0].rect.x,
                           self.buttons[0].rect.y + self.buttons[0].rect.h, "Reset", font, (0, 0, 0), 40)
@@ -172,7 +170,7 @@ class GeneralUI:
         self.buttons.clear()
         self.dropdowns.clear()
         self.sub_interface = None
-        font = pygame.font.SysFont("Futura", win_data.sqr_size // 2)
+        font = Button.get_font(win_data.sqr_size // 2)
         setattr(self, "winner", winner)
         menu_btn = Button(0, 0, "Main menu", font, (0, 0, 0), 22)
         rematch_btn = Button(0, 0, "Rematch", font, (0, 0, 0), 33, tree_exists=False, on=True)
@@ -248,7 +246,7 @@ class PromotionInterface:
         return events
 
     def create(self, side, win_data, graphics):
-        font = pygame.font.SysFont("Futura", win_data.sqr_size // 2)
+        font = Button.get_font(win_data.sqr_size // 2)
         half = win_data.sqr_size // 2
         if side == 1:
             white_knight_btn = Button(win_data.width - win_data.side_margin_size + win_data.sqr_size + half,
@@ -273,22 +271,29 @@ class PromotionInterface:
             self.buttons = [black_knight_btn, black_bishop_btn, black_rook_btn, black_queen_btn]
 
 
+# The variations UI draws each line of the part tree in its own pane (ScrollingInterface): the main line at the top, and
+# the variations two per row below it. Panes are created when a depth is first drawn; when the tree is nested deeper
+# than the panes can show, they show the deepest variations, and the ones in between are not drawn.
 class VariationsInterface:
     def __init__(self, x, y, width, height, engine=False):
 
         self.pos_buttons = {0: []}
-        max_height = height // 2
+        self.lines = {}  # depth -> the MoveTree line its pos_buttons were made for
+        self.selected = None  # the notation button of the current position
+        self.x, self.y, self.width, self.height = x, y, width, height
         if not engine:
-            self.scrollers = {0: ScrollingInterface(x, y, width, max_height, 4),
-                              1: ScrollingInterface(x, y + height, width, max_height, 4),
-                              2: ScrollingInterface(x + width, y + height, width, max_height, 4),
-                              3: ScrollingInterface(x, y + height * 2, width, max_height, 4),
-                              4: ScrollingInterface(x + width, y + height * 2, width, max_height, 4)}
+            self.scrollers = {0: ScrollingInterface(x, y, width, height // 2, 4)}
+            self.panes = 5
         else:
             self.scrollers = {0: ScrollingInterface(x, y, width, height * 2, 16)}
+            self.panes = 1
+        self.first_variation = 1  # the depth drawn in the first variation pane
 
         self.branch_buttons = {0: []}  # notation buttons that point to an alternative line
         self.modify_buttons = []  # Delete from here, promote variation, make main line
+        self.transposition_buttons = []  # links to the same position reached by another move order
+        self.explorer_buttons = []  # the moves the explorer's database games played from the current position
+        self.explorer_labels = []  # (text, x, y): how many games reached the position, and the first of them
         self.clock = time.time()
 
     def update(self, window_data, user_input, events, **kwargs):
@@ -305,63 +310,83 @@ class VariationsInterface:
             self.clock = time.time()
 
         # Update notation buttons and scrollers
-        for i in range(max(self.pos_buttons.keys()) + 1):
-            scr = self.scrollers[i].update(user_input)
-            for btn in self.pos_buttons[i]:
+        for depth, buttons in self.pos_buttons.items():
+            scr = self.scrollers[depth].update(user_input)
+            for btn in buttons:
                 btn.update_notation(window_data, user_input, scr, events)
+            if self.scrollers[depth].settling():
+                window_data.invalidate()
 
-        for i in range(max(self.branch_buttons.keys()) + 1):
-            for btn in self.branch_buttons[i]:
+        for buttons in self.branch_buttons.values():
+            for btn in buttons:
                 btn.update_toggle(window_data, user_input, events)
 
         for btn in self.modify_buttons:
             btn.update(window_data, user_input, events)
 
+        for btn in self.transposition_buttons:
+            btn.update(window_data, user_input, events)
+
+        for btn in self.explorer_buttons:
+            btn.update(window_data, user_input, events)
+        for text, x, y in self.explorer_labels:
+            Button.draw_text(window_data, text, self.explorer_font, (0, 0, 0), x, y)
+
         return events
 
     def engine_update(self, window_data, user_input):  # Many Analysis features of VariationsUI are disabled here
         scr = self.scrollers[0].update(user_input)
         for btn in self.pos_buttons[0]:
             btn.update_notation(window_data, user_input, scr)
+        if self.scrollers[0].settling():
+            window_data.invalidate()
 
     def get_notation_buttons(self, win_data, line, depth, key):
-        # iterate over the line of Positions and fill in the buttons list
-        font = pygame.font.SysFont("Futura", win_data.sqr_size // 4)
-        interface = self.scrollers[depth]
-        if depth not in self.pos_buttons:
-            self.pos_buttons[depth] = []
-        buttons = []
-        y_offset = 0 + interface.total
+        # iterate over the line of Positions and fill in the buttons list; MoveTree only ever extends a drawn line in
+        # place, so if this is the line the buttons were made for, only the buttons of its new positions are added
+        if not self.visible(depth):
+            return
+        font = Button.get_font(win_data.sqr_size // 4)
+        interface = self.scroller(depth)
         y_increment = win_data.sqr_size // 8
-        for index, pos in enumerate(line):
-            if pos.turn == 1:
-                buttons.append(
-                    NotationButton(interface.rect.x, interface.rect.y + y_offset, pos.move_notation, font, (0, 0, 0), 0,
-                                   position_key=pos.key))
-            else:
-                if index != 0:
-                    btn_y = buttons[-1].rect.y
-                else:
-                    btn_y = interface.rect.y + interface.total
-                    y_offset += win_data.sqr_size // 8
-                buttons.append(
-                    NotationButton(interface.rect.x + win_data.sqr_size, btn_y, pos.move_notation, font, (0, 0, 0), 0,
-                                   position_key=pos.key))
-            if pos.key == key:
-                buttons[-1].on = 1
+        if self.lines.get(depth) is line and depth in self.pos_buttons:
+            buttons = self.pos_buttons[depth]
+        else:
+            buttons = []
+            self.lines[depth] = line
+        for index in range(len(buttons), len(line)):
+            pos = line[index]
+            if index == 0:
+                btn_y = interface.rect.y + interface.total
+            elif pos.turn == 1:  # a new row: one increment below a white move, two below a black one
+                btn_y = buttons[-1].rect.y + (y_increment if line[index - 1].turn == 1 else 2 * y_increment)
             else:
-                buttons[-1].on = 0
-            y_offset += y_increment
+                btn_y = buttons[-1].rect.y
+            btn_x = interface.rect.x if pos.turn == 1 else interface.rect.x + win_data.sqr_size
+            buttons.append(NotationButton(btn_x, btn_y, pos.move_notation, font, (0, 0, 0), 0, position_key=pos.key))
         self.pos_buttons[depth] = buttons
 
+        if self.selected is not None:
+            self.selected.on = 0
+        self.selected = self.notation_button(key)
+        if self.selected is not None:
+            self.selected.on = 1
+
+    def notation_button(self, key):  # the button of the position with this key among the drawn lines, or None
+        for buttons in self.pos_buttons.values():
+            for btn in buttons:
+                if btn.event_data["position_key"] == key:
+                    return btn
+        return None
+
     def allow_delete(self, win_data):
-        font = pygame.font.SysFont("Futura", win_data.sqr_size // 4)
+        font = Button.get_font(win_data.sqr_size // 4)
         where = self.scrollers[0]
         self.modify_buttons = [Button(
             where.rect.x + where.rect.w, where.rect.y, "Delete from here", font, (0, 0, 0), 2)]
 
     def allow_branch_promotions(self, win_data):
-        font = pygame.font.SysFont("Futura", win_data.sqr_size // 4)
+        font = Button.get_font(win_data.sqr_size // 4)
         self.allow_delete(win_data)
         self.modify_buttons.append(Button(self.modify_buttons[-1].rect.x,
                                           self.modify_buttons[-1].rect.y + self.modify_buttons[-1].rect.h,
@@ -370,6 +395,68 @@ class VariationsInterface:
     def no_modify(self):
         self.modify_buttons.clear()
 
+    def get_transposition_buttons(self, win_data, transpositions):  # placed below the modify buttons, up to 3
+        font = Button.get_font(win_data.sqr_size // 4)
+        where = self.scrollers[0]
+        y = self.modify_buttons[-1].rect.y + self.modify_buttons[-1].rect.h if self.modify_buttons else where.rect.y
+        self.transposition_buttons = []
+        for position in transpositions[:3]:
+            if position.key == "r":
+                label = "start"
+            elif position.turn == -1 and not position.move_notation.startswith("..."):
+                label = str(position.ply) + "... " + position.move_notation
+            else:
+                label = position.move_notation
+            btn = Button(where.rect.x + where.rect.w, y, "Transposes to " + label, font, (0, 0, 0), 0,
+                         position_key=position.key)
+            self.transposition_buttons.append(btn)
+            y += btn.rect.h
+
+    def get_explorer_buttons(self, win_data, moves, total, games):  # placed below the transposition buttons
+        # moves: [[rank, file, rank, file, promotion], SAN, games, White wins, draws, Black wins], the most played
+        # first, and games: the tags of the first games that reached the position
+        self.explorer_font = Button.get_font(win_data.sqr_size // 4)
+        where = self.scrollers[0]
+        x = where.rect.x + where.rect.w
+        above = self.transposition_buttons or self.modify_buttons
+        y = above[-1].rect.y + above[-1].rect.h if above else where.rect.y
+        y += win_data.sqr_size // 8
+        line_height = self.explorer_font.size("0")[1]
+        self.explorer_labels = [("Database: " + str(total) + " games", x, y)]
+        self.explorer_buttons = []
+        y += line_height
+        for move, san, count, white, draws, black in moves[:5]:
+            label = f"{san}  {count}  +{100 * white // count}% ={100 * draws // count}% -{100 * black // count}%"
+            btn = Button(x, y, label, self.explorer_font, (0, 0, 0), 46, move=move)
+            self.explorer_buttons.append(btn)
+            y += btn.rect.h
+        for tags in games:
+            self.explorer_labels.append((tags.get("White", "?") + " - " + tags.get("Black", "?") + "  "
+                                         + tags.get("Result", "*") + "  " + tags.get("Date", "?")[:4], x, y))
+            y += line_height
+
+    def set_tree_height(self, tree_height):
+        # the deepest variation, and the pane below it where the alternatives to the current position are listed, are
+        # always drawn; if that moves the variation panes to other depths, they are laid out again
+        first_variation = max(1, tree_height + 3 - self.panes)
+        if first_variation != self.first_variation:
+            self.first_variation = first_variation
+            self.scrollers = {0: self.scrollers[0]}
+            self.pos_buttons = {0: self.pos_buttons[0]} if 0 in self.pos_buttons else {0: []}
+            self.branch_buttons = {0: []}
+        self.no_branch(tree_height)
+
+    def visible(self, depth):
+        return depth == 0 or self.first_variation <= depth < self.first_variation + self.panes - 1
+
+    def scroller(self, depth):  # the pane that draws a depth of the part tree, created when it is first needed
+        if depth not in self.scrollers:
+            pane = depth - self.first_variation
+            self.scrollers[depth] = ScrollingInterface(self.x + (pane % 2) * self.width,
+                                                       self.y + (pane // 2 + 1) * self.height, self.width,
+                                                       self.height // 2, 4)
+        return self.scrollers[depth]
+
     def no_branch(self, depth):
         self.branch_buttons = {key: value for key, value in self.branch_buttons.items() if key < depth}
         if len(self.branch_buttons.keys()) == 0:
@@ -382,12 +469,17 @@ class VariationsInterface:
             self.pos_buttons[0] = []
 
     def get_branch_buttons(self, win_data, siblings, depth, key):
-        font = pygame.font.SysFont("Futura", win_data.sqr_size // 4)
+        # a position can have any number of alternatives; up to 5 of them are listed, around the one being shown
+        if not self.visible(depth + 1):
+            return
+        font = Button.get_font(win_data.sqr_size // 4)
         self.branch_buttons[depth] = []
+        current = next((index for index, alternative in enumerate(siblings) if alternative.key == key), 0)
+        start = max(0, min(current - 2, len(siblings) - 5))
+        interface = self.scroller(depth + 1)
         y_off = 0
-        for alternative in siblings:
-            btn = ToggleButton(self.scrollers[depth + 1].rect.x,
-                               (self.scrollers[depth + 1].rect.y - win_data.sqr_size * 0.7) + y_off,
+        for alternative in siblings[start:start + 5]:
+            btn = ToggleButton(interface.rect.x, (interface.rect.y - win_data.sqr_size * 0.7) + y_off,
                                "=> " + alternative.move_notation + " ...", font, (0, 0, 0), 8,
                                position_key=alternative.key)
             if alternative.key == key:
@@ -396,6 +488,8 @@ class VariationsInterface:
             y_off += btn.rect.h
 
     def update_scrolling_height(self, depth):
+        if not self.visible(depth):
+            return
         self.scrollers[depth].update_height(self.get_buttons_height(self.pos_buttons[depth]))
 
     @staticmethod
@@ -443,6 +537,9 @@ class ScrollingInterface:  # ScrollingInterface manipulates the offset for the h
 
         return [self.rect, self.adjust(offset)]
 
+    def settling(self):  # whether the next update() scrolls the pane by itself
+        return self.pre_off != 0 or self.max_down
+
     def forward_offset(self, turn):
         if turn == -1 or self.rect.h < self.max_height or self.total - self.min_delta <= -self.scrolling_max:
             return
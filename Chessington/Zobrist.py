@@ -0,0 +1,44 @@
+import random
+
+# Zobrist keys for Chessington's positions, with the same scheme as Enginegton's but values from a fixed seed of their
+# own, so keys are the same in every session; a move updates its parent's key by XORing out what changed
+
+piece_index = {1: 0, 2: 1, 3: 2, 5: 3, 9: 4, 10: 5, -1: 6, -2: 7, -3: 8, -5: 9, -9: 10, -10: 11}  # as fen_read
+
+_rng = random.Random(0x43686573)
+pieces = [[_rng.getrandbits(64) for _ in range(12)] for _ in range(64)]  # [square][piece index]
+castling = [_rng.getrandbits(64) for _ in range(16)]  # [Position.castling_rights]
+en_passant = [_rng.getrandbits(64) for _ in range(8)]  # [file]
+black_to_move = _rng.getrandbits(64)
+
+
+def piece_key(piece, rank, file):
+    return pieces[rank * 8 + file][piece_index[piece]]
+
+
+def en_passant_file(position, move):
+    # the file of a pawn that has just been pushed two squares with an enemy pawn beside it, -1 otherwise;
+    # without a pawn that could capture it, the en passant right does not change the position (for repetitions)
+    if move[0] == -1 or move[1] != move[3] or abs(move[0] - move[2]) != 2:
+        return -1
+    rank, file = move[2], move[3]
+    pawn = position[rank][file]
+    if pawn != 1 and pawn != -1:
+        return -1
+    if (file > 0 and position[rank][file - 1] == -pawn) or (file < 7 and position[rank][file + 1] == -pawn):
+        return file
+    return -1
+
+
+def full_key(position, side_to_move, castle, move):  # the key of a position built from scratch
+    key = castling[castle]
+    for rank in range(8):
+        for file in range(8):
+            if position[rank][file] != 0:
+                key ^= piece_key(position[rank][file], rank, file)
+    if side_to_move == -1:
+        key ^= black_to_move
+    file = en_passant_file(position, move)
+    if file != -1:
+        key ^= en_passant[file]
+    return key
@@ -16,12 +16,12 @@ def main():
             if event.type == pygame.QUIT:
                 chessington.quit_app()
             elif event.type == pygame.VIDEORESIZE:
-                chessington.resize_application(pygame.display.get_surface().get_size()[1])
+                chessington.request_resize(pygame.display.get_surface().get_size()[1])  # applied once it settles
             elif event.type == pygame.MOUSEWHEEL:
                 wheel = event.y
 
         chessington.update_app(wheel)
-        pygame.display.update()
+        pygame.display.update(chessington.window_data.end_frame())  # only the regions repainted in this frame
 
 
 if __name__ == '__main__':
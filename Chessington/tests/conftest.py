@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules import each other by name, as main.py runs them from Chessington/; pygame runs without a display
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+from EngineCache import EngineCache
+from Game import Game
+
+# White to move, free to castle both ways
+position = [[-5, 0, 0, 0, -10, 0, 0, -5], [-1] * 8] + [[0] * 8 for _ in range(4)] \
+           + [[1] * 8, [5, 0, 0, 0, 10, 0, 0, 5]]
+
+
+def test_a_cached_castling_move_is_played_without_a_search(tmp_path):
+    cache = EngineCache(str(tmp_path / "engine_cache.bin"), slots=64)
+    game = Game(pl_colour=-1, side_to_move=1, from_pos=True, engine_on=True, preexisting_tree=None, position=position,
+                move=[-1, -1, -1, -1], move_note="", castle=15, promotion=False, cache=cache)
+    game.get_moves()
+    key = game.current_position.zobrist
+    game.store_result(key, "f/74765\n0.250000 6 1000")  # the engine's short castle, type 5
+
+    answers, requests = [], []
+    enginegton = SimpleNamespace(answer=lambda kind, result, callback: answers.append(result),
+                                 request=lambda message, callback=None: requests.append(message))
+    game.start_engine(enginegton)
+    assert answers == ["f/74760"] and requests == []
+    cache.close()
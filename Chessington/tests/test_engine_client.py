@@ -0,0 +1,44 @@
+import concurrent.futures
+import socket
+import EngineClient
+
+
+class EngineProcess:  # the test plays the engine at the other end of the socket
+    def __init__(self, target, args):
+        host, port = args[0].decode().split(":")
+        self.address = (host, int(port))
+        self.channel = None
+
+    def start(self):
+        self.channel = socket.create_connection(self.address)
+
+    def post(self, message):
+        self.channel.sendall(message.encode() + b"\0")
+
+    def join(self):
+        self.channel.close()
+
+
+def test_a_stopped_search_does_not_answer_the_next_one(monkeypatch):
+    monkeypatch.setattr(EngineClient.multiprocessing, "Process", EngineProcess)
+    client = EngineClient.EngineClient("")
+    engine = client.engine_process
+    engine.post("ok")
+    concurrent.futures.wait([client.startup_request.future], timeout=5)
+    moves = []
+
+    client.request("find\n", lambda result: moves.append(("first", result)))
+    engine.post("ok")
+    stop = client.request("stop\n")
+    second = client.request("find\n", lambda result: moves.append(("second", result)))
+    engine.post("f/64440\n0.300000 6 1000")  # the first search's move, on its way before the stop arrived
+    engine.post("ok")
+    concurrent.futures.wait([stop], timeout=5)
+    assert stop.done() and not second.done()
+
+    engine.post("ok")
+    engine.post("f/16350\n-0.200000 6 1000")
+    assert second.result(timeout=5) == "f/16350\n-0.200000 6 1000"
+    client.dispatch()
+    assert moves == [("second", "f/16350\n-0.200000 6 1000")]
+    engine.join()
@@ -0,0 +1,67 @@
+import os
+import sys
+from types import SimpleNamespace
+import Chessington
+import Session
+from Benchmarks import start_position
+from Board import Board
+from Game import Game
+
+
+class UI:  # the interface is not drawn
+    get_game_UI = None
+
+    def __init__(self, *args, **kwargs):
+        self.sub_interface = None
+
+
+def new_game(engine_on):
+    return Game(pl_colour=1, side_to_move=1, from_pos=False, engine_on=engine_on, preexisting_tree=None,
+                position=start_position, move=[-1, -1, -1, -1], move_note="", castle=15, promotion=False)
+
+
+def play(app, origin, destination):
+    game = app.current_game
+    position = app.board.process_move(app.board.position[origin[0]][origin[1]], origin, destination,
+                                      **game.get_kwargs())
+    game.update(position, app.enginegton)
+    app.journal.flush(game.current_position)
+
+
+def test_analysing_a_finished_game_keeps_the_analysis_session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["main.py"])
+    monkeypatch.setattr(Chessington, "GeneralUI", UI)
+    os.mkdir("assets")
+    app = Chessington.Chessington.__new__(Chessington.Chessington)
+    app.journal = None
+    app.window_data = SimpleNamespace(sqr_size=10)
+    app.enginegton = SimpleNamespace(request=lambda message, callback=None: None)
+    app.board = Board({}, None, {})
+    app.load_all_pieces = lambda: {}
+    app.handle_events = lambda events: None
+
+    # an analysis session, saved on leaving it
+    app.current_game = new_game(False)
+    app.board.set_pos(start_position)
+    app.start_journal(None, False)
+    play(app, (6, 4), (4, 4))
+    analysed = app.current_game.current_position.zobrist
+    app.save_session()
+
+    # a game against the engine, then "Analyse" on its game over screen
+    app.current_game = new_game(True)
+    app.board.set_pos(start_position)
+    app.start_journal(None, False)
+    play(app, (6, 3), (4, 3))
+    app.current_UI = SimpleNamespace(winner=1)
+    app.restart_game(on=False, tree_exists=True)
+    assert app.journal.session_path != Chessington.Chessington.analysis_path()
+    play(app, (1, 3), (3, 3))
+    app.save_session()
+
+    tree, current = Session.open_session(os.path.join("assets", "session.bin"))
+    tree.load_all()
+    assert [child.zobrist for child in tree.root.children] == [analysed]
+    tree.source.close()
+    assert os.listdir("assets") == ["session.bin"]
@@ -0,0 +1,36 @@
+#pragma once
+#include <string>
+#include <mutex>
+#include <cstdint>
+
+////// Chessington-Enginegton transport
+
+	// a local TCP connection to Chessington, which listens on 127.0.0.1 and passes its address ("host:port") to Run()
+	// every message is terminated by a '\0' byte, so multi-line requests and results can be sent as one message
+	// Receive() blocks (optionally with a timeout), so an idle engine does not use any CPU
+
+class Channel
+{
+private:
+
+	std::uintptr_t handle = 0; // SOCKET on Windows, file descriptor elsewhere
+	bool connected = false;
+	std::string buffer; // bytes received but not yet split into messages
+	std::mutex send_mutex; // the search thread and the main engine thread can both post results
+
+	bool PopMessage(std::string& message);
+
+public:
+
+	bool closed = false; // set once Chessington closes the connection
+
+	Channel() = default;
+	~Channel();
+	Channel(const Channel&) = delete;
+	Channel& operator=(const Channel&) = delete;
+
+	bool Connect(const std::string& address);
+	// returns false if no message arrived within timeout_ms (or if the connection was closed); a negative timeout blocks indefinitely
+	bool Receive(std::string& message, int timeout_ms = -1);
+	void Send(const std::string& message);
+};
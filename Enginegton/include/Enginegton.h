@@ -2,6 +2,8 @@
 #include <random>
 #include <thread>
 #include <mutex>
+#include <atomic>
+#include <condition_variable>
 #include <fstream>
 #include <string>
 #include <cstdlib>
@@ -10,15 +12,18 @@
 
 #include "PieceGroup.h"
 #include "EvalTables.h"
+#include "Channel.h"
 
 ////// Chessington-Enginegton communication
 
-	// both processes write to "enginegton_log.txt"
+	// both processes exchange '\0'-terminated messages over a Channel (see Channel.h)
+	// every request is acknowledged with "ok"; "get" is followed by its result ("/..."), "find" by the move ("f/..."), "perft" by its counts ("p/...")
 
 	// 1. "get" - get all legal moves in a given position 
 	// 2. "find" - find a move in a given position 
 	// 3. "stop" - ask the engine to stop searching
 	// 4. "term" - ask the engine process to close 
+	// 5. "perft" - count the leaf nodes of the legal move tree to a given depth, for validating MovesGen() against Chessington 
 
 class Enginegton
 {
@@ -27,37 +32,41 @@ private:
 	std::unordered_map<char, int> fen_read = {
 		{'0', -1}, {'P', 0}, {'p', 6}, {'N', 1}, {'n', 7}, {'B', 2}, {'b', 8}, {'R', 3}, {'r', 9}, {'Q', 4}, {'q', 10}, {'K', 5}, {'k', 11} };
 
-	std::unordered_map<std::string, int> requests = {{"get", 0}, {"find", 1}, {"stop", 2}, {"term", 3}};
+	std::unordered_map<std::string, int> requests = {{"get", 0}, {"find", 1}, {"stop", 2}, {"term", 3}, {"perft", 4}};
 
-	std::string path_to_log;
+	Channel channel;
 	std::string private_log_path; // for logging data on the last search 
 	std::string private_log_board; // store the board for the private log 
 
-	void CheckLog();
-	std::vector<std::string> GetReadOut();
+	std::vector<std::string> read_out; // lines of the last request received 
+
+	bool CheckChannel(int timeout_ms); // sets "request" and "read_out" if a message arrives within timeout_ms 
 	void Post(std::string res);
-	void WaitForEmptyLog();
 	void ParseRequest(std::string& b, std::string& t, std::string& m, std::string& c);
 	void PrivateLog(Move& move, unsigned int table_s, float eval, float nps);
 
-	bool terminate = false;
-	bool stop_search = false; 
-	bool timeout = false; 
+	std::atomic<bool> terminate{ false };
+	std::atomic<bool> stop_search{ false };
+	std::atomic<bool> timeout{ false };
 
 	float max_search_time = 30000.0f;
 
 	std::string request = "";
-	int orientation = 1;
 
-	void SearchThread();
-	bool searching = false;
+	void SearchThread(std::vector<std::string> r_out);
+	void JoinSearch(); // wait for the previous search thread to finish before touching the engine state again 
+	std::thread search_thread;
+	std::mutex search_mutex; // guards search_active and the "ok" that answers "stop" 
+	std::condition_variable search_started; 
+	std::atomic<bool> searching{ false }; // set by FindMove() once the request has been parsed 
+	bool search_active = false; // true from the launch of the search thread until it has posted its final message 
 	
-	void PostMove(Move& move);
-	void Flip(Move& move);
+	void PostMove(Move& move, float eval, int depth);
 
 	////// Main functions to call in response to Chessington requests 
 	void GetMoves(std::vector<std::string>& r_out);
 	void FindMove(std::vector<std::string>& r_out);
+	void RunPerft(std::vector<std::string>& r_out);
 	
 	////// Masks and bitboards 
 	uint64_t origin_masks[64]; 
@@ -112,6 +121,7 @@ private:
 	// helpers 
 	void ProcessMove(const Move& move);
 	void UndoMove(const Move& move);
+	unsigned long long int Perft(int depth); // number of leaf nodes "depth" plies below the current position 
 	int Promote(int in);
 	int Unpromote();
 
@@ -164,6 +174,7 @@ private:
 	inline uint64_t BishopControl(int origin);
 	// Finds the index of the common blocker (a candidate for pin) between a sliding piece and the opposing king; returns -1 if more than one blocker was found 
 	int RayIndex(uint64_t mask, int start); 
+	bool EnPassantExposesKing(int origin, int destination); 
 	// Rook and bishop moves using magics 
 	inline uint64_t RookMoves(int origin, uint64_t own_pieces);
 	inline uint64_t BishopMoves(int origin, uint64_t own_pieces);
@@ -216,7 +227,8 @@ private:
 
 public:
 
-	Enginegton(const char* path, const char* priv_path);
+	Enginegton(const char* address, const char* priv_path);
+	~Enginegton();
 	void Run();
 };
 
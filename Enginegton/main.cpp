@@ -7,8 +7,8 @@
 #ifdef __cplusplus
 extern "C" {
 #endif
-    ENGINEGTON_DLL void Run(const char* path, const char* priv_path) {
-        std::unique_ptr<Enginegton> engine = std::make_unique<Enginegton>(path, priv_path);
+    ENGINEGTON_DLL void Run(const char* address, const char* priv_path) {
+        std::unique_ptr<Enginegton> engine = std::make_unique<Enginegton>(address, priv_path);
         engine->Run();
     }
 
@@ -0,0 +1,115 @@
+#include "pch.h"
+#include "Channel.h"
+
+#ifdef _WIN32
+#include <winsock2.h>
+#include <ws2tcpip.h>
+#pragma comment(lib, "Ws2_32.lib")
+typedef SOCKET socket_t;
+#define CLOSE_SOCKET closesocket
+#else
+#include <sys/socket.h>
+#include <sys/select.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+#include <arpa/inet.h>
+#include <unistd.h>
+typedef int socket_t;
+#define CLOSE_SOCKET close
+#endif
+
+Channel::~Channel() {
+	if (!connected) return;
+	CLOSE_SOCKET((socket_t)handle);
+#ifdef _WIN32
+	WSACleanup();
+#endif
+}
+
+bool Channel::Connect(const std::string& address) {
+
+#ifdef _WIN32
+	WSADATA wsa_data;
+	if (WSAStartup(MAKEWORD(2, 2), &wsa_data) != 0) return false;
+#endif
+
+	size_t sep = address.find(':');
+	if (sep == std::string::npos) return false;
+
+	sockaddr_in addr = {};
+	addr.sin_family = AF_INET;
+	addr.sin_port = htons((unsigned short)std::stoi(address.substr(sep + 1)));
+	inet_pton(AF_INET, address.substr(0, sep).c_str(), &addr.sin_addr);
+
+	socket_t s = socket(AF_INET, SOCK_STREAM, IPPROTO_TCP);
+	if (connect(s, (sockaddr*)&addr, sizeof(addr)) != 0) {
+		CLOSE_SOCKET(s);
+		return false;
+	}
+
+	// requests and results are tiny, so they should not wait for Nagle's algorithm to batch them
+	int no_delay = 1;
+	setsockopt(s, IPPROTO_TCP, TCP_NODELAY, (const char*)&no_delay, sizeof(no_delay));
+
+	handle = (std::uintptr_t)s;
+	connected = true;
+	return true;
+}
+
+bool Channel::PopMessage(std::string& message) {
+	size_t end = buffer.find('\0');
+	if (end == std::string::npos) return false;
+	message = buffer.substr(0, end);
+	buffer.erase(0, end + 1);
+	return true;
+}
+
+bool Channel::Receive(std::string& message, int timeout_ms) {
+
+	if (PopMessage(message)) return true;
+	if (!connected || closed) return false;
+
+	socket_t s = (socket_t)handle;
+	char chunk[4096];
+
+	while (true) {
+
+		if (timeout_ms >= 0) {
+			fd_set read_set;
+			FD_ZERO(&read_set);
+			FD_SET(s, &read_set);
+			timeval tv;
+			tv.tv_sec = timeout_ms / 1000;
+			tv.tv_usec = (timeout_ms % 1000) * 1000;
+			if (select((int)s + 1, &read_set, nullptr, nullptr, &tv) <= 0) return false; // timed out
+		}
+
+		int received = recv(s, chunk, sizeof(chunk), 0);
+		if (received <= 0) {
+			closed = true; // Chessington closed the connection, or it broke
+			return false;
+		}
+		buffer.append(chunk, received);
+		if (PopMessage(message)) return true;
+	}
+}
+
+void Channel::Send(const std::string& message) {
+
+	std::lock_guard<std::mutex> lock(send_mutex);
+	if (!connected || closed) return;
+
+	std::string framed = message;
+	framed += '\0';
+
+	socket_t s = (socket_t)handle;
+	size_t sent = 0;
+	while (sent < framed.size()) {
+		int n = send(s, framed.c_str() + sent, (int)(framed.size() - sent), 0);
+		if (n <= 0) {
+			closed = true;
+			return;
+		}
+		sent += n;
+	}
+}
@@ -1,13 +1,16 @@
 #include "pch.h"
 #include "Enginegton.h"
 
-Enginegton::Enginegton(const char* path, const char* priv_path) : terminate(false) {
+Enginegton::Enginegton(const char* address, const char* priv_path) : terminate(false) {
 
-	std::string p(path);
 	std::string pp(priv_path);
-	path_to_log = p;
 	private_log_path = pp; 
 
+	if (!channel.Connect(std::string(address))) {
+		terminate = true; // Chessington is not listening; there is nobody to serve
+		return;
+	}
+
 	std::mt19937 mt;
 	std::uniform_int_distribution<unsigned long long int> dist(0, UINT64_MAX);
 
@@ -16,7 +19,7 @@ Enginegton::Enginegton(const char* path, const char* priv_path) : terminate(fals
 	for (int i = 0; i < 8; ++i) {
 		for (int j = 0; j < 8; ++j) {
 
-			CheckLog(); // to make it possible to quit Chessington during loading screen 
+			CheckChannel(0); // to make it possible to quit Chessington during loading screen 
 			if (request == "term") {
 				terminate = true; 
 				return;
@@ -69,6 +72,11 @@ Enginegton::Enginegton(const char* path, const char* priv_path) : terminate(fals
 }
 
 
+Enginegton::~Enginegton() {
+	terminate = true;
+	JoinSearch();
+}
+
 void Enginegton::Run() {
 
 	Post("ok"); // notify Chessington that the constructor call has finished, so it can proceed to main menu 
@@ -77,100 +85,110 @@ void Enginegton::Run() {
 
 	while (!terminate) {
 
-		if (std::chrono::duration_cast<std::chrono::milliseconds>(std::chrono::high_resolution_clock::now() - start).count() > max_search_time && timeout == false) 
-			timeout = true;
+		// block until Chessington sends a request; while a search is running, wake up in time to enforce max_search_time 
+		int wait = -1;
+		if (search_active && !timeout) {
+			long long elapsed = std::chrono::duration_cast<std::chrono::milliseconds>(std::chrono::high_resolution_clock::now() - start).count();
+			wait = elapsed >= max_search_time ? 0 : (int)(max_search_time - elapsed);
+		}
 
 		request.clear();
 
-		// peek the file, get Chessington's request, set "request" if it matches one of the 4 main request types 
-		CheckLog();
-		
+		// get Chessington's request, set "request" if it matches one of the 4 main request types 
+		if (!CheckChannel(wait)) {
+			if (channel.closed) terminate = true; // Chessington is gone; stop any search and exit 
+			else if (wait >= 0) timeout = true; 
+			continue;
+		}
+
 		if (request.empty()) continue;
 
 		if (request == "find") {
+			JoinSearch();
 			stop_search = false; 
 			timeout = false; 
 
 			// "stop_search" and "timeout" are modified only in this thread, and read in SearchThread 
-			// "searching" is modified only in SearchThread, and read in this 
-
-			std::thread search_thread(&Enginegton::SearchThread, this);
-			search_thread.detach();
-			while (!searching) { ; } // wait until SearchThread sets "searching" to true
+			// "search_active" is guarded by search_mutex, so that exactly one "ok" answers a "stop" request 
+
+			std::unique_lock<std::mutex> lock(search_mutex);
+			search_active = true;
+			searching = false;
+			search_thread = std::thread(&Enginegton::SearchThread, this, read_out);
+			search_started.wait(lock, [this] { return searching || !search_active; }); // wait until FindMove has parsed the request
+			lock.unlock();
 			start = std::chrono::high_resolution_clock::now();
 			Post("ok"); 
 		}
 		else if (request == "get") {
-			std::vector<std::string> r_out = GetReadOut();
+			JoinSearch();
 			Post("ok"); 
-			GetMoves(r_out);
+			GetMoves(read_out);
+		}
+		else if (request == "perft") {
+			JoinSearch();
+			Post("ok");
+			RunPerft(read_out);
 		}
 		else if (request == "stop") {
-			if (stop_search) Post("ok"); // in case the engine is not working, post straight away 
+			std::lock_guard<std::mutex> lock(search_mutex);
 			stop_search = true; // in case it is working, "ok" will be posted at the end of SearchThread() 
+			if (!search_active) Post("ok"); // in case the engine is not working, post straight away 
 		}
 		else {
-			Post("ok");
 			terminate = true; 
+			JoinSearch();
+			Post("ok");
 		}
 	}
 }
 
-void Enginegton::CheckLog() {
-	std::ifstream log(path_to_log);
-	std::string line;
-	std::getline(log, line);
-	if (requests.count(line) > 0 && !line.empty()) request = line;
-	log.close();
+bool Enginegton::CheckChannel(int timeout_ms) {
+	std::string message;
+	if (!channel.Receive(message, timeout_ms)) return false;
+
+	read_out.clear();
+	size_t begin = 0;
+	while (begin <= message.size()) {
+		size_t end = message.find('\n', begin);
+		if (end == std::string::npos) end = message.size();
+		read_out.push_back(message.substr(begin, end - begin));
+		begin = end + 1;
+	}
+	if (requests.count(read_out[0]) > 0) request = read_out[0];
+	return true;
 }
 
-void Enginegton::SearchThread() {
-	std::vector<std::string> r_out = GetReadOut();
+void Enginegton::SearchThread(std::vector<std::string> r_out) {
 	FindMove(r_out); // starts the recursive search 
+	std::lock_guard<std::mutex> lock(search_mutex);
+	search_active = false;
+	search_started.notify_all();
 	if (stop_search) Post("ok"); 
 }
 
-std::vector<std::string> Enginegton::GetReadOut() {
-	std::vector<std::string> read_out;
-	std::ifstream log(path_to_log);
-	std::string line;
-	while (std::getline(log, line)) read_out.push_back(line);
-	log.close();
-	return read_out;
+void Enginegton::JoinSearch() {
+	if (search_thread.joinable()) search_thread.join();
 }
 
 void Enginegton::Post(std::string res) {
-	std::ofstream log(path_to_log);
-	log << res;
-	log.close();
-}
-
-void Enginegton::WaitForEmptyLog() {
-	while (true) {
-		std::ifstream log(path_to_log);
-		if (log.peek() == std::ifstream::traits_type::eof()) break;
-		log.close();
-	}
-}
-
-// flip the move if Chessington passed in a flipped board 
-void Enginegton::Flip(Move& move) {
-	move.origin = 63 - move.origin;
-	move.destination = 63 - move.destination;
+	channel.Send(res);
 }
 
-void Enginegton::PostMove(Move& move) {
-	WaitForEmptyLog();
-	if (orientation == -1) Flip(move);
+void Enginegton::PostMove(Move& move, float eval, int depth) {
+	// the move, then a line with the evaluation, the depth searched (0 if the search timed out or was not needed) 
+	// and the node count, which Chessington keeps in its result cache 
 	int or_f = move.origin % 8;
 	int des_f = move.destination % 8;
 	Post("f/" + std::to_string((move.origin - or_f) >> 3) + std::to_string(or_f)
-		+ std::to_string((move.destination - des_f) >> 3) + std::to_string(des_f) + std::to_string(move.type));
+		+ std::to_string((move.destination - des_f) >> 3) + std::to_string(des_f) + std::to_string(move.type)
+		+ "\n" + std::to_string(eval) + " " + std::to_string(depth) + " " + std::to_string(total_node_count));
 }
 
 void Enginegton::ParseRequest(std::string& b, std::string& t, std::string& m, std::string& c) {
 
-	// GetReadOut() divides the data in the request to board (b), turn and orientation (t), last move (m), and castling rights (c) information 
+	// CheckChannel() divides the data in the request to board (b), turn (t), last move (m), and castling rights (c) information 
+	// Chessington stores positions with White at the bottom whichever way the user views the board, so requests and results need no flipping 
 
 	// the turn variable is used to denote piece colours - GetPieces(turn) return white_pieces& if turn == 1
 	if (t[0] == '-') turn = -1;
@@ -182,33 +200,16 @@ void Enginegton::ParseRequest(std::string& b, std::string& t, std::string& m, st
 	board_state_bitboard = 0;
 	unsigned long long int hash = 0;
 	// build the board and board_state_bitboard 
-	if (t[1] != '-') {
-		orientation = 1;
-		for (int i = 0; i < 64; ++i) {
-			int to_int = fen_read[b[i]];
-			if (to_int != -1) {
-				board_state_bitboard |= (1ULL << i);
-				hash ^= zob_table[i][to_int];
-			}
-			board.push_back(to_int);
-			private_log_board += b[i];
-			private_log_board += "  ";
-			if ((i + 1) % 8 == 0) private_log_board += "\n";
-		}
-	}
-	else {
-		orientation = -1; // the engine always works from White's perspective and stores the request's orientation in case the output needs to be flipped back
-		for (int i = 63; i >= 0; --i) {
-			int to_int = fen_read[b[i]];
-			if (to_int != -1) {
-				board_state_bitboard |= (1ULL << (63 - i));
-				hash ^= zob_table[i][to_int];
-			}
-			board.push_back(to_int);
-			private_log_board += b[i];
-			private_log_board += "  ";
-			if ((64 - i) % 8 == 0) private_log_board += "\n";
+	for (int i = 0; i < 64; ++i) {
+		int to_int = fen_read[b[i]];
+		if (to_int != -1) {
+			board_state_bitboard |= (1ULL << i);
+			hash ^= zob_table[i][to_int];
 		}
+		board.push_back(to_int);
+		private_log_board += b[i];
+		private_log_board += "  ";
+		if ((i + 1) % 8 == 0) private_log_board += "\n";
 	}
 	
 	// get castling rights 
@@ -231,9 +232,7 @@ void Enginegton::ParseRequest(std::string& b, std::string& t, std::string& m, st
 		return;
 	}
 
-	std::vector<int> move;
-	if (orientation == 1) move = { m[0] - '0', m[1] - '0', m[2] - '0', m[3] - '0' };
-	else move = { 7 - (m[0] - '0'), 7 - (m[1] - '0'), 7 - (m[2] - '0'), 7 - (m[3] - '0') };
+	std::vector<int> move = { m[0] - '0', m[1] - '0', m[2] - '0', m[3] - '0' };
 
 	// if last move was a pawn push, and en passant is legal in the current position, the intiial hash position needs to be updated 
 	if (move[1] == move[3] && abs(move[0] - move[2]) == 2 && (board[move[2] * 8 + move[3]] == 0 || board[move[2] * 8 + move[3]] == 6)) {
@@ -285,7 +284,6 @@ void Enginegton::GetMoves(std::vector<std::string>& r_out) {
 	std::string res = "/";
 	while (q.GetSize() > 0) {
 		Move move = q.Dequeue();
-		if (orientation == -1) Flip(move);
 		int or_f = move.origin % 8;
 		int des_f = move.destination % 8;
 		std::string m = std::to_string((move.origin - or_f) >> 3) + std::to_string(or_f)
@@ -295,7 +293,6 @@ void Enginegton::GetMoves(std::vector<std::string>& r_out) {
 	res += "\n";
 	std::string d = std::to_string(check > 0) + std::to_string(checkmate) + std::to_string(stalemate) + std::to_string(material);
 	res += d;
-	WaitForEmptyLog();
 	Post(res);
 }
 
@@ -321,7 +318,11 @@ void Enginegton::FindMove(std::vector<std::string>& r_out) {
 	if (white_pieces.material + black_pieces.material <= 90 || (white_pieces.material == 0 || black_pieces.material == 0)) max_depth = 8;
 	else max_depth = 6; 
 
-	searching = true; 
+	{
+		std::lock_guard<std::mutex> lock(search_mutex);
+		searching = true; 
+	}
+	search_started.notify_all(); // let Run() acknowledge the request 
 	auto start = std::chrono::high_resolution_clock::now();
 
 	Move move; 
@@ -332,8 +333,7 @@ void Enginegton::FindMove(std::vector<std::string>& r_out) {
 
 	if (q.GetSize() == 1) {
 		move = q.Dequeue();
-		WaitForEmptyLog();
-		PostMove(move);
+		PostMove(move, 0.0f, 0); // the only legal move needs no search; depth 0, so its made-up eval is not cached
 		searching = false;
 		return;
 	}
@@ -390,11 +390,65 @@ void Enginegton::FindMove(std::vector<std::string>& r_out) {
 	if (!stop_search && !terminate) {
 		float secs = std::chrono::duration_cast<std::chrono::milliseconds>(std::chrono::high_resolution_clock::now() - start).count() / 1000.f;
 		PrivateLog(move, table_s, e, total_node_count / secs);
-		WaitForEmptyLog();
-		PostMove(move);
+		PostMove(move, e, timeout ? 0 : max_depth);
+	}
+}
+
+void Enginegton::RunPerft(std::vector<std::string>& r_out) {
+
+	// the request holds the usual position lines, followed by the depth and whether to divide the count by root move 
+	ParseRequest(r_out[1], r_out[2], r_out[3], r_out[4]);
+	int depth = std::stoi(r_out[5]);
+	bool divide = r_out.size() > 6 && r_out[6] == "1";
+
+	capture_log.clear();
+	castle_log.clear();
+	castle_log.push_back(white_pieces.castling_rights);
+	castle_log.push_back(black_pieces.castling_rights);
+
+	auto start = std::chrono::high_resolution_clock::now();
+
+	unsigned long long int nodes = 0;
+	std::string moves = "";
+	if (depth > 0) {
+		MoveQueue q(128);
+		MovesGen(q);
+		while (q.GetSize() > 0) {
+			Move move = q.Dequeue();
+			ProcessMove(move);
+			unsigned long long int count = Perft(depth - 1);
+			UndoMove(move);
+			nodes += count;
+			if (!divide) continue;
+			int or_f = move.origin % 8;
+			int des_f = move.destination % 8;
+			moves += "\n" + std::to_string((move.origin - or_f) >> 3) + std::to_string(or_f)
+				+ std::to_string((move.destination - des_f) >> 3) + std::to_string(des_f) + std::to_string(move.type) + ":" + std::to_string(count);
+		}
 	}
+	else nodes = 1;
+
+	long long ms = std::chrono::duration_cast<std::chrono::milliseconds>(std::chrono::high_resolution_clock::now() - start).count();
+	Post("p/" + std::to_string(nodes) + "\n" + std::to_string(ms) + moves);
 }
 
+unsigned long long int Enginegton::Perft(int depth) {
+
+	if (depth == 0) return 1;
+
+	MoveQueue q(128);
+	MovesGen(q);
+	if (depth == 1) return q.GetSize(); // bulk counting: the leaves do not need to be played 
+
+	unsigned long long int nodes = 0;
+	while (q.GetSize() > 0) {
+		Move move = q.Dequeue();
+		ProcessMove(move);
+		nodes += Perft(depth - 1);
+		UndoMove(move);
+	}
+	return nodes;
+}
 
 float Enginegton::Calculate(int depth, const Move& move, float alpha, float beta) {
 
@@ -771,6 +825,24 @@ int Enginegton::RayIndex(uint64_t mask, int start) {
 	return start; 
 }
 
+bool Enginegton::EnPassantExposesKing(int origin, int destination) {
+	// both pawns leave the rank of the capture, so a rook or queen behind them can reach a king on that rank, which 
+	// the pins found by RookControl() (one piece between the king and the attacker) do not cover 
+	int king_sqr = GetPieces(turn).king_sqr;
+	int rank_start = origin & 56;
+	if ((king_sqr & 56) != rank_start) return false;
+	int captured = destination + 8 * turn;
+	uint64_t occupied = (board_state_bitboard & ~origin_masks[origin] & ~origin_masks[captured]) | origin_masks[destination];
+	int k = ((occupied & rook_masks[king_sqr]) * rook_magics[king_sqr]) >> (64 - rook_index_shifts[king_sqr]);
+	uint64_t control = rook_magic_bitboards[king_sqr][k];
+	for (int sqr = rank_start; sqr < rank_start + 8; ++sqr) {
+		if ((control & origin_masks[sqr]) == 0) continue;
+		int id = GetPieces(-turn).GetPieceID(sqr);
+		if (id == 3 || id == 4 || id == 9 || id == 10) return true;
+	}
+	return false;
+}
+
 uint64_t Enginegton::RookMoves(int origin, uint64_t own_pieces) {
 	int k = ((board_state_bitboard & rook_masks[origin]) * rook_magics[origin]) >> (64 - rook_index_shifts[origin]);
 	return rook_magic_bitboards[origin][k] & ~own_pieces;
@@ -791,7 +863,10 @@ void Enginegton::WhitePawnBitScan(int origin, uint64_t moves, MoveQueue& queue)
 		uint64_t move = moves & origin_masks[pos];
 		if (move == 0) continue; 
 		if (pos >= 8) {
-			if (move == en_passant_mask) type = 7;
+			if (move == en_passant_mask) {
+				if (EnPassantExposesKing(origin, pos)) continue;
+				type = 7;
+			}
 			else type = 0;
 			queue.Enqueue(Move(move | origin_masks[origin], origin, pos, RatePawnMove(pos), type));
 		}
@@ -810,7 +885,10 @@ void Enginegton::BlackPawnBitScan(int origin, uint64_t moves, MoveQueue& queue)
 		uint64_t move = moves & origin_masks[pos];
 		if (move == 0) continue;
 		if (pos <= 55) {
-			if (move == en_passant_mask) type = 8;
+			if (move == en_passant_mask) {
+				if (EnPassantExposesKing(origin, pos)) continue;
+				type = 8;
+			}
 			else type = 0;
 			queue.Enqueue(Move(move | origin_masks[origin], origin, pos, RatePawnMove(pos), type));
 		}
@@ -1032,10 +1110,10 @@ void Enginegton::MovesGen(MoveQueue& queue, bool initial) {
 				break;
 
 			case 11:
-				BlackKingBitScan(origin, (king_control_bitboards[origin] & ~blockers_mask) & ~control, queue, GetPieces(turn).castling_rights, blockers_mask);
+				BlackKingBitScan(origin, (king_control_bitboards[origin] & ~blockers_mask) & ~control, queue, GetPieces(turn).castling_rights, board_state_bitboard);
 				break;
 			case 5:
-				WhiteKingBitScan(origin, (king_control_bitboards[origin] & ~blockers_mask) & ~control, queue, GetPieces(turn).castling_rights, blockers_mask);
+				WhiteKingBitScan(origin, (king_control_bitboards[origin] & ~blockers_mask) & ~control, queue, GetPieces(turn).castling_rights, board_state_bitboard);
 				break;
 
 			case 7:
@@ -1070,7 +1148,7 @@ void Enginegton::MovesGen(MoveQueue& queue, bool initial) {
 
 		if (en_passant_mask != 0) {
 			if ((en_passant_mask == (check_map << 8) && turn == -1) || (en_passant_mask == (check_map >> 8) && turn == 1)) {
-				opp_pieces_mask |= check_map;
+				opp_pieces_mask = check_map | en_passant_mask; // the checking pawn, which can also be taken en passant 
 			}
 			else opp_pieces_mask &= check_map;
 		}
@@ -1338,7 +1416,7 @@ void Enginegton::MovingSide() {
 
 		if (en_passant_mask != 0) {
 			if ((en_passant_mask == (check_map << 8) && turn == -1) || (en_passant_mask == (check_map >> 8) && turn == 1)) {
-				opp_pieces_mask |= check_map;
+				opp_pieces_mask = check_map | en_passant_mask; // the checking pawn, which can also be taken en passant 
 			}
 			else opp_pieces_mask &= check_map;
 		}
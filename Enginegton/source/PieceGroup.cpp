@@ -52,8 +52,9 @@ void PieceGroup::RemovePiece(int square, uint64_t mask) {
 	if (id != 0 && id != 6) piece_material -= material_map[id];
 
 	if ((id == 3 || id == 9) && castling_rights > 0) {
-		if (mask == kingside_rook_mask) castling_rights -= 2;
-		else if (mask == queenside_rook_mask) castling_rights -= 1;
+		// cleared, not subtracted: a rook can leave its corner and return after the right is lost 
+		if (mask == kingside_rook_mask) castling_rights &= ~2;
+		else if (mask == queenside_rook_mask) castling_rights &= ~1;
 	}
 }
 
@@ -76,8 +77,9 @@ void PieceGroup::UpdatePiecePosition(int old_sqr, int new_sqr, uint64_t old_mask
 	map[new_sqr] = id;
 
 	if ((id == 3 || id == 9) && castling_rights > 0) {
-		if (old_mask == kingside_rook_mask) castling_rights -= 2;
-		else if (old_mask == queenside_rook_mask) castling_rights -= 1;
+		// cleared, not subtracted: a rook can leave its corner and return after the right is lost 
+		if (old_mask == kingside_rook_mask) castling_rights &= ~2;
+		else if (old_mask == queenside_rook_mask) castling_rights &= ~1;
 	}
 	if (id == 5 || id == 11) {
 		king_mask = new_mask;